@@ -1,11 +1,13 @@
 # Copyright (c) 2022 Kyle Schouviller (https://github.com/kyle0654)
 
 from logging import Logger
+from typing import Optional
 
 import torch
 
 from invokeai.app.services.object_serializer.object_serializer_disk import ObjectSerializerDisk
 from invokeai.app.services.object_serializer.object_serializer_forward_cache import ObjectSerializerForwardCache
+from invokeai.app.services.shared.sqlite.sqlite_database import SqliteDatabase
 from invokeai.app.services.shared.sqlite.sqlite_util import init_db
 from invokeai.backend.stable_diffusion.diffusion.conditioning_data import ConditioningFieldData
 from invokeai.backend.util.logging import InvokeAILogger
@@ -18,6 +20,7 @@ from ..services.boards.boards_default import BoardService
 from ..services.bulk_download.bulk_download_default import BulkDownloadService
 from ..services.config import InvokeAIAppConfig
 from ..services.download import DownloadQueueService
+from ..services.events.events_base import EventServiceBase
 from ..services.events.events_fastapievents import FastAPIEventService
 from ..services.image_files.image_files_disk import DiskImageFileStorage
 from ..services.image_records.image_records_sqlite import SqliteImageRecordStorage
@@ -30,6 +33,7 @@ from ..services.model_images.model_images_default import ModelImageFileStorageDi
 from ..services.model_manager.model_manager_default import ModelManagerService
 from ..services.model_records import ModelRecordServiceSQL
 from ..services.names.names_default import SimpleNameService
+from ..services.session_processor.session_processor_base import SessionProcessorBase
 from ..services.session_processor.session_processor_default import DefaultSessionProcessor, DefaultSessionRunner
 from ..services.session_queue.session_queue_sqlite import SqliteSessionQueue
 from ..services.urls.urls_default import LocalUrlService
@@ -65,6 +69,44 @@ class ApiDependencies:
         logger.info(f"InvokeAI version {__version__}")
         logger.info(f"Root directory = {str(config.root_path)}")
 
+        events = FastAPIEventService(event_handler_id)
+        session_processor = DefaultSessionProcessor(
+            session_runner=DefaultSessionRunner(),
+            worker_services_factory=ApiDependencies.build_worker_services,
+        )
+        services, db = ApiDependencies._build_services(
+            config=config, events=events, session_processor=session_processor, logger=logger
+        )
+
+        ApiDependencies.invoker = Invoker(services)
+        db.clean()
+
+    @staticmethod
+    def build_worker_services(
+        config: InvokeAIAppConfig, events: EventServiceBase, logger: Logger = logger
+    ) -> InvocationServices:
+        """Build the services for a session worker process.
+
+        The worker shares the database with the main process. It does not run a session processor of its own, and it
+        leaves session queue maintenance to the main process.
+        """
+        services, _ = ApiDependencies._build_services(
+            config=config,
+            events=events,
+            session_processor=None,
+            logger=logger,
+            startup_maintenance=False,
+        )
+        return services
+
+    @staticmethod
+    def _build_services(
+        config: InvokeAIAppConfig,
+        events: EventServiceBase,
+        session_processor: Optional[SessionProcessorBase],
+        logger: Logger,
+        startup_maintenance: bool = True,
+    ) -> tuple[InvocationServices, SqliteDatabase]:
         output_folder = config.outputs_path
         if output_folder is None:
             raise ValueError("Output folder is not set")
@@ -82,7 +124,6 @@ class ApiDependencies:
         board_images = BoardImagesService()
         board_records = SqliteBoardRecordStorage(db=db)
         boards = BoardService()
-        events = FastAPIEventService(event_handler_id)
         bulk_download = BulkDownloadService()
         image_records = SqliteImageRecordStorage(db=db)
         images = ImageService()
@@ -103,8 +144,7 @@ class ApiDependencies:
         )
         names = SimpleNameService()
         performance_statistics = InvocationStatsService()
-        session_processor = DefaultSessionProcessor(session_runner=DefaultSessionRunner())
-        session_queue = SqliteSessionQueue(db=db)
+        session_queue = SqliteSessionQueue(db=db, startup_maintenance=startup_maintenance)
         urls = LocalUrlService()
         workflow_records = SqliteWorkflowRecordsStorage(db=db)
 
@@ -126,16 +166,14 @@ class ApiDependencies:
             download_queue=download_queue_service,
             names=names,
             performance_statistics=performance_statistics,
-            session_processor=session_processor,
+            session_processor=session_processor,  # type: ignore
             session_queue=session_queue,
             urls=urls,
             workflow_records=workflow_records,
             tensors=tensors,
             conditioning=conditioning,
         )
-
-        ApiDependencies.invoker = Invoker(services)
-        db.clean()
+        return services, db
 
     @staticmethod
     def shutdown() -> None:
@@ -27,7 +27,7 @@ from invokeai.backend.stable_diffusion.diffusion.conditioning_data import (
 from invokeai.backend.util.devices import TorchDevice
 
 from .baseinvocation import BaseInvocation, BaseInvocationOutput, invocation, invocation_output
-from .model import CLIPField
+from .model import CLIPField, get_lora_patch_key
 
 # unconditioned: Optional[torch.Tensor]
 
@@ -78,16 +78,18 @@ class CompelInvocation(BaseInvocation):
         # loras = [(context.models.get(**lora.dict(exclude={"weight"})).context.model, lora.weight) for lora in self.clip.loras]
 
         ti_list = generate_ti_list(self.prompt, text_encoder_info.config.base, context)
+        # runtime LoRAs are cheap to apply, so patched copies are not worth their VRAM
+        lora_runtime = context.config.get().lora_patch_mode == "runtime"
 
         with (
             # apply all patches while the model is on the target device
-            text_encoder_info.model_on_device() as (model_state_dict, text_encoder),
+            text_encoder_info.patched_model_on_device(
+                None if lora_runtime else get_lora_patch_key("lora_te_", self.clip.loras),
+                lambda model_state_dict, model: ModelPatcher.apply_lora_text_encoder(
+                    model, loras=_lora_loader(), model_state_dict=model_state_dict, runtime=lora_runtime
+                ),
+            ) as (_, text_encoder),
             tokenizer_info as tokenizer,
-            ModelPatcher.apply_lora_text_encoder(
-                text_encoder,
-                loras=_lora_loader(),
-                model_state_dict=model_state_dict,
-            ),
             # Apply CLIP Skip after LoRA to prevent LoRA application from failing on skipped layers.
             ModelPatcher.apply_clip_skip(text_encoder, self.clip.skipped_layers),
             ModelPatcher.apply_ti(tokenizer, text_encoder, ti_list) as (
@@ -175,17 +177,18 @@ class SDXLPromptInvocationBase:
         # loras = [(context.models.get(**lora.dict(exclude={"weight"})).context.model, lora.weight) for lora in self.clip.loras]
 
         ti_list = generate_ti_list(prompt, text_encoder_info.config.base, context)
+        # runtime LoRAs are cheap to apply, so patched copies are not worth their VRAM
+        lora_runtime = context.config.get().lora_patch_mode == "runtime"
 
         with (
             # apply all patches while the model is on the target device
-            text_encoder_info.model_on_device() as (state_dict, text_encoder),
+            text_encoder_info.patched_model_on_device(
+                None if lora_runtime else get_lora_patch_key(lora_prefix, clip_field.loras),
+                lambda state_dict, model: ModelPatcher.apply_lora(
+                    model, loras=_lora_loader(), prefix=lora_prefix, model_state_dict=state_dict, runtime=lora_runtime
+                ),
+            ) as (_, text_encoder),
             tokenizer_info as tokenizer,
-            ModelPatcher.apply_lora(
-                text_encoder,
-                loras=_lora_loader(),
-                prefix=lora_prefix,
-                model_state_dict=state_dict,
-            ),
             # Apply CLIP Skip after LoRA to prevent LoRA application from failing on skipped layers.
             ModelPatcher.apply_clip_skip(text_encoder, clip_field.skipped_layers),
             ModelPatcher.apply_ti(tokenizer, text_encoder, ti_list) as (
@@ -1,7 +1,8 @@
 # Copyright (c) 2023 Kyle Schouviller (https://github.com/kyle0654)
 import inspect
 from contextlib import ExitStack
-from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+from dataclasses import dataclass, replace
+from typing import Any, Callable, ContextManager, Dict, Hashable, Iterator, List, Optional, Tuple, Union
 
 import torch
 import torchvision
@@ -29,9 +30,10 @@ from invokeai.app.invocations.fields import (
     UIType,
 )
 from invokeai.app.invocations.ip_adapter import IPAdapterField
-from invokeai.app.invocations.model import ModelIdentifierField, UNetField
+from invokeai.app.invocations.model import ModelIdentifierField, UNetField, get_lora_patch_key
 from invokeai.app.invocations.primitives import LatentsOutput
 from invokeai.app.invocations.t2i_adapter import T2IAdapterField
+from invokeai.app.services.session_processor.session_processor_common import CanceledException
 from invokeai.app.services.shared.invocation_context import InvocationContext
 from invokeai.app.util.controlnet_utils import prepare_control_image
 from invokeai.backend.ip_adapter.ip_adapter import IPAdapter
@@ -44,6 +46,7 @@ from invokeai.backend.stable_diffusion.diffusers_pipeline import (
     StableDiffusionGeneratorPipeline,
     T2IAdapterData,
 )
+from invokeai.backend.stable_diffusion.denoise_coalescer import DenoiseCoalescer
 from invokeai.backend.stable_diffusion.diffusion.conditioning_data import (
     BasicConditioningInfo,
     IPAdapterConditioningInfo,
@@ -53,11 +56,32 @@ from invokeai.backend.stable_diffusion.diffusion.conditioning_data import (
     TextConditioningData,
     TextConditioningRegions,
 )
+from invokeai.backend.stable_diffusion.diffusion.conditioning_plan import ConditioningPlan
 from invokeai.backend.stable_diffusion.schedulers import SCHEDULER_MAP
 from invokeai.backend.util.devices import TorchDevice
 from invokeai.backend.util.mask import to_standard_float_mask
 from invokeai.backend.util.silence_warnings import SilenceWarnings
 
+# Schedulers that do not draw random noise while stepping. Only these are batched with the denoising of other sessions,
+# since a batch shares one scheduler, and so one random generator.
+BATCHABLE_SCHEDULERS = {
+    "ddim",
+    "deis",
+    "lms",
+    "lms_k",
+    "pndm",
+    "heun",
+    "heun_k",
+    "euler",
+    "euler_k",
+    "kdpm_2",
+    "dpmpp_2s",
+    "dpmpp_2s_k",
+    "dpmpp_2m",
+    "dpmpp_2m_k",
+    "unipc",
+}
+
 
 def get_scheduler(
     context: InvocationContext,
@@ -91,12 +115,23 @@ def get_scheduler(
     return scheduler
 
 
+@dataclass
+class DenoiseRequest:
+    """The inputs of a denoise invocation whose denoising is batched with that of other sessions."""
+
+    invocation: "DenoiseLatentsInvocation"
+    context: InvocationContext
+    latents: torch.Tensor
+    noise: Optional[torch.Tensor]
+    seed: int
+
+
 @invocation(
     "denoise_latents",
     title="Denoise Latents",
     tags=["latents", "denoise", "txt2img", "t2i", "t2l", "img2img", "i2i", "l2l"],
     category="latents",
-    version="1.5.3",
+    version="1.5.5",
 )
 class DenoiseLatentsInvocation(BaseInvocation):
     """Denoises noisy latents to decodable images"""
@@ -157,6 +192,19 @@ class DenoiseLatentsInvocation(BaseInvocation):
     cfg_rescale_multiplier: float = InputField(
         title="CFG Rescale Multiplier", default=0, ge=0, lt=1, description=FieldDescriptions.cfg_rescale_multiplier
     )
+    cfg_truncate_after: float = InputField(
+        title="CFG Truncate After", default=1.0, ge=0, le=1, description=FieldDescriptions.cfg_truncate_after
+    )
+    cfg_truncate_similarity: Optional[float] = InputField(
+        title="CFG Truncate Similarity",
+        default=None,
+        ge=0,
+        le=1,
+        description=FieldDescriptions.cfg_truncate_similarity,
+    )
+    feature_reuse_interval: int = InputField(
+        title="Feature Reuse Interval", default=1, ge=1, description=FieldDescriptions.feature_reuse_interval
+    )
     latents: Optional[LatentsField] = InputField(
         default=None,
         description=FieldDescriptions.latents,
@@ -308,7 +356,9 @@ class DenoiseLatentsInvocation(BaseInvocation):
         unet: UNet2DConditionModel,
         latent_height: int,
         latent_width: int,
+        ip_adapter_data: Optional[List[IPAdapterData]] = None,
     ) -> TextConditioningData:
+        """Prepare the text conditioning of the denoising run, and the plan of its step-invariant UNet inputs."""
         # Normalize self.positive_conditioning and self.negative_conditioning to lists.
         cond_list = self.positive_conditioning
         if not isinstance(cond_list, list):
@@ -351,6 +401,16 @@ class DenoiseLatentsInvocation(BaseInvocation):
             cond_regions=cond_regions,
             guidance_scale=self.cfg_scale,
             guidance_rescale_multiplier=self.cfg_rescale_multiplier,
+            guidance_truncate_after=self.cfg_truncate_after,
+            guidance_truncate_similarity=self.cfg_truncate_similarity,
+        )
+        conditioning_data.plan = ConditioningPlan(
+            conditioning_data,
+            ip_adapter_data,
+            latent_height=latent_height,
+            latent_width=latent_width,
+            device=unet.device,
+            dtype=unet.dtype,
         )
         return conditioning_data
 
@@ -684,6 +744,15 @@ class DenoiseLatentsInvocation(BaseInvocation):
 
         mask, masked_latents, gradient_mask = self.prep_inpaint_mask(context, latents)
 
+        # If this session runs side by side with others, batch the denoising with theirs if possible
+        coalescer = DenoiseCoalescer.current()
+        batch_key = self.get_batch_key(context, latents, noise, mask) if coalescer is not None else None
+        if coalescer is not None and batch_key is not None:
+            request = DenoiseRequest(invocation=self, context=context, latents=latents, noise=noise, seed=seed)
+            result_latents = coalescer.run(batch_key, request, self.denoise_batch)
+            name = context.tensors.save(tensor=result_latents)
+            return LatentsOutput.build(latents_name=name, latents=result_latents, seed=None)
+
         # TODO(ryand): I have hard-coded `do_classifier_free_guidance=True` to mirror the behaviour of ControlNets,
         # below. Investigate whether this is appropriate.
         t2i_adapter_data = self.run_t2i_adapters(
@@ -713,26 +782,13 @@ class DenoiseLatentsInvocation(BaseInvocation):
         def step_callback(state: PipelineIntermediateState) -> None:
             context.util.sd_step_callback(state, unet_config.base)
 
-        def _lora_loader() -> Iterator[Tuple[LoRAModelRaw, float]]:
-            for lora in self.unet.loras:
-                lora_info = context.models.load(lora.lora)
-                assert isinstance(lora_info.model, LoRAModelRaw)
-                yield (lora_info.model, lora.weight)
-                del lora_info
-            return
-
         unet_info = context.models.load(self.unet.unet)
         with (
             ExitStack() as exit_stack,
-            unet_info.model_on_device() as (model_state_dict, unet),
+            # Apply the LoRA after unet has been moved to its target device for faster patching.
+            unet_info.patched_model_on_device(*self._lora_patch(context)) as (_, unet),
             ModelPatcher.apply_freeu(unet, self.unet.freeu_config),
             set_seamless(unet, self.unet.seamless_axes),  # FIXME
-            # Apply the LoRA after unet has been moved to its target device for faster patching.
-            ModelPatcher.apply_lora_unet(
-                unet,
-                loras=_lora_loader(),
-                model_state_dict=model_state_dict,
-            ),
         ):
             assert isinstance(unet, UNet2DConditionModel)
             latents = latents.to(device=unet.device, dtype=unet.dtype)
@@ -753,8 +809,22 @@ class DenoiseLatentsInvocation(BaseInvocation):
             pipeline = self.create_pipeline(unet, scheduler)
 
             _, _, latent_height, latent_width = latents.shape
+            ip_adapter_data = self.prep_ip_adapter_data(
+                context=context,
+                ip_adapters=ip_adapters,
+                image_prompts=image_prompts,
+                exit_stack=exit_stack,
+                latent_height=latent_height,
+                latent_width=latent_width,
+                dtype=unet.dtype,
+            )
+
             conditioning_data = self.get_conditioning_data(
-                context=context, unet=unet, latent_height=latent_height, latent_width=latent_width
+                context=context,
+                unet=unet,
+                latent_height=latent_height,
+                latent_width=latent_width,
+                ip_adapter_data=ip_adapter_data,
             )
 
             controlnet_data = self.prep_control_data(
@@ -766,16 +836,6 @@ class DenoiseLatentsInvocation(BaseInvocation):
                 exit_stack=exit_stack,
             )
 
-            ip_adapter_data = self.prep_ip_adapter_data(
-                context=context,
-                ip_adapters=ip_adapters,
-                image_prompts=image_prompts,
-                exit_stack=exit_stack,
-                latent_height=latent_height,
-                latent_width=latent_width,
-                dtype=unet.dtype,
-            )
-
             num_inference_steps, timesteps, init_timestep, scheduler_step_kwargs = self.init_scheduler(
                 scheduler,
                 device=unet.device,
@@ -801,7 +861,10 @@ class DenoiseLatentsInvocation(BaseInvocation):
                 ip_adapter_data=ip_adapter_data,
                 t2i_adapter_data=t2i_adapter_data,
                 callback=step_callback,
+                feature_reuse_interval=self.feature_reuse_interval,
             )
+            diffuser = pipeline.invokeai_diffuser
+            context.util.record_unet_passes(diffuser.unet_passes, diffuser.skipped_unet_passes)
 
         # https://discuss.huggingface.co/t/memory-usage-by-later-pipeline-stages/23699
         result_latents = result_latents.to("cpu")
@@ -809,3 +872,180 @@ class DenoiseLatentsInvocation(BaseInvocation):
 
         name = context.tensors.save(tensor=result_latents)
         return LatentsOutput.build(latents_name=name, latents=result_latents, seed=None)
+
+    def _lora_loader(self, context: InvocationContext) -> Iterator[Tuple[LoRAModelRaw, float]]:
+        for lora in self.unet.loras:
+            lora_info = context.models.load(lora.lora)
+            assert isinstance(lora_info.model, LoRAModelRaw)
+            yield (lora_info.model, lora.weight)
+            del lora_info
+        return
+
+    def _lora_patch(
+        self, context: InvocationContext
+    ) -> Tuple[
+        Optional[Hashable], Callable[[Optional[Dict[str, torch.Tensor]], UNet2DConditionModel], ContextManager[None]]
+    ]:
+        """Return the patch key and patch function that apply the UNet's LoRAs, for `patched_model_on_device()`."""
+        runtime = context.config.get().lora_patch_mode == "runtime"
+
+        def patch(
+            model_state_dict: Optional[Dict[str, torch.Tensor]], unet: UNet2DConditionModel
+        ) -> ContextManager[None]:
+            return ModelPatcher.apply_lora_unet(
+                unet, loras=self._lora_loader(context), model_state_dict=model_state_dict, runtime=runtime
+            )
+
+        # runtime LoRAs are cheap to apply, so patched copies are not worth their VRAM
+        return (None if runtime else get_lora_patch_key("lora_unet_", self.unet.loras), patch)
+
+    def get_batch_key(
+        self,
+        context: InvocationContext,
+        latents: torch.Tensor,
+        noise: Optional[torch.Tensor],
+        mask: Optional[torch.Tensor],
+    ) -> Optional[Hashable]:
+        """Return a key under which this invocation's denoising may be batched with that of other sessions.
+
+        Invocations with equal keys use the same models, scheduler, steps, guidance and resolution, and differ only in
+        their seeds, prompts and input latents. Returns None if this invocation cannot be batched, because it uses
+        inpainting, control, adapters, regional prompts or a stochastic scheduler, or denoises more than one latent.
+        Guidance truncation by similarity is not batched either, since it looks at all of the latents of the batch.
+        """
+        if mask is not None or self.control or self.ip_adapter or self.t2i_adapter:
+            return None
+        # the denoised batch is split into one latent per request
+        if latents.shape[0] != 1:
+            return None
+        if self.cfg_truncate_similarity is not None:
+            return None
+        if self.scheduler not in BATCHABLE_SCHEDULERS:
+            return None
+
+        conditionings: List[ConditioningField] = []
+        for c in [self.positive_conditioning, self.negative_conditioning]:
+            if isinstance(c, list):
+                if len(c) != 1:
+                    return None
+                c = c[0]
+            if c.mask is not None:
+                return None
+            conditionings.append(c)
+        embeds_shapes = tuple(
+            tuple(context.conditioning.load(c.conditioning_name).conditionings[0].embeds.shape) for c in conditionings
+        )
+
+        return (
+            self.unet.model_dump_json(),
+            self.scheduler,
+            self.steps,
+            tuple(self.cfg_scale) if isinstance(self.cfg_scale, list) else self.cfg_scale,
+            self.cfg_rescale_multiplier,
+            self.cfg_truncate_after,
+            self.feature_reuse_interval,
+            self.denoising_start,
+            self.denoising_end,
+            tuple(latents.shape),
+            noise is not None,
+            embeds_shapes,
+        )
+
+    def denoise_batch(self, requests: List[DenoiseRequest]) -> List[Union[torch.Tensor, BaseException]]:
+        """Denoise the latents of several invocations with equal batch keys (see `get_batch_key()`) as one batch.
+
+        Returns the denoised latents of each request, in order, or the CanceledException of requests whose session
+        was canceled while denoising.
+        """
+        context = requests[0].context
+        unet_config = context.models.get_config(self.unet.unet.key)
+        canceled: List[Optional[CanceledException]] = [None] * len(requests)
+
+        def step_callback(state: PipelineIntermediateState) -> None:
+            for i, request in enumerate(requests):
+                if canceled[i] is not None:
+                    continue
+                predicted_original = state.predicted_original
+                request_state = replace(
+                    state,
+                    latents=state.latents[i : i + 1],
+                    predicted_original=predicted_original[i : i + 1] if predicted_original is not None else None,
+                )
+                try:
+                    request.context.util.sd_step_callback(request_state, unet_config.base)
+                except CanceledException as e:
+                    canceled[i] = e
+            if all(canceled):
+                raise CanceledException
+
+        unet_info = context.models.load(self.unet.unet)
+        with (
+            unet_info.patched_model_on_device(*self._lora_patch(context)) as (_, unet),
+            ModelPatcher.apply_freeu(unet, self.unet.freeu_config),
+            set_seamless(unet, self.unet.seamless_axes),
+        ):
+            assert isinstance(unet, UNet2DConditionModel)
+            latents = torch.cat([r.latents for r in requests]).to(device=unet.device, dtype=unet.dtype)
+            noise = None
+            if requests[0].noise is not None:
+                noise = torch.cat([r.noise for r in requests if r.noise is not None])
+                noise = noise.to(device=unet.device, dtype=unet.dtype)
+
+            # Batched schedulers do not draw random noise, so the seed of the first request stands for all of them
+            seed = requests[0].seed
+            scheduler = get_scheduler(
+                context=context,
+                scheduler_info=self.unet.scheduler,
+                scheduler_name=self.scheduler,
+                seed=seed,
+            )
+            pipeline = self.create_pipeline(unet, scheduler)
+
+            _, _, latent_height, latent_width = latents.shape
+            conditioning_data = TextConditioningData.stack(
+                [
+                    r.invocation.get_conditioning_data(
+                        context=r.context, unet=unet, latent_height=latent_height, latent_width=latent_width
+                    )
+                    for r in requests
+                ]
+            )
+            conditioning_data.plan = ConditioningPlan(
+                conditioning_data,
+                None,
+                latent_height=latent_height,
+                latent_width=latent_width,
+                device=unet.device,
+                dtype=unet.dtype,
+            )
+
+            num_inference_steps, timesteps, init_timestep, scheduler_step_kwargs = self.init_scheduler(
+                scheduler,
+                device=unet.device,
+                steps=self.steps,
+                denoising_start=self.denoising_start,
+                denoising_end=self.denoising_end,
+                seed=seed,
+            )
+
+            result_latents = pipeline.latents_from_embeddings(
+                latents=latents,
+                timesteps=timesteps,
+                init_timestep=init_timestep,
+                noise=noise,
+                seed=seed,
+                num_inference_steps=num_inference_steps,
+                scheduler_step_kwargs=scheduler_step_kwargs,
+                conditioning_data=conditioning_data,
+                callback=step_callback,
+                feature_reuse_interval=self.feature_reuse_interval,
+            )
+            diffuser = pipeline.invokeai_diffuser
+            # the passes are counted per guidance branch and step, which the requests of the batch all share
+            for request in requests:
+                request.context.util.record_unet_passes(diffuser.unet_passes, diffuser.skipped_unet_passes)
+
+        result_latents = result_latents.to("cpu")
+        TorchDevice.empty_cache()
+
+        return [canceled[i] or result_latents[i : i + 1] for i in range(len(requests))]
@@ -119,6 +119,9 @@ class FieldDescriptions:
     denoising_end = "When to stop denoising, expressed a percentage of total steps"
     cfg_scale = "Classifier-Free Guidance scale"
     cfg_rescale_multiplier = "Rescale multiplier for CFG guidance, used for models trained with zero-terminal SNR"
+    cfg_truncate_after = "Skip the unconditioned (negative prompt) pass after this fraction of the steps, to speed up the last steps"
+    feature_reuse_interval = "Run the deep blocks of the UNet only every this many steps, and reuse their features at the other steps. Higher values are faster, for previews and drafts, at a cost in quality. 1 runs the full UNet at every step"
+    cfg_truncate_similarity = "Skip the unconditioned (negative prompt) pass for the remaining steps once the cosine similarity of the conditioned and unconditioned predictions reaches this value. Off if unset"
     scheduler = "Scheduler to use during inference"
     positive_cond = "Positive conditioning tensor"
     negative_cond = "Negative conditioning tensor"
@@ -1,5 +1,5 @@
 import copy
-from typing import List, Optional
+from typing import Hashable, List, Optional
 
 from pydantic import BaseModel, Field
 
@@ -46,6 +46,14 @@ class LoRAField(BaseModel):
     weight: float = Field(description="Weight to apply to lora model")
 
 
+def get_lora_patch_key(prefix: str, loras: List[LoRAField]) -> Optional[Hashable]:
+    """Return a key identifying the patches that applying `loras` with `prefix` makes to a model, or None if there are
+    no LoRAs. The order of the LoRAs does not matter, since their deltas are summed."""
+    if not loras:
+        return None
+    return (prefix, tuple(sorted((lora.lora.key, lora.weight) for lora in loras)))
+
+
 class UNetField(BaseModel):
     unet: ModelIdentifierField = Field(description="Info to load unet submodel")
     scheduler: ModelIdentifierField = Field(description="Info to load scheduler submodel")
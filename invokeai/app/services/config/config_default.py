@@ -32,6 +32,11 @@ ATTENTION_TYPE = Literal["auto", "normal", "xformers", "sliced", "torch-sdp"]
 ATTENTION_SLICE_SIZE = Literal["auto", "balanced", "max", 1, 2, 3, 4, 5, 6, 7, 8]
 LOG_FORMAT = Literal["plain", "color", "syslog", "legacy"]
 LOG_LEVEL = Literal["debug", "info", "warning", "error", "critical"]
+SESSION_WORKER_MODE = Literal["thread", "process"]
+CACHE_EVICTION_POLICY = Literal["lru", "gdsf", "pin_until_idle"]
+LORA_PATCH_MODE = Literal["merge", "runtime"]
+CACHE_QUANTIZATION = Literal["int8", "fp8"]
+UNET_COMPILE_MODE = Literal["off", "default", "reduce-overhead", "max-autotune"]
 CONFIG_SCHEMA_VERSION = "4.0.2"
 
 
@@ -101,20 +106,35 @@ class InvokeAIAppConfig(BaseSettings):
         profile_prefix: An optional prefix for profile output files.
         profiles_dir: Path to profiles output directory.
         ram: Maximum memory amount used by memory model cache for rapid switching (GB).
-        vram: Amount of VRAM reserved for model storage (GB).
+        vram: Amount of VRAM reserved for model storage on each execution device (GB).
+        pinned_ram: Amount of the model cache to keep in pinned (page-locked) memory, for faster uploads of models to CUDA devices (GB). Not used on hosts without CUDA.
+        patched_vram: Amount of VRAM on each execution device used to keep copies of models with LoRAs applied, so that later sessions using the same models and LoRAs skip patching (GB). Set to 0 to disable.
+        mmap_safetensors: Memory-map the weights of models stored in safetensors files instead of copying them into the model cache. Mapped weights are shared through the OS page cache with other processes on the host, are read from disk only when used, and do not count against the `ram` limit.
+        prefetch_depth: Number of pending queue items whose models are loaded into the model cache ahead of time, while earlier sessions run. Models are only prefetched into free space in the cache. Set to 0 to disable prefetching.
+        cache_eviction_policy: Policy that chooses which models to evict when the model cache is full. `lru` evicts the least recently used models, `gdsf` evicts models that are used rarely relative to their size, and `pin_until_idle` is `lru` but never evicts models that are in use.<br>Valid values: `lru`, `gdsf`, `pin_until_idle`
+        cache_quantization: When the model cache is full, quantize the weights of the models that would be evicted to this 8-bit type, with a scale per output channel, instead of evicting them. Quantized models take about half the room of fp16 models and are dequantized when moved to an execution device, at a small cost in quality. Models are evicted once they are quantized. Quantization is off if unset.<br>Valid values: `int8`, `fp8`
         convert_cache: Maximum size of on-disk converted models cache (GB).
         lazy_offload: Keep models in VRAM until their space is needed.
         log_memory_usage: If True, a memory snapshot will be captured before and after every model cache operation, and the result will be logged (at debug level). There is a time cost to capturing the memory snapshots, so it is recommended to only enable this feature if you are actively inspecting the model cache's behaviour.
         device: Preferred execution device. `auto` will choose the device depending on the hardware platform and the installed torch capabilities.<br>Valid values: `auto`, `cpu`, `cuda:0`, `cuda:1`, `cuda:2`, `cuda:3`, `cuda:4`, `cuda:5`, `cuda:6`, `cuda:7`, `mps`
         devices: List of execution devices; will override default device selected.
+        device_error_threshold: Number of consecutive CUDA errors after which an execution device is quarantined, and its sessions re-queued to run on the other devices. Out-of-memory errors are not counted, since they usually come from jobs too large for the device. The last device in service is never quarantined. Set to 0 to never quarantine devices.
+        device_quarantine_cooldown: How long a quarantined execution device stays out of service, in seconds. It is then probed, and returned to service if it responds.
+        device_poll_interval: How often to poll the memory of the execution devices, in seconds. A device that fails to respond counts as an error against it. Devices are not polled if unset.
         precision: Floating point precision. `float16` will consume half the memory of `float32` but produce slightly lower-quality images. The `auto` setting will guess the proper precision based on your video card and operating system.<br>Valid values: `auto`, `float16`, `bfloat16`, `float32`, `autocast`
         sequential_guidance: Whether to calculate guidance in serial instead of in parallel, lowering memory requirements.
         attention_type: Attention type.<br>Valid values: `auto`, `normal`, `xformers`, `sliced`, `torch-sdp`
         attention_slice_size: Slice size, valid when attention_type=="sliced".<br>Valid values: `auto`, `balanced`, `max`, `1`, `2`, `3`, `4`, `5`, `6`, `7`, `8`
         force_tiled_decode: Whether to enable tiled VAE decode (reduces memory consumption with some performance penalty).
+        lora_patch_mode: How LoRAs are applied to models. `merge` adds each LoRA's full-size weight delta to the patched weights. `runtime` adds the outputs of LoRA and LoCon layers to the patched modules' outputs while the model runs, which lowers peak VRAM and patching time when many LoRAs are stacked, at a small cost per step. Other LoRA types are always merged.<br>Valid values: `merge`, `runtime`
+        unet_compile_mode: Compile the UNet with `torch.compile` to speed up its denoising steps. `default` compiles it, `reduce-overhead` also captures it as CUDA graphs and `max-autotune` tunes its kernels for longer. The UNet is compiled once per model, device and latent size, which takes a while, and the compiled UNet is reused by later sessions. Regional prompts, IP-Adapters, token merging and runtime LoRAs run uncompiled. Only applies to CPU and CUDA devices.<br>Valid values: `off`, `default`, `reduce-overhead`, `max-autotune`
+        token_merging_ratios: Merge similar spatial tokens before the self-attention layers of the UNet, and unmerge them after, to speed up high-resolution generations at a small cost in detail. Each ratio is the fraction of the tokens merged at a resolution level of the UNet, from the highest resolution down, e.g. `[0.5]` merges half of the tokens at the highest resolution only. Ratios must be below 1, and at most three quarters of the tokens are merged. Disabled if unset.
         pil_compress_level: The compress_level setting of PIL.Image.save(), used for PNG encoding. All settings are lossless. 0 = no compression, 1 = fastest with slightly larger filesize, 9 = slowest with smallest filesize. 1 is typically the best setting.
         max_queue_size: Maximum number of items in the session queue.
         max_threads: Maximum number of session queue execution threads. Autocalculated from number of GPUs if not set.
+        session_worker_mode: Run sessions in worker threads of the main process, or in one worker process per execution device. Process mode requires an on-disk database. The worker processes share the `ram` cache budget equally. Devices are not quarantined in process mode.<br>Valid values: `thread`, `process`
+        parallel_nodes: Run independent nodes of a session at the same time, each on its own execution device. Lets a single session that fans out over tiles or seeds use all the GPUs.
+        max_denoise_batch: Maximum number of queue items of the same batch to run side by side on an execution device, denoising them as a single UNet batch when they use the same models, scheduler, steps and resolution. Only applies to worker threads, when `parallel_nodes` is off.
         clear_queue_on_startup: Empties session queue on startup.
         allow_nodes: List of nodes to allow. Omit to allow all.
         deny_nodes: List of nodes to deny. Omit to deny none.
@@ -173,7 +193,13 @@ class InvokeAIAppConfig(BaseSettings):
 
     # CACHE
     ram:                          float = Field(default_factory=get_default_ram_cache_size, gt=0, description="Maximum memory amount used by memory model cache for rapid switching (GB).")
-    vram:                         float = Field(default=DEFAULT_VRAM_CACHE, ge=0, description="Amount of VRAM reserved for model storage (GB).")
+    vram:                         float = Field(default=DEFAULT_VRAM_CACHE, ge=0, description="Amount of VRAM reserved for model storage on each execution device (GB).")
+    pinned_ram:                   float = Field(default=0.0, ge=0,          description="Amount of the model cache to keep in pinned (page-locked) memory, for faster uploads of models to CUDA devices (GB). Not used on hosts without CUDA.")
+    patched_vram:                 float = Field(default=0.0, ge=0,          description="Amount of VRAM on each execution device used to keep copies of models with LoRAs applied, so that later sessions using the same models and LoRAs skip patching (GB). Set to 0 to disable.")
+    mmap_safetensors:              bool = Field(default=False,              description="Memory-map the weights of models stored in safetensors files instead of copying them into the model cache. Mapped weights are shared through the OS page cache with other processes on the host, are read from disk only when used, and do not count against the `ram` limit.")
+    prefetch_depth:                 int = Field(default=0, ge=0,            description="Number of pending queue items whose models are loaded into the model cache ahead of time, while earlier sessions run. Models are only prefetched into free space in the cache. Set to 0 to disable prefetching.")
+    cache_eviction_policy: CACHE_EVICTION_POLICY = Field(default="lru",     description="Policy that chooses which models to evict when the model cache is full. `lru` evicts the least recently used models, `gdsf` evicts models that are used rarely relative to their size, and `pin_until_idle` is `lru` but never evicts models that are in use.")
+    cache_quantization: Optional[CACHE_QUANTIZATION] = Field(default=None, description="When the model cache is full, quantize the weights of the models that would be evicted to this 8-bit type, with a scale per output channel, instead of evicting them. Quantized models take about half the room of fp16 models and are dequantized when moved to an execution device, at a small cost in quality. Models are evicted once they are quantized. Quantization is off if unset.")
     convert_cache:                float = Field(default=DEFAULT_CONVERT_CACHE, ge=0, description="Maximum size of on-disk converted models cache (GB).")
     lazy_offload:                  bool = Field(default=True,               description="Keep models in VRAM until their space is needed.")
     log_memory_usage:              bool = Field(default=False,              description="If True, a memory snapshot will be captured before and after every model cache operation, and the result will be logged (at debug level). There is a time cost to capturing the memory snapshots, so it is recommended to only enable this feature if you are actively inspecting the model cache's behaviour.")
@@ -181,6 +207,9 @@ class InvokeAIAppConfig(BaseSettings):
     # DEVICE
     device:                      DEVICE = Field(default="auto",             description="Preferred execution device. `auto` will choose the device depending on the hardware platform and the installed torch capabilities.")
     devices:      Optional[list[DEVICE]] = Field(default=None,              description="List of execution devices; will override default device selected.")
+    device_error_threshold:         int = Field(default=3, ge=0,            description="Number of consecutive CUDA errors after which an execution device is quarantined, and its sessions re-queued to run on the other devices. Out-of-memory errors are not counted, since they usually come from jobs too large for the device. The last device in service is never quarantined. Set to 0 to never quarantine devices.")
+    device_quarantine_cooldown:   float = Field(default=600.0, gt=0,        description="How long a quarantined execution device stays out of service, in seconds. It is then probed, and returned to service if it responds.")
+    device_poll_interval: Optional[float] = Field(default=None, gt=0,       description="How often to poll the memory of the execution devices, in seconds. A device that fails to respond counts as an error against it. Devices are not polled if unset.")
     precision:                PRECISION = Field(default="auto",             description="Floating point precision. `float16` will consume half the memory of `float32` but produce slightly lower-quality images. The `auto` setting will guess the proper precision based on your video card and operating system.")
 
     # GENERATION
@@ -188,9 +217,15 @@ class InvokeAIAppConfig(BaseSettings):
     attention_type:      ATTENTION_TYPE = Field(default="auto",             description="Attention type.")
     attention_slice_size: ATTENTION_SLICE_SIZE = Field(default="auto",      description='Slice size, valid when attention_type=="sliced".')
     force_tiled_decode:            bool = Field(default=False,              description="Whether to enable tiled VAE decode (reduces memory consumption with some performance penalty).")
+    lora_patch_mode:    LORA_PATCH_MODE = Field(default="merge",            description="How LoRAs are applied to models. `merge` adds each LoRA's full-size weight delta to the patched weights. `runtime` adds the outputs of LoRA and LoCon layers to the patched modules' outputs while the model runs, which lowers peak VRAM and patching time when many LoRAs are stacked, at a small cost per step. Other LoRA types are always merged.")
+    unet_compile_mode: UNET_COMPILE_MODE = Field(default="off",             description="Compile the UNet with `torch.compile` to speed up its denoising steps. `default` compiles it, `reduce-overhead` also captures it as CUDA graphs and `max-autotune` tunes its kernels for longer. The UNet is compiled once per model, device and latent size, which takes a while, and the compiled UNet is reused by later sessions. Regional prompts, IP-Adapters, token merging and runtime LoRAs run uncompiled. Only applies to CPU and CUDA devices.")
+    token_merging_ratios: Optional[list[float]] = Field(default=None,       description="Merge similar spatial tokens before the self-attention layers of the UNet, and unmerge them after, to speed up high-resolution generations at a small cost in detail. Each ratio is the fraction of the tokens merged at a resolution level of the UNet, from the highest resolution down, e.g. `[0.5]` merges half of the tokens at the highest resolution only. Ratios must be below 1, and at most three quarters of the tokens are merged. Disabled if unset.")
     pil_compress_level:             int = Field(default=1,                  description="The compress_level setting of PIL.Image.save(), used for PNG encoding. All settings are lossless. 0 = no compression, 1 = fastest with slightly larger filesize, 9 = slowest with smallest filesize. 1 is typically the best setting.")
     max_queue_size:                 int = Field(default=10000, gt=0,        description="Maximum number of items in the session queue.")
     max_threads:          Optional[int] = Field(default=None,               description="Maximum number of session queue execution threads. Autocalculated from number of GPUs if not set.")
+    session_worker_mode: SESSION_WORKER_MODE = Field(default="thread",       description="Run sessions in worker threads of the main process, or in one worker process per execution device. Process mode requires an on-disk database. The worker processes share the `ram` cache budget equally. Devices are not quarantined in process mode.")
+    parallel_nodes:                bool = Field(default=False,              description="Run independent nodes of a session at the same time, each on its own execution device. Lets a single session that fans out over tiles or seeds use all the GPUs.")
+    max_denoise_batch:              int = Field(default=1, ge=1,            description="Maximum number of queue items of the same batch to run side by side on an execution device, denoising them as a single UNet batch when they use the same models, scheduler, steps and resolution. Only applies to worker threads, when `parallel_nodes` is off.")
     clear_queue_on_startup:        bool = Field(default=False,              description="Empties session queue on startup.")
 
     # NODES
@@ -207,6 +242,14 @@ class InvokeAIAppConfig(BaseSettings):
 
     model_config = SettingsConfigDict(env_prefix="INVOKEAI_", env_ignore_empty=True)
 
+    @field_validator("token_merging_ratios")
+    @classmethod
+    def validate_token_merging_ratios(cls, v: Optional[list[float]]) -> Optional[list[float]]:
+        """Validate that the token merging ratios are in [0, 1)."""
+        if v is not None and any(not 0 <= ratio < 1 for ratio in v):
+            raise ValueError(f"Token merging ratios must be at least 0 and below 1, got {v}")
+        return v
+
     def update_config(self, config: dict[str, Any] | InvokeAIAppConfig, clobber: bool = True) -> None:
         """Updates the config, overwriting existing values.
 
@@ -59,6 +59,16 @@ class InvocationStatsServiceBase(ABC):
         """
         pass
 
+    @abstractmethod
+    def record_unet_passes(self, graph_execution_state_id: str, unet_passes: int, skipped_unet_passes: int) -> None:
+        """
+        Add the UNet passes of a denoising node to the statistics of its session.
+        :param graph_execution_state_id: The id of the session.
+        :param unet_passes: The number of UNet passes that ran, with one pass per guidance branch and step.
+        :param skipped_unet_passes: The number of UNet passes that were skipped by guidance truncation.
+        """
+        pass
+
     @abstractmethod
     def reset_stats(self):
         """Reset all stored statistics."""
@@ -41,6 +41,9 @@ class GraphExecutionStatsSummary:
     wall_time_seconds: Optional[float]
     ram_usage_gb: Optional[float]
     ram_change_gb: Optional[float]
+    # The UNet passes run by the denoising nodes, and those skipped by guidance truncation.
+    unet_passes: int = 0
+    skipped_unet_passes: int = 0
 
 
 @dataclass
@@ -71,6 +74,11 @@ class InvocationStatsSummary:
         if self.graph_stats.ram_usage_gb is not None and self.graph_stats.ram_change_gb is not None:
             _str += f"RAM used by InvokeAI process: {self.graph_stats.ram_usage_gb:4.2f}G ({self.graph_stats.ram_change_gb:+5.3f}G)\n"
 
+        if self.graph_stats.skipped_unet_passes > 0:
+            skipped = self.graph_stats.skipped_unet_passes
+            total = self.graph_stats.unet_passes + skipped
+            _str += f"UNet passes skipped by CFG truncation: {skipped}/{total} ({skipped / total:.1%})\n"
+
         _str += f"RAM used to load models: {self.model_cache_stats.total_usage_gb:4.2f}G\n"
         if self.vram_usage_gb:
             _str += f"VRAM in use: {self.vram_usage_gb:4.3f}G\n"
@@ -111,10 +119,16 @@ class GraphExecutionStats:
 
     def __init__(self):
         self._node_stats_list: list[NodeExecutionStats] = []
+        self._unet_passes = 0
+        self._skipped_unet_passes = 0
 
     def add_node_execution_stats(self, node_stats: NodeExecutionStats):
         self._node_stats_list.append(node_stats)
 
+    def add_unet_passes(self, unet_passes: int, skipped_unet_passes: int):
+        self._unet_passes += unet_passes
+        self._skipped_unet_passes += skipped_unet_passes
+
     def get_total_run_time(self) -> float:
         """Get the total time spent executing nodes in the graph."""
         total = 0.0
@@ -161,6 +175,8 @@ class GraphExecutionStats:
             wall_time_seconds=wall_time_seconds,
             ram_usage_gb=ram_usage_gb,
             ram_change_gb=ram_change_gb,
+            unet_passes=self._unet_passes,
+            skipped_unet_passes=self._skipped_unet_passes,
         )
 
     def get_node_stats_summaries(self) -> list[NodeExecutionStatsSummary]:
@@ -74,6 +74,10 @@ class InvocationStatsService(InvocationStatsServiceBase):
             )
             self._stats[graph_execution_state_id].add_node_execution_stats(node_stats)
 
+    def record_unet_passes(self, graph_execution_state_id: str, unet_passes: int, skipped_unet_passes: int) -> None:
+        if graph_stats := self._stats.get(graph_execution_state_id):
+            graph_stats.add_unet_passes(unet_passes, skipped_unet_passes)
+
     def reset_stats(self, graph_execution_state_id: str):
         self._stats.pop(graph_execution_state_id)
         self._cache_stats.pop(graph_execution_state_id)
@@ -124,6 +124,9 @@ class ModelLoadService(ModelLoadServiceBase):
             else lambda path: safetensors_load_file(path, device="cpu")
         )
         assert loader is not None
-        raw_model = loader(model_path)
-        ram_cache.put(key=cache_key, model=raw_model)
-        return LoadedModelWithoutConfig(_locker=ram_cache.get(key=cache_key))
+        with ram_cache.load_lock(cache_key):
+            # another thread may have loaded the model while we waited for the load lock
+            if not ram_cache.exists(cache_key):
+                raw_model = loader(model_path)
+                ram_cache.put(key=cache_key, model=raw_model)
+            return LoadedModelWithoutConfig(_locker=ram_cache.get(key=cache_key))
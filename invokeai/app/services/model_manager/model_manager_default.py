@@ -5,6 +5,7 @@ from typing_extensions import Self
 
 from invokeai.app.services.invoker import Invoker
 from invokeai.backend.model_manager.load import ModelCache, ModelConvertCache, ModelLoaderRegistry
+from invokeai.backend.model_manager.load.model_cache import EVICTION_POLICIES
 from invokeai.backend.util.logging import InvokeAILogger
 
 from ..config import InvokeAIAppConfig
@@ -77,6 +78,13 @@ class ModelManagerService(ModelManagerServiceBase):
         ram_cache = ModelCache(
             max_cache_size=app_config.ram,
             max_vram_cache_size=app_config.vram,
+            max_pinned_cache_size=app_config.pinned_ram,
+            max_patched_cache_size=app_config.patched_vram,
+            mmap_weights=app_config.mmap_safetensors,
+            quantization=app_config.cache_quantization,
+            device_error_threshold=app_config.device_error_threshold,
+            device_quarantine_cooldown=app_config.device_quarantine_cooldown,
+            eviction_policy=EVICTION_POLICIES[app_config.cache_eviction_policy](),
             logger=logger,
         )
         convert_cache = ModelConvertCache(cache_path=app_config.convert_cache_path, max_size=app_config.convert_cache)
@@ -0,0 +1,121 @@
+"""
+Predictive model prefetching.
+
+While sessions run, the prefetcher looks at the next pending items of the session queue and loads the models they use
+into the RAM cache, so that disk reads overlap with the denoising of the running sessions. Models are then copied into
+the VRAM tier of an idle execution device, if there is one. Prefetching never evicts models from the RAM cache: models
+that do not fit in its free space are left to be loaded when they are needed.
+"""
+
+from threading import Event as ThreadEvent
+from threading import Thread
+from typing import TYPE_CHECKING, Optional
+
+from invokeai.app.invocations.model import ModelIdentifierField
+from invokeai.app.services.session_queue.session_queue_common import get_model_identifiers
+from invokeai.backend.model_manager import AnyModelConfig, ModelType, SubModelType
+from invokeai.backend.model_manager.config import DiffusersConfigBase
+from invokeai.backend.model_manager.load.model_cache.model_cache_default import GIG
+from invokeai.backend.model_manager.load.model_util import calc_model_size_by_fs, get_recorded_model_size
+
+if TYPE_CHECKING:
+    from invokeai.app.services.invocation_services import InvocationServices
+
+# The submodels of main models that are prefetched. Main models are referenced by graphs without a submodel type.
+PREFETCH_SUBMODELS = [SubModelType.UNet, SubModelType.TextEncoder, SubModelType.TextEncoder2, SubModelType.VAE]
+
+
+class ModelPrefetcher:
+    """Loads the models of pending queue items into the model cache in a background thread."""
+
+    def __init__(self, services: "InvocationServices", depth: int, polling_interval: float = 1) -> None:
+        """
+        Args:
+            services: The invocation services.
+            depth: The number of pending queue items to prefetch the models of.
+            polling_interval: How often to check the pending queue items when not woken, in seconds.
+        """
+        self._services = services
+        self._depth = depth
+        self._polling_interval = polling_interval
+        self._wake_event = ThreadEvent()
+        self._stop_event = ThreadEvent()
+        self._thread: Optional[Thread] = None
+
+    def start(self) -> None:
+        self._thread = Thread(name="model_prefetcher", target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._wake_event.set()
+
+    def wake(self) -> None:
+        """Prefetch the models of the pending queue items now, e.g. because a session started or items were queued."""
+        self._wake_event.set()
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            self._wake_event.wait(self._polling_interval)
+            self._wake_event.clear()
+            try:
+                self.prefetch()
+            except Exception as e:
+                self._services.logger.warning(f"Error while prefetching models: {e}")
+
+    def prefetch(self) -> None:
+        """Prefetch the models of the next pending queue items, in the order the items will run."""
+        ram_cache = self._services.model_manager.load.ram_cache
+        for queue_item in self._services.session_queue.get_pending_queue_items(self._depth):
+            if self._stop_event.is_set():
+                return
+            model_keys: set[str] = set()
+            for identifier in get_model_identifiers(queue_item.session.graph):
+                model_keys.add(identifier.key)
+                try:
+                    self._prefetch_model(identifier)
+                except Exception as e:  # the model will fail again, and be reported, when the session loads it
+                    self._services.logger.debug(f"Unable to prefetch model {identifier.key}: {e}")
+            if device := ram_cache.prefetch_to_vram(model_keys):
+                self._services.logger.debug(f"Prefetched the models of queue item {queue_item.item_id} to {device}")
+
+    def _prefetch_model(self, identifier: ModelIdentifierField) -> None:
+        """Load a model into the RAM cache, unless it is already cached or does not fit in the cache's free space."""
+        model_manager = self._services.model_manager
+        ram_cache = model_manager.load.ram_cache
+        config = model_manager.store.get_model(identifier.key)
+        if identifier.submodel_type is not None:
+            submodel_types: list[Optional[SubModelType]] = [identifier.submodel_type]
+        elif config.type is ModelType.Main:
+            submodel_types = list(self._main_submodels(config))
+        else:
+            submodel_types = [None]
+
+        for submodel_type in submodel_types:
+            if ram_cache.exists(config.key, submodel_type):
+                continue
+            free_space = ram_cache.max_cache_size * GIG - ram_cache.cache_size()
+            if self._estimate_size(config, submodel_type) > free_space:
+                self._services.logger.debug(f"Not prefetching {config.name}: it does not fit in the model cache")
+                return
+            self._services.logger.debug(f"Prefetching {config.name} {submodel_type or ''}")
+            model_manager.load.load_model(config, submodel_type)
+
+    def _main_submodels(self, config: AnyModelConfig) -> list[SubModelType]:
+        """Return the submodels of a main model to prefetch."""
+        if config.submodel_sizes is not None:
+            return [x for x in PREFETCH_SUBMODELS if x in config.submodel_sizes]
+        model_path = self._services.configuration.models_path / config.path
+        if not model_path.is_dir():
+            return [SubModelType.UNet]  # converting a checkpoint puts all of its submodels in the cache
+        return [x for x in PREFETCH_SUBMODELS if (model_path / x.value).is_dir()]
+
+    def _estimate_size(self, config: AnyModelConfig, submodel_type: Optional[SubModelType]) -> int:
+        """Estimate the size of a model in the RAM cache from the size of its files, as recorded in its config if it was."""
+        if (recorded_size := get_recorded_model_size(config, submodel_type)) is not None:
+            return recorded_size
+        return calc_model_size_by_fs(
+            model_path=self._services.configuration.models_path / config.path,
+            subfolder=submodel_type.value if submodel_type else None,
+            variant=config.repo_variant if isinstance(config, DiffusersConfigBase) else None,
+        )
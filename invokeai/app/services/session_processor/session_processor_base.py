@@ -15,33 +15,34 @@ class SessionRunnerBase(ABC):
     """
 
     @abstractmethod
-    def start(self, services: InvocationServices, cancel_event: Event, profiler: Optional[Profiler] = None) -> None:
+    def start(self, services: InvocationServices, profiler: Optional[Profiler] = None) -> None:
         """Starts the session runner.
 
         Args:
             services: The invocation services.
-            cancel_event: The cancel event.
             profiler: The profiler to use for session profiling via cProfile. Omit to disable profiling. Basic session
                 stats will be still be recorded and logged when profiling is disabled.
         """
         pass
 
     @abstractmethod
-    def run(self, queue_item: SessionQueueItem) -> None:
+    def run(self, queue_item: SessionQueueItem, cancel_event: Event) -> None:
         """Runs a session.
 
         Args:
             queue_item: The session to run.
+            cancel_event: The cancel event for this queue item. Setting it cancels this session only.
         """
         pass
 
     @abstractmethod
-    def run_node(self, invocation: BaseInvocation, queue_item: SessionQueueItem) -> None:
+    def run_node(self, invocation: BaseInvocation, queue_item: SessionQueueItem, cancel_event: Event) -> None:
         """Run a single node in the graph.
 
         Args:
             invocation: The invocation to run.
             queue_item: The session queue item.
+            cancel_event: The cancel event for this queue item.
         """
         pass
 
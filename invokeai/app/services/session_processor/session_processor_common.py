@@ -4,6 +4,9 @@ from pydantic import BaseModel, Field
 class SessionProcessorStatus(BaseModel):
     is_started: bool = Field(description="Whether the session processor is started")
     is_processing: bool = Field(description="Whether a session is being processed")
+    quarantined_devices: list[str] = Field(
+        default_factory=list, description="The execution devices taken out of service after repeated errors"
+    )
 
 
 class CanceledException(Exception):
@@ -12,6 +15,21 @@ class CanceledException(Exception):
     pass
 
 
+class DeviceQuarantinedException(Exception):
+    """The execution device was quarantined while running a session. The session should run again on another device."""
+
+    pass
+
+
+class SessionWorkerException(Exception):
+    """An error raised while a session worker process ran a session, re-raised in the main process."""
+
+    def __init__(self, error_type: str, error_message: str, error_traceback: str) -> None:
+        super().__init__(error_message)
+        self.error_type = error_type
+        self.error_traceback = error_traceback
+
+
 class ProgressImage(BaseModel):
     """The progress image sent intermittently during processing"""
 
@@ -1,19 +1,27 @@
+import multiprocessing
+import time
 import traceback
-from contextlib import suppress
-from queue import Queue
-from threading import BoundedSemaphore, Lock, Thread
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import ExitStack, suppress
+from contextvars import copy_context
+from queue import Empty, Queue
+from threading import BoundedSemaphore, Condition, Lock, Thread
 from threading import Event as ThreadEvent
-from typing import Optional, Set
+from typing import Dict, Optional, Set
+
+import torch
 
 from invokeai.app.invocations.baseinvocation import BaseInvocation, BaseInvocationOutput
 from invokeai.app.services.events.events_common import (
     BatchEnqueuedEvent,
+    EventBase,
     FastAPIEvent,
     QueueClearedEvent,
     QueueItemStatusChangedEvent,
     register_events,
 )
 from invokeai.app.services.invocation_stats.invocation_stats_common import GESStatsNotFoundError
+from invokeai.app.services.model_records import UnknownModelException
 from invokeai.app.services.session_processor.session_processor_base import (
     OnAfterRunNode,
     OnAfterRunSession,
@@ -22,11 +30,27 @@ from invokeai.app.services.session_processor.session_processor_base import (
     OnNodeError,
     OnNonFatalProcessorError,
 )
-from invokeai.app.services.session_processor.session_processor_common import CanceledException
-from invokeai.app.services.session_queue.session_queue_common import SessionQueueItem, SessionQueueItemNotFoundError
+from invokeai.app.services.session_processor.model_prefetcher import ModelPrefetcher
+from invokeai.app.services.session_processor.session_processor_common import (
+    CanceledException,
+    DeviceQuarantinedException,
+    SessionWorkerException,
+)
+from invokeai.app.services.session_processor.session_worker_process import (
+    SessionWorkerProcess,
+    WorkerServicesFactory,
+    get_worker_config,
+)
+from invokeai.app.services.session_queue.session_queue_common import (
+    SessionQueueItem,
+    SessionQueueItemNotFoundError,
+    get_invocation_model_keys,
+    get_model_keys,
+)
 from invokeai.app.services.shared.graph import NodeInputError
 from invokeai.app.services.shared.invocation_context import InvocationContextData, build_invocation_context
 from invokeai.app.util.profiler import Profiler
+from invokeai.backend.stable_diffusion.denoise_coalescer import DenoiseCoalescer
 from invokeai.backend.util.devices import TorchDevice
 
 from ..invoker import Invoker
@@ -34,6 +58,10 @@ from .session_processor_base import InvocationServices, SessionProcessorBase, Se
 from .session_processor_common import SessionProcessorStatus
 
 
+# Multiplier applied to the size of a session's models to estimate its peak device memory, leaving room for activations
+SESSION_MEMORY_HEADROOM = 1.2
+
+
 class DefaultSessionRunner(SessionRunnerBase):
     """Processes a single session's invocations."""
 
@@ -61,60 +89,152 @@ class DefaultSessionRunner(SessionRunnerBase):
         self._on_after_run_session_callbacks = on_after_run_session_callbacks or []
         self._process_lock = Lock()
 
-    def start(
-        self, services: InvocationServices, cancel_event: ThreadEvent, profiler: Optional[Profiler] = None
-    ) -> None:
+    def start(self, services: InvocationServices, profiler: Optional[Profiler] = None) -> None:
         self._services = services
-        self._cancel_event = cancel_event
         self._profiler = profiler
 
-    def _is_canceled(self) -> bool:
-        """Check if the cancel event is set. This is also passed to the invocation context builder and called during
-        denoising to check if the session has been canceled."""
-        return self._cancel_event.is_set()
-
-    def run(self, queue_item: SessionQueueItem):
+    def run(self, queue_item: SessionQueueItem, cancel_event: ThreadEvent):
         # Exceptions raised outside `run_node` are handled by the processor. There is no need to catch them here.
 
         self._on_before_run_session(queue_item=queue_item)
 
-        # Loop over invocations until the session is complete or canceled
-        while True:
-            try:
-                with self._process_lock:
-                    invocation = queue_item.session.next()
-            # Anything other than a `NodeInputError` is handled as a processor error
-            except NodeInputError as e:
-                error_type = e.__class__.__name__
-                error_message = str(e)
-                error_traceback = traceback.format_exc()
-                self._on_node_error(
-                    invocation=e.node,
-                    queue_item=queue_item,
-                    error_type=error_type,
-                    error_message=error_message,
-                    error_traceback=error_traceback,
-                )
-                break
+        try:
+            max_parallel_nodes = self._max_parallel_nodes()
+            if max_parallel_nodes > 1:
+                self._run_parallel(queue_item, cancel_event, max_parallel_nodes)
+            else:
+                # Loop over invocations until the session is complete or canceled
+                while True:
+                    invocation = self._next_invocation(queue_item)
+                    if invocation is None or cancel_event.is_set():
+                        break
+
+                    self.run_node(invocation, queue_item, cancel_event)
+
+                    if self._is_session_done(queue_item, cancel_event):
+                        break
+        except DeviceQuarantinedException:
+            # The session is re-queued by the processor, without reaching `_on_after_run_session`
+            self._on_requeue_session(queue_item=queue_item)
+            raise
 
-            if invocation is None or self._is_canceled():
-                break
+        self._on_after_run_session(queue_item=queue_item)
 
-            self.run_node(invocation, queue_item)
+    def _max_parallel_nodes(self) -> int:
+        """Return the number of invocations of a session that may run at the same time."""
+        if not self._services.configuration.parallel_nodes:
+            return 1
+        return len(TorchDevice.execution_devices())
 
-            # The session is complete if all invocations have been run or there is an error on the session.
-            # At this time, the queue item may be canceled, but the object itself here won't be updated yet. We must
-            # use the cancel event to check if the session is canceled.
-            if (
-                queue_item.session.is_complete()
-                or self._is_canceled()
-                or queue_item.status in ["failed", "canceled", "completed"]
-            ):
-                break
+    def _next_invocation(self, queue_item: SessionQueueItem) -> Optional[BaseInvocation]:
+        """Get the session's next ready invocation. Returns None if there is none, or if it failed to prepare."""
+        try:
+            with self._process_lock:
+                return queue_item.session.next()
+        # Anything other than a `NodeInputError` is handled as a processor error
+        except NodeInputError as e:
+            error_type = e.__class__.__name__
+            error_message = str(e)
+            error_traceback = traceback.format_exc()
+            self._on_node_error(
+                invocation=e.node,
+                queue_item=queue_item,
+                error_type=error_type,
+                error_message=error_message,
+                error_traceback=error_traceback,
+            )
+            return None
+
+    def _is_session_done(self, queue_item: SessionQueueItem, cancel_event: ThreadEvent) -> bool:
+        # The session is complete if all invocations have been run or there is an error on the session.
+        # At this time, the queue item may be canceled, but the object itself here won't be updated yet. We must
+        # use the cancel event to check if the session is canceled.
+        return (
+            queue_item.session.is_complete()
+            or cancel_event.is_set()
+            or queue_item.status in ["failed", "canceled", "completed"]
+        )
 
-        self._on_after_run_session(queue_item=queue_item)
+    def _run_parallel(self, queue_item: SessionQueueItem, cancel_event: ThreadEvent, max_nodes: int) -> None:
+        """Run a session's invocations, dispatching independent ready invocations concurrently.
 
-    def run_node(self, invocation: BaseInvocation, queue_item: SessionQueueItem) -> None:
+        One invocation at a time runs on the device reserved for the session. Additional invocations run on devices
+        that are idle, so that a session that fans out (e.g. over tiles or seeds) can use all the devices.
+        """
+        session_device = TorchDevice.bound_execution_device()
+        # in-flight invocation to whether it runs on the session's device
+        in_flight: Dict[Future[bool], bool] = {}
+        # whether to look for an idle device to run another invocation on
+        try_idle_device = True
+
+        with ThreadPoolExecutor(max_workers=max_nodes, thread_name_prefix="session_node") as pool:
+            while True:
+                # Dispatch ready invocations until there are as many in flight as there are devices
+                while len(in_flight) < max_nodes and not self._is_session_done(queue_item, cancel_event):
+                    if not any(in_flight.values()):
+                        invocation = self._next_invocation(queue_item)
+                        if invocation is None:
+                            break
+                        future = pool.submit(
+                            self._run_node_on_device, invocation, queue_item, cancel_event, session_device
+                        )
+                        in_flight[future] = True
+                    elif try_idle_device:
+                        # The session's device is busy. Another invocation is only taken from the session once an idle
+                        # device is reserved for it: waiting for a device while holding one could deadlock with another
+                        # session doing the same. If none is idle, the invocation runs later on the session's device.
+                        future = pool.submit(self._run_next_node_on_idle_device, queue_item, cancel_event)
+                        in_flight[future] = False
+                        try_idle_device = False
+                    else:
+                        break
+
+                # Nothing in flight and nothing ready - the session is finished
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    in_flight.pop(future)
+                    # an invocation that ran may have made others ready, and its device is free again
+                    if future.result():
+                        try_idle_device = True
+
+    def _run_node_on_device(
+        self,
+        invocation: BaseInvocation,
+        queue_item: SessionQueueItem,
+        cancel_event: ThreadEvent,
+        device: Optional[torch.device],
+    ) -> bool:
+        """Run an invocation on the indicated device, or on a newly reserved device if none is given."""
+        if device is not None:
+            with TorchDevice.bind_execution_device(device):
+                self.run_node(invocation, queue_item, cancel_event)
+            return True
+        ram_cache = self._services.model_manager.load.ram_cache
+        with ram_cache.reserve_execution_device(model_keys=get_invocation_model_keys(invocation)):
+            self.run_node(invocation, queue_item, cancel_event)
+        return True
+
+    def _run_next_node_on_idle_device(self, queue_item: SessionQueueItem, cancel_event: ThreadEvent) -> bool:
+        """Run the session's next ready invocation on an execution device that is idle right now.
+
+        Returns false if no device is idle or no invocation is ready. The ready invocations are left to run later.
+        """
+        ram_cache = self._services.model_manager.load.ram_cache
+        with ExitStack() as stack:
+            try:
+                stack.enter_context(ram_cache.reserve_execution_device(timeout=0))
+            except TimeoutError:
+                return False
+            invocation = self._next_invocation(queue_item)
+            if invocation is None:
+                return False
+            self.run_node(invocation, queue_item, cancel_event)
+            return True
+
+    def run_node(self, invocation: BaseInvocation, queue_item: SessionQueueItem, cancel_event: ThreadEvent) -> None:
         try:
             # Any unhandled exception in this scope is an invocation error & will fail the graph
             with self._services.performance_statistics.collect_stats(invocation, queue_item.session_id):
@@ -125,16 +245,20 @@ class DefaultSessionRunner(SessionRunnerBase):
                     source_invocation_id=queue_item.session.prepared_source_mapping[invocation.id],
                     queue_item=queue_item,
                 )
+                # The cancel event is scoped to this queue item. It is also called during denoising to check if the
+                # session has been canceled.
                 context = build_invocation_context(
                     data=data,
                     services=self._services,
-                    is_canceled=self._is_canceled,
+                    is_canceled=cancel_event.is_set,
                 )
 
                 # Invoke the node
                 output = invocation.invoke_internal(context=context, services=self._services)
                 # Save output and history
-                queue_item.session.complete(invocation.id, output)
+                with self._process_lock:
+                    queue_item.session.complete(invocation.id, output)
+                self._services.model_manager.load.ram_cache.record_device_success()
 
                 self._on_after_run_node(invocation, queue_item, output)
 
@@ -150,6 +274,10 @@ class DefaultSessionRunner(SessionRunnerBase):
             # handle cancellation.
             pass
         except Exception as e:
+            # Errors caused by a failing device are counted against it. Once the device is quarantined, the session is
+            # handed back to the processor to run again on another device, instead of failing.
+            if self._services.model_manager.load.ram_cache.record_device_error(e):
+                raise DeviceQuarantinedException(str(e)) from e
             error_type = e.__class__.__name__
             error_message = str(e)
             error_traceback = traceback.format_exc()
@@ -223,6 +351,24 @@ class DefaultSessionRunner(SessionRunnerBase):
         except SessionQueueItemNotFoundError:
             pass
 
+    def _on_requeue_session(self, queue_item: SessionQueueItem) -> None:
+        """Called when a session stops because its device was quarantined, to be re-queued and run again.
+
+        - Stop the profiler if profiling is enabled.
+        - Reset the performance statistics of the session, which start over when it runs again.
+        """
+
+        self._services.logger.debug(
+            f"On requeue session: queue item {queue_item.item_id}, session {queue_item.session_id}"
+        )
+
+        if self._profiler is not None:
+            self._profiler.stop()
+
+        # The stats of a session that ran no node were never tracked
+        with suppress(KeyError):
+            self._services.performance_statistics.reset_stats(queue_item.session.id)
+
     def _on_before_run_node(self, invocation: BaseInvocation, queue_item: SessionQueueItem):
         """Called before a node is run.
 
@@ -282,14 +428,16 @@ class DefaultSessionRunner(SessionRunnerBase):
 
         # Node errors do not get the full traceback. Only the queue item gets the full traceback.
         node_error = f"{error_type}: {error_message}"
-        queue_item.session.set_node_error(invocation.id, node_error)
         self._services.logger.error(
             f"Error while invoking session {queue_item.session_id}, invocation {invocation.id} ({invocation.get_type()}): {error_message}"
         )
         self._services.logger.error(error_traceback)
 
-        # Fail the queue item
-        queue_item = self._services.session_queue.set_queue_item_session(queue_item.item_id, queue_item.session)
+        # Fail the queue item. Other invocations of the session may still be running, so the session must not change
+        # while it is being saved.
+        with self._process_lock:
+            queue_item.session.set_node_error(invocation.id, node_error)
+            queue_item = self._services.session_queue.set_queue_item_session(queue_item.item_id, queue_item.session)
         queue_item = self._services.session_queue.fail_queue_item(
             queue_item.item_id, error_type, error_message, error_traceback
         )
@@ -320,13 +468,24 @@ class DefaultSessionProcessor(SessionProcessorBase):
         on_non_fatal_processor_error_callbacks: Optional[list[OnNonFatalProcessorError]] = None,
         thread_limit: int = 1,
         polling_interval: int = 1,
+        worker_services_factory: Optional[WorkerServicesFactory] = None,
     ) -> None:
+        """
+        Args:
+            session_runner: The session runner used by worker threads.
+            on_non_fatal_processor_error_callbacks: Callbacks to run when a non-fatal processor error occurs.
+            thread_limit: The number of dequeuer threads.
+            polling_interval: How often to poll the session queue, in seconds.
+            worker_services_factory: Builds the services of session worker processes. Required to run sessions in
+                worker processes when the `session_worker_mode` config setting is "process".
+        """
         super().__init__()
 
         self.session_runner = session_runner if session_runner else DefaultSessionRunner()
         self._on_non_fatal_processor_error_callbacks = on_non_fatal_processor_error_callbacks or []
         self._thread_limit = thread_limit
         self._polling_interval = polling_interval
+        self._worker_services_factory = worker_services_factory
 
     def start(self, invoker: Invoker) -> None:
         self._invoker: Invoker = invoker
@@ -336,7 +495,8 @@ class DefaultSessionProcessor(SessionProcessorBase):
         self._resume_event = ThreadEvent()
         self._stop_event = ThreadEvent()
         self._poll_now_event = ThreadEvent()
-        self._cancel_event = ThreadEvent()
+        # queue item id to the cancel event for that item - each active item gets its own event
+        self._cancel_events: Dict[int, ThreadEvent] = {}
 
         register_events(QueueClearedEvent, self._on_queue_cleared)
         register_events(BatchEnqueuedEvent, self._on_batch_enqueued)
@@ -356,13 +516,32 @@ class DefaultSessionProcessor(SessionProcessorBase):
             else None
         )
 
-        self._worker_thread_count = self._invoker.services.configuration.max_threads or len(
-            TorchDevice.execution_devices()
-        )
+        # In process mode, there is one worker process per execution device, each fed by a thread of this process.
+        self._worker_processes = self._create_worker_processes()
+        if self._worker_processes:
+            self._worker_thread_count = len(self._worker_processes)
+        else:
+            self._worker_thread_count = self._invoker.services.configuration.max_threads or len(
+                TorchDevice.execution_devices()
+            )
 
-        self._session_worker_queue: Queue[SessionQueueItem] = Queue()
+        # Items are only claimed from the session queue when a worker and an execution device are free to run them.
+        # This keeps the number of "in_progress" items equal to the number of sessions actually running, so that a
+        # restart does not cancel a backlog of items that never started.
+        self._dispatch_condition = Condition()
+        self._dispatched = 0  # claimed items that have not finished yet
+        self._session_worker_queue: Queue[SessionQueueItem] = Queue(maxsize=self._worker_thread_count)
+
+        # Models of pending items are prefetched into the model cache of this process. Worker processes have their own.
+        self._prefetcher: Optional[ModelPrefetcher] = None
+        prefetch_depth = self._invoker.services.configuration.prefetch_depth
+        if prefetch_depth > 0 and not self._worker_processes:
+            self._prefetcher = ModelPrefetcher(
+                services=invoker.services, depth=prefetch_depth, polling_interval=self._polling_interval
+            )
+            self._prefetcher.start()
 
-        self.session_runner.start(services=invoker.services, cancel_event=self._cancel_event, profiler=self._profiler)
+        self.session_runner.start(services=invoker.services, profiler=self._profiler)
         # Session processor - singlethreaded
         self._thread = Thread(
             name="session_processor",
@@ -371,46 +550,122 @@ class DefaultSessionProcessor(SessionProcessorBase):
                 "stop_event": self._stop_event,
                 "poll_now_event": self._poll_now_event,
                 "resume_event": self._resume_event,
-                "cancel_event": self._cancel_event,
             },
         )
         self._thread.start()
 
         # Session processor workers - multithreaded
         self._invoker.services.logger.debug(f"Starting {self._worker_thread_count} session processing threads.")
-        for _i in range(0, self._worker_thread_count):
+        for i in range(0, self._worker_thread_count):
             worker = Thread(
                 name="session_worker",
                 target=self._process_next_session,
+                kwargs={"worker_process": self._worker_processes[i] if self._worker_processes else None},
                 daemon=True,
             )
             worker.start()
 
+        # Devices that fail to respond to polling are quarantined like devices that fail sessions
+        device_poll_interval = self._invoker.services.configuration.device_poll_interval
+        if device_poll_interval is not None:
+            Thread(
+                name="device_health",
+                target=self._poll_device_health,
+                kwargs={"interval": device_poll_interval},
+                daemon=True,
+            ).start()
+
     def stop(self, *args, **kwargs) -> None:
         self._stop_event.set()
+        if self._prefetcher is not None:
+            self._prefetcher.stop()
+        for worker_process in self._worker_processes:
+            worker_process.stop()
+
+    def _create_worker_processes(self) -> list[SessionWorkerProcess]:
+        """Create and start one session worker process per execution device, if process mode is configured."""
+        configuration = self._invoker.services.configuration
+        if configuration.session_worker_mode != "process":
+            return []
+        if configuration.use_memory_db or self._worker_services_factory is None:
+            self._invoker.services.logger.warning(
+                "Session worker processes require an on-disk database. Running sessions in worker threads instead."
+            )
+            return []
+
+        event_queue = multiprocessing.get_context("spawn").Queue()
+        devices = sorted(TorchDevice.execution_devices(), key=str)
+        # each worker process has its own model cache, so they share the RAM cache budget
+        worker_config = get_worker_config(configuration, len(devices))
+        worker_processes = [
+            SessionWorkerProcess(
+                device=device,
+                config=worker_config,
+                services_factory=self._worker_services_factory,
+                event_queue=event_queue,
+            )
+            for device in devices
+        ]
+        for worker_process in worker_processes:
+            self._invoker.services.logger.info(f"Starting session worker process on {worker_process.device}")
+            worker_process.start()
+
+        Thread(
+            name="session_worker_events",
+            target=self._forward_worker_events,
+            kwargs={"event_queue": event_queue},
+            daemon=True,
+        ).start()
+        return worker_processes
+
+    def _forward_worker_events(self, event_queue: "multiprocessing.Queue[EventBase]") -> None:
+        """Dispatch the events emitted by session worker processes on this process's event bus."""
+        while True:
+            try:
+                event = event_queue.get(timeout=self._polling_interval)
+            except Empty:
+                continue
+            self._invoker.services.events.dispatch(event)
+
+    def _poll_device_health(self, interval: float) -> None:
+        """Periodically poll the health of the execution devices."""
+        while True:
+            time.sleep(interval)
+            self._invoker.services.model_manager.load.ram_cache.poll_device_health()
 
     def _poll_now(self) -> None:
         self._poll_now_event.set()
 
+    def _cancel_queue_item(self, item_id: int) -> None:
+        if cancel_event := self._cancel_events.get(item_id):
+            cancel_event.set()
+        for worker_process in self._worker_processes:
+            worker_process.cancel(item_id)
+
     async def _on_queue_cleared(self, event: FastAPIEvent[QueueClearedEvent]) -> None:
-        if any(item.queue_id == event[1].queue_id for item in self._active_queue_items):
-            self._cancel_event.set()
+        canceled = [item for item in self._active_queue_items if item.queue_id == event[1].queue_id]
+        for item in canceled:
+            self._cancel_queue_item(item.item_id)
+        if canceled:
             self._poll_now()
 
     async def _on_batch_enqueued(self, event: FastAPIEvent[BatchEnqueuedEvent]) -> None:
         self._poll_now()
+        if self._prefetcher is not None:
+            self._prefetcher.wake()
 
     async def _on_queue_item_status_changed(self, event: FastAPIEvent[QueueItemStatusChangedEvent]) -> None:
-        if self._active_queue_items and event[1].status in ["completed", "failed", "canceled"]:
+        if self._cancel_events and event[1].status in ["completed", "failed", "canceled"]:
             # When the queue item is canceled via HTTP, the queue item status is set to `"canceled"` and this event is
-            # emitted. We need to respond to this event and stop graph execution. This is done by setting the cancel
-            # event, which the session runner checks between invocations. If set, the session runner loop is broken.
+            # emitted. We need to respond to this event and stop graph execution. This is done by setting the queue
+            # item's own cancel event, which the session runner checks between invocations. If set, the session runner
+            # loop is broken. Sessions of other queue items running on other devices are not affected.
             #
             # Long-running nodes that cannot be interrupted easily present a challenge. `denoise_latents` is one such
             # node, but it gets a step callback, called on each step of denoising. This callback checks if the queue item
             # is canceled, and if it is, raises a `CanceledException` to stop execution immediately.
             if event[1].status == "canceled":
-                self._cancel_event.set()
+                self._cancel_queue_item(event[1].item_id)
             self._poll_now()
 
     def resume(self) -> SessionProcessorStatus:
@@ -424,9 +679,11 @@ class DefaultSessionProcessor(SessionProcessorBase):
         return self.get_status()
 
     def get_status(self) -> SessionProcessorStatus:
+        device_profiles = self._invoker.services.model_manager.load.ram_cache.device_profiles
         return SessionProcessorStatus(
             is_started=self._resume_event.is_set(),
             is_processing=len(self._active_queue_items) > 0,
+            quarantined_devices=[str(device) for device, profile in device_profiles.items() if profile.quarantined],
         )
 
     def _process(
@@ -434,14 +691,12 @@ class DefaultSessionProcessor(SessionProcessorBase):
         stop_event: ThreadEvent,
         poll_now_event: ThreadEvent,
         resume_event: ThreadEvent,
-        cancel_event: ThreadEvent,
     ):
         try:
             # Any unhandled exception in this block is a fatal processor error and will stop the processor.
             self._thread_semaphore.acquire()
             stop_event.clear()
             resume_event.set()
-            cancel_event.clear()
 
             while not stop_event.is_set():
                 poll_now_event.clear()
@@ -450,21 +705,32 @@ class DefaultSessionProcessor(SessionProcessorBase):
                     # If we are paused, wait for resume event
                     resume_event.wait()
 
+                    # Wait for a free worker and device before claiming the next session
+                    if not self._acquire_dispatch_slot(timeout=self._polling_interval):
+                        continue
+
                     # Get the next session to process
-                    queue_item = self._invoker.services.session_queue.dequeue()
+                    try:
+                        queue_item = self._invoker.services.session_queue.dequeue()
+                    except Exception:
+                        self._release_dispatch_slot()
+                        raise
 
                     if queue_item is None:
                         # The queue was empty, wait for next polling interval or event to try again
+                        self._release_dispatch_slot()
                         self._invoker.services.logger.debug("Waiting for next polling interval or event")
                         poll_now_event.wait(self._polling_interval)
                         continue
 
+                    # The cancel event is created before the item is handed to a worker, so that a cancellation
+                    # arriving before the worker picks up the item is not lost.
+                    self._cancel_events[queue_item.item_id] = ThreadEvent()
                     self._session_worker_queue.put(queue_item)
                     self._invoker.services.logger.debug(f"Scheduling queue item {queue_item.item_id} to run")
-                    cancel_event.clear()
-
-                    # Run the graph
-                    # self.session_runner.run(queue_item=self._queue_item)
+                    # the next pending items have moved up the queue
+                    if self._prefetcher is not None:
+                        self._prefetcher.wake()
 
                 except Exception:
                     # Wait for next polling interval or event to try again
@@ -483,22 +749,153 @@ class DefaultSessionProcessor(SessionProcessorBase):
             poll_now_event.clear()
             self._thread_semaphore.release()
 
-    def _process_next_session(self) -> None:
+    def _dispatch_limit(self) -> int:
+        """Return the number of sessions that may run at once: one per worker and execution device in service."""
+        device_profiles = self._invoker.services.model_manager.load.ram_cache.device_profiles
+        in_service = sum(1 for profile in device_profiles.values() if not profile.quarantined)
+        return min(self._worker_thread_count, in_service)
+
+    def _acquire_dispatch_slot(self, timeout: float) -> bool:
+        """Wait for fewer sessions to run than the dispatch limit, and count one more. Returns false on timeout."""
+        with self._dispatch_condition:
+            if not self._dispatch_condition.wait_for(lambda: self._dispatched < self._dispatch_limit(), timeout):
+                return False
+            self._dispatched += 1
+            return True
+
+    def _release_dispatch_slot(self) -> None:
+        with self._dispatch_condition:
+            self._dispatched -= 1
+            self._dispatch_condition.notify_all()
+
+    def _process_next_session(self, worker_process: Optional[SessionWorkerProcess] = None) -> None:
         while True:
             self._resume_event.wait()
             queue_item = self._session_worker_queue.get()
-            if queue_item.status == "canceled":
+            cancel_event = self._cancel_events.setdefault(queue_item.item_id, ThreadEvent())
+            if queue_item.status == "canceled" or cancel_event.is_set():
+                self._cancel_events.pop(queue_item.item_id, None)
+                self._release_dispatch_slot()
                 continue
+            # the claimed queue item, followed by any items claimed to run side by side with it
+            queue_items = [queue_item]
             try:
                 self._active_queue_items.add(queue_item)
-                # reserve a GPU for this session - may block
-                with self._invoker.services.model_manager.load.ram_cache.reserve_execution_device():
-                    # Run the session on the reserved GPU
-                    self.session_runner.run(queue_item=queue_item)
-            except Exception:
-                continue
+                if worker_process is not None:
+                    # Run the session in the worker process, which owns its GPU
+                    worker_process.run(queue_item)
+                    continue
+                queue_items.extend(self._claim_coalescable_items(queue_item))
+                # reserve a GPU for this session - may block. Only GPUs with room for the session's models are
+                # considered, preferring one that already holds them, then the fastest.
+                ram_cache = self._invoker.services.model_manager.load.ram_cache
+                model_keys = get_model_keys(queue_item.session.graph)
+                with ram_cache.reserve_execution_device(
+                    model_keys=model_keys, required_memory=self._estimate_required_memory(model_keys)
+                ):
+                    if len(queue_items) > 1:
+                        self._run_coalesced(queue_items)
+                    else:
+                        # Run the session on the reserved GPU
+                        self.session_runner.run(queue_item=queue_item, cancel_event=cancel_event)
+            except Exception as e:
+                for item in queue_items:
+                    self._on_session_exception(item, e)
             finally:
-                self._active_queue_items.remove(queue_item)
+                for item in queue_items:
+                    self._active_queue_items.discard(item)
+                    self._cancel_events.pop(item.item_id, None)
+                self._release_dispatch_slot()
+
+    def _claim_coalescable_items(self, queue_item: SessionQueueItem) -> list[SessionQueueItem]:
+        """Claim pending items of the same batch as the indicated item, to run side by side with it on one device.
+
+        Items of a batch usually differ only in their seeds or prompts, so their denoising can be coalesced into a
+        single UNet batch. See `DenoiseCoalescer`.
+        """
+        configuration = self._invoker.services.configuration
+        if configuration.max_denoise_batch <= 1 or configuration.parallel_nodes:
+            return []
+        claimed: list[SessionQueueItem] = []
+        while len(claimed) < configuration.max_denoise_batch - 1:
+            item = self._invoker.services.session_queue.dequeue(batch_id=queue_item.batch_id)
+            if item is None:
+                break
+            self._cancel_events[item.item_id] = ThreadEvent()
+            self._active_queue_items.add(item)
+            claimed.append(item)
+        return claimed
+
+    def _run_coalesced(self, queue_items: list[SessionQueueItem]) -> None:
+        """Run several sessions side by side on the device reserved by this thread, batching their denoising.
+
+        Each session runs in its own thread, which inherits this thread's execution device.
+        """
+        coalescer = DenoiseCoalescer(len(queue_items))
+        threads = [
+            Thread(
+                name="session_coalesced",
+                target=copy_context().run,
+                args=(self._run_coalesced_session, coalescer, item),
+                daemon=True,
+            )
+            for item in queue_items
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _run_coalesced_session(self, coalescer: DenoiseCoalescer, queue_item: SessionQueueItem) -> None:
+        cancel_event = self._cancel_events.setdefault(queue_item.item_id, ThreadEvent())
+        with coalescer.member():
+            try:
+                self.session_runner.run(queue_item=queue_item, cancel_event=cancel_event)
+            except Exception as e:
+                self._on_session_exception(queue_item, e)
+
+    def _on_session_exception(self, queue_item: SessionQueueItem, e: Exception) -> None:
+        """Handle an exception raised while running a session.
+
+        If the session's device was quarantined, the queue item is returned to the queue to run on another device.
+        Otherwise, it is handled as a non-fatal processor error.
+        """
+        # The queue item may have been removed from the queue while the session was running
+        with suppress(SessionQueueItemNotFoundError):
+            if isinstance(e, DeviceQuarantinedException):
+                self._invoker.services.logger.warning(
+                    f"Re-queuing queue item {queue_item.item_id} after its execution device was quarantined"
+                )
+                self._invoker.services.session_queue.requeue_queue_item(queue_item.item_id)
+                self._poll_now()
+                return
+            if isinstance(e, SessionWorkerException):
+                # raised in a session worker process, whose error and traceback were sent back with the result
+                error_type, error_traceback = e.error_type, e.error_traceback
+            else:
+                error_type, error_traceback = e.__class__.__name__, traceback.format_exc()
+            self._on_non_fatal_processor_error(
+                queue_item=queue_item,
+                error_type=error_type,
+                error_message=str(e),
+                error_traceback=error_traceback,
+            )
+
+    def _estimate_required_memory(self, model_keys: Set[str]) -> int:
+        """Estimate the peak device memory needed by a session using the indicated models, in bytes.
+
+        This is the size of the session's models, plus headroom for activations. Models in the RAM cache are counted at
+        their cached size, and the others at the size recorded in their configs when they were installed.
+        """
+        model_manager = self._invoker.services.model_manager
+        footprint = 0
+        for model_key in model_keys:
+            size = model_manager.load.ram_cache.estimate_model_footprint({model_key})
+            if not size:
+                with suppress(UnknownModelException):
+                    size = model_manager.store.get_model(model_key).size or 0
+            footprint += size
+        return int(footprint * SESSION_MEMORY_HEADROOM)
 
     def _on_non_fatal_processor_error(
         self,
@@ -0,0 +1,251 @@
+"""
+Session worker processes.
+
+When the `session_worker_mode` config setting is "process", the session processor runs each session in a worker
+process bound to a single execution device, instead of in a thread of the main process. Each worker process owns its
+own model cache, so CPU-bound node work on one device does not contend for the GIL with work on another.
+
+The main process remains responsible for claiming queue items from the database. It sends the id of each claimed item
+to a worker process, and the worker process runs it with its own services, which share the database with the main
+process. Events emitted by the worker are forwarded to the main process, which dispatches them on its event bus.
+
+The `ram` model cache budget is shared equally by the worker processes. Model installation and downloads stay in the
+main process.
+
+Errors raised while a worker runs a session are sent back with its result, and re-raised by the main process, which
+fails or re-queues the item as it does for sessions run in threads. Devices are not quarantined in process mode: the
+model cache of each worker holds its own device only, and the last device in service is never quarantined.
+"""
+
+import multiprocessing
+import traceback
+from logging import Logger
+from multiprocessing.synchronize import Event as ProcessEvent
+from queue import Empty
+from typing import TYPE_CHECKING, NamedTuple, Optional, Protocol
+
+import torch
+
+from invokeai.app.services.config.config_default import InvokeAIAppConfig, get_config
+from invokeai.app.services.events.events_base import EventServiceBase
+from invokeai.app.services.events.events_common import EventBase
+from invokeai.app.services.invoker import Invoker
+from invokeai.app.services.session_processor.session_processor_common import (
+    DeviceQuarantinedException,
+    SessionWorkerException,
+)
+from invokeai.app.services.session_queue.session_queue_common import SessionQueueItem, get_model_keys
+from invokeai.backend.util.logging import InvokeAILogger
+
+if TYPE_CHECKING:
+    from multiprocessing import Queue as ProcessQueue
+
+    from invokeai.app.services.invocation_services import InvocationServices
+
+# How often the main process checks that a worker process is still alive while it runs a session, in seconds
+WORKER_LIVENESS_INTERVAL = 1.0
+
+
+class WorkerServicesFactory(Protocol):
+    def __call__(self, config: InvokeAIAppConfig, events: EventServiceBase, logger: Logger) -> "InvocationServices":
+        """Build the invocation services used by a session worker process.
+
+        This must be a module-level function or static method so that it can be sent to a spawned process.
+
+        Args:
+            config: The app config of the main process, restricted to the worker's execution device.
+            events: The event service that forwards the worker's events to the main process.
+            logger: The logger for the worker.
+        """
+        ...
+
+
+class SessionWorkerResult(NamedTuple):
+    """The outcome of a queue item run by a session worker process. The error fields are None if there was no error."""
+
+    item_id: int
+    error_type: Optional[str] = None
+    error_message: Optional[str] = None
+    error_traceback: Optional[str] = None
+    quarantined: bool = False
+
+
+def get_worker_config(config: InvokeAIAppConfig, worker_count: int) -> InvokeAIAppConfig:
+    """Return the config of one of `worker_count` session worker processes, each with an equal share of the RAM cache."""
+    return config.model_copy(update={"ram": config.ram / worker_count})
+
+
+class SessionWorkerInvoker(Invoker):
+    """The invoker of a session worker process.
+
+    Only the services needed to run sessions are started. The model installer and the download queue belong to the main
+    process; running them in each worker would repeat their work against the shared database.
+    """
+
+    def _start(self) -> None:
+        for service in self._worker_services():
+            if callable(start_op := getattr(service, "start", None)):
+                start_op(self)
+
+    def stop(self) -> None:
+        for service in self._worker_services():
+            if callable(stop_op := getattr(service, "stop", None)):
+                stop_op(self)
+
+    def _worker_services(self) -> list[object]:
+        services: list[object] = []
+        for name, service in vars(self.services).items():
+            if name in ("download_queue", "session_processor"):
+                continue
+            if name == "model_manager":
+                services.extend([service.store, service.load])
+            else:
+                services.append(service)
+        return services
+
+
+class ForwardingEventService(EventServiceBase):
+    """Event service used in session worker processes. Events are put on a queue that the main process reads."""
+
+    def __init__(self, event_queue: "ProcessQueue[EventBase]") -> None:
+        super().__init__()
+        self._event_queue = event_queue
+
+    def dispatch(self, event: EventBase) -> None:
+        self._event_queue.put(event)
+
+
+class SessionWorkerProcess:
+    """Handle held by the main process on a worker process that runs sessions on a single execution device."""
+
+    def __init__(
+        self,
+        device: torch.device,
+        config: InvokeAIAppConfig,
+        services_factory: WorkerServicesFactory,
+        event_queue: "ProcessQueue[EventBase]",
+    ) -> None:
+        self.device = device
+        self.item_id: Optional[int] = None
+        self._config = config
+        self._services_factory = services_factory
+        self._event_queue = event_queue
+        self._spawn()
+
+    def _spawn(self) -> None:
+        """Create a new worker process, with its own task and result queues."""
+        # CUDA cannot be re-initialized in a forked process
+        context = multiprocessing.get_context("spawn")
+        self._task_queue: "ProcessQueue[Optional[int]]" = context.Queue()
+        self._result_queue: "ProcessQueue[SessionWorkerResult]" = context.Queue()
+        self._cancel_event = context.Event()
+        self._process = context.Process(
+            name=f"session_worker_{self.device}",
+            target=run_session_worker,
+            kwargs={
+                "device": str(self.device),
+                "config": self._config,
+                "services_factory": self._services_factory,
+                "task_queue": self._task_queue,
+                "result_queue": self._result_queue,
+                "event_queue": self._event_queue,
+                "cancel_event": self._cancel_event,
+            },
+            daemon=True,
+        )
+
+    def start(self) -> None:
+        self._process.start()
+
+    def stop(self) -> None:
+        self._task_queue.put(None)
+
+    def run(self, queue_item: SessionQueueItem) -> None:
+        """Run a queue item in the worker process, blocking until it is finished.
+
+        An error raised while the worker ran the session is re-raised as a SessionWorkerException, or as a
+        DeviceQuarantinedException if the device was quarantined. If the worker process dies while running the session,
+        a new worker process is started for later sessions, and a RuntimeError is raised.
+        """
+        self._cancel_event.clear()
+        self.item_id = queue_item.item_id
+        self._task_queue.put(queue_item.item_id)
+        try:
+            while True:
+                try:
+                    result = self._result_queue.get(timeout=WORKER_LIVENESS_INTERVAL)
+                except Empty:
+                    if not self._process.is_alive():
+                        exitcode = self._process.exitcode
+                        self._spawn()
+                        self.start()
+                        raise RuntimeError(
+                            f"Session worker process for {self.device} exited with code {exitcode}; restarted it"
+                        )
+                    continue
+                if result.quarantined:
+                    raise DeviceQuarantinedException(result.error_message)
+                if result.error_type is not None:
+                    raise SessionWorkerException(
+                        error_type=result.error_type,
+                        error_message=result.error_message or "",
+                        error_traceback=result.error_traceback or "",
+                    )
+                return
+        finally:
+            self.item_id = None
+
+    def cancel(self, item_id: int) -> None:
+        """Cancel the session the worker is running, if it is running the indicated queue item."""
+        if self.item_id == item_id:
+            self._cancel_event.set()
+
+
+def run_session_worker(
+    device: str,
+    config: InvokeAIAppConfig,
+    services_factory: WorkerServicesFactory,
+    task_queue: "ProcessQueue[Optional[int]]",
+    result_queue: "ProcessQueue[SessionWorkerResult]",
+    event_queue: "ProcessQueue[EventBase]",
+    cancel_event: ProcessEvent,
+) -> None:
+    """Entry point of a session worker process. Runs queue items sent by the main process until told to stop."""
+    from invokeai.app.services.session_processor.session_processor_default import DefaultSessionRunner
+
+    # Make the config singleton of this process match the main process, restricted to our device.
+    app_config = get_config()
+    app_config.update_config(config)
+    app_config._root = config._root
+    app_config._config_file = config._config_file
+    app_config.devices = [device]  # type: ignore
+
+    logger = InvokeAILogger.get_logger(f"session_worker:{device}", config=app_config)
+    services = services_factory(config=app_config, events=ForwardingEventService(event_queue), logger=logger)
+    invoker = SessionWorkerInvoker(services)
+    session_runner = DefaultSessionRunner()
+    session_runner.start(services=services)
+    ram_cache = services.model_manager.load.ram_cache
+    logger.info(f"Session worker process started on {device}")
+
+    try:
+        while (item_id := task_queue.get()) is not None:
+            result = SessionWorkerResult(item_id=item_id)
+            try:
+                queue_item = services.session_queue.get_queue_item(item_id)
+                with ram_cache.reserve_execution_device(model_keys=get_model_keys(queue_item.session.graph)):
+                    session_runner.run(queue_item=queue_item, cancel_event=cancel_event)  # type: ignore
+            except Exception as e:
+                # The main process fails or re-queues the item, as it does for exceptions raised by sessions in threads
+                logger.error(f"Error in session worker while running queue item {item_id}: {e}")
+                result = SessionWorkerResult(
+                    item_id=item_id,
+                    error_type=e.__class__.__name__,
+                    error_message=str(e),
+                    error_traceback=traceback.format_exc(),
+                    quarantined=isinstance(e, DeviceQuarantinedException),
+                )
+            finally:
+                result_queue.put(result)
+    finally:
+        invoker.stop()
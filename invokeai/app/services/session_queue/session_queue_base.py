@@ -24,8 +24,13 @@ class SessionQueueBase(ABC):
     """Base class for session queue"""
 
     @abstractmethod
-    def dequeue(self) -> Optional[SessionQueueItem]:
-        """Dequeues the next session queue item."""
+    def dequeue(self, batch_id: Optional[str] = None) -> Optional[SessionQueueItem]:
+        """Dequeues the next session queue item. If a batch id is given, only items of that batch are dequeued."""
+        pass
+
+    @abstractmethod
+    def requeue_queue_item(self, item_id: int) -> SessionQueueItem:
+        """Returns an in-progress queue item to the pending state, so that it runs again."""
         pass
 
     @abstractmethod
@@ -43,6 +48,12 @@ class SessionQueueBase(ABC):
         """Gets the next session queue item (does not dequeue it)"""
         pass
 
+    @abstractmethod
+    def get_pending_queue_items(self, limit: int) -> list[SessionQueueItem]:
+        """Gets up to `limit` pending session queue items of all queues, in the order they will be dequeued (does not
+        dequeue them)"""
+        pass
+
     @abstractmethod
     def clear(self, queue_id: str) -> ClearResult:
         """Deletes all session queue items"""
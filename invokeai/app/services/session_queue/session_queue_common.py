@@ -16,6 +16,7 @@ from pydantic import (
 from pydantic_core import to_jsonable_python
 
 from invokeai.app.invocations.baseinvocation import BaseInvocation
+from invokeai.app.invocations.model import ModelIdentifierField
 from invokeai.app.services.shared.graph import Graph, GraphExecutionState, NodeNotFoundError
 from invokeai.app.services.workflow_records.workflow_records_common import (
     WorkflowWithoutID,
@@ -180,6 +181,46 @@ def get_session(queue_item_dict: dict) -> GraphExecutionState:
     return session
 
 
+def get_model_keys(graph: Graph) -> set[str]:
+    """Return the keys of all the models referenced by the nodes of a graph.
+
+    This picks up model identifiers wherever they appear in node fields, including
+    those nested inside `UNetField`, `CLIPField`, `VAEField` and `LoRAField` values.
+    """
+    return {x.key for x in get_model_identifiers(graph)}
+
+
+def get_invocation_model_keys(invocation: BaseModel) -> set[str]:
+    """Return the keys of all the models referenced by the fields of a single invocation."""
+    return {x.key for x in get_invocation_model_identifiers(invocation)}
+
+
+def get_model_identifiers(graph: Graph) -> list[ModelIdentifierField]:
+    """Return the identifiers of all the models referenced by the nodes of a graph, in node order."""
+    identifiers: list[ModelIdentifierField] = []
+    for node in graph.nodes.values():
+        identifiers.extend(get_invocation_model_identifiers(node))
+    return identifiers
+
+
+def get_invocation_model_identifiers(invocation: BaseModel) -> list[ModelIdentifierField]:
+    """Return the identifiers of all the models referenced by the fields of a single invocation."""
+    identifiers: list[ModelIdentifierField] = []
+
+    def _collect(value: object) -> None:
+        if isinstance(value, ModelIdentifierField):
+            identifiers.append(value)
+        elif isinstance(value, BaseModel):
+            for field_name in value.model_fields:
+                _collect(getattr(value, field_name, None))
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                _collect(item)
+
+    _collect(invocation)
+    return identifiers
+
+
 def get_workflow(queue_item_dict: dict) -> Optional[WorkflowWithoutID]:
     workflow_raw = queue_item_dict.get("workflow", None)
     if workflow_raw is not None:
@@ -33,9 +33,12 @@ class SqliteSessionQueue(SessionQueueBase):
     __conn: sqlite3.Connection
     __cursor: sqlite3.Cursor
     __lock: threading.RLock
+    __startup_maintenance: bool
 
     def start(self, invoker: Invoker) -> None:
         self.__invoker = invoker
+        if not self.__startup_maintenance:
+            return
         self._set_in_progress_to_canceled()
         if self.__invoker.services.configuration.clear_queue_on_startup:
             clear_result = self.clear(DEFAULT_QUEUE_ID)
@@ -46,8 +49,16 @@ class SqliteSessionQueue(SessionQueueBase):
             if prune_result.deleted > 0:
                 self.__invoker.services.logger.info(f"Pruned {prune_result.deleted} finished queue items")
 
-    def __init__(self, db: SqliteDatabase) -> None:
+    def __init__(self, db: SqliteDatabase, startup_maintenance: bool = True) -> None:
+        """
+        Initialize the session queue.
+
+        :param db: The database holding the queue
+        :param startup_maintenance: Cancel stale in-progress items and clear or prune the queue on start. This should
+        be disabled for queues opened by session worker processes, which share the database with the main process.
+        """
         super().__init__()
+        self.__startup_maintenance = startup_maintenance
         self.__lock = db.lock
         self.__conn = db.conn
         self.__cursor = self.__conn.cursor()
@@ -148,21 +159,35 @@ class SqliteSessionQueue(SessionQueueBase):
         self.__invoker.services.events.emit_batch_enqueued(enqueue_result)
         return enqueue_result
 
-    def dequeue(self) -> Optional[SessionQueueItem]:
+    def dequeue(self, batch_id: Optional[str] = None) -> Optional[SessionQueueItem]:
         try:
             self.__lock.acquire()
             self.__cursor.execute(
                 """--sql
                 SELECT *
                 FROM session_queue
-                WHERE status = 'pending'
+                WHERE
+                  status = 'pending'
+                  AND (? IS NULL OR batch_id = ?)
                 ORDER BY
                   priority DESC,
                   item_id ASC
                 LIMIT 1
-                """
+                """,
+                (batch_id, batch_id),
             )
             result = cast(Union[sqlite3.Row, None], self.__cursor.fetchone())
+            if result is not None:
+                # Claim the item while holding the lock, so that concurrent dequeues never get the same item
+                self.__cursor.execute(
+                    """--sql
+                    UPDATE session_queue
+                    SET status = 'in_progress'
+                    WHERE item_id = ?
+                    """,
+                    (result["item_id"],),
+                )
+                self.__conn.commit()
         except Exception:
             self.__conn.rollback()
             raise
@@ -201,6 +226,29 @@ class SqliteSessionQueue(SessionQueueBase):
             return None
         return SessionQueueItem.queue_item_from_dict(dict(result))
 
+    def get_pending_queue_items(self, limit: int) -> list[SessionQueueItem]:
+        try:
+            self.__lock.acquire()
+            self.__cursor.execute(
+                """--sql
+                SELECT *
+                FROM session_queue
+                WHERE status = 'pending'
+                ORDER BY
+                  priority DESC,
+                  item_id ASC
+                LIMIT ?
+                """,
+                (limit,),
+            )
+            results = cast(list[sqlite3.Row], self.__cursor.fetchall())
+        except Exception:
+            self.__conn.rollback()
+            raise
+        finally:
+            self.__lock.release()
+        return [SessionQueueItem.queue_item_from_dict(dict(result)) for result in results]
+
     def get_current(self, queue_id: str) -> Optional[SessionQueueItem]:
         try:
             self.__lock.acquire()
@@ -360,6 +408,13 @@ class SqliteSessionQueue(SessionQueueBase):
             self.__lock.release()
         return PruneResult(deleted=count)
 
+    def requeue_queue_item(self, item_id: int) -> SessionQueueItem:
+        queue_item = self.get_queue_item(item_id)
+        if queue_item.status != "in_progress":
+            # the item was canceled or finished in the meantime
+            return queue_item
+        return self._set_queue_item_status(item_id=item_id, status="pending")
+
     def cancel_queue_item(self, item_id: int) -> SessionQueueItem:
         queue_item = self._set_queue_item_status(item_id=item_id, status="canceled")
         return queue_item
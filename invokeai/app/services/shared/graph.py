@@ -9,6 +9,7 @@ from pydantic import (
     BaseModel,
     GetCoreSchemaHandler,
     GetJsonSchemaHandler,
+    PrivateAttr,
     ValidationError,
     field_validator,
 )
@@ -777,6 +778,9 @@ class GraphExecutionState(BaseModel):
         default_factory=dict,
     )
 
+    # Prepared nodes that have been handed out by `next()` but not yet completed or errored. Not persisted.
+    _executing: set[str] = PrivateAttr(default_factory=set)
+
     @field_validator("graph")
     def graph_is_valid(cls, v: Graph):
         """Validates that the graph is valid"""
@@ -784,10 +788,12 @@ class GraphExecutionState(BaseModel):
         return v
 
     def next(self) -> Optional[BaseInvocation]:
-        """Gets the next node ready to execute."""
+        """Gets the next node ready to execute.
 
-        # TODO: enable multiple nodes to execute simultaneously by tracking currently executing nodes
-        #       possibly with a timeout?
+        Nodes returned by this method are tracked as executing until they are completed or errored, and are not
+        returned again. Calling it again before completing the node gets the next independent ready node, if any, so
+        several nodes may execute simultaneously.
+        """
 
         # If there are no prepared nodes, prepare some nodes
         next_node = self._get_next_node()
@@ -801,6 +807,7 @@ class GraphExecutionState(BaseModel):
 
         # Get values from edges
         if next_node is not None:
+            self._executing.add(next_node.id)
             try:
                 self._prepare_inputs(next_node)
             except ValidationError as e:
@@ -816,6 +823,7 @@ class GraphExecutionState(BaseModel):
             return  # TODO: log error?
 
         # Mark node as executed
+        self._executing.discard(node_id)
         self.executed.add(node_id)
         self.results[node_id] = output
 
@@ -829,8 +837,13 @@ class GraphExecutionState(BaseModel):
 
     def set_node_error(self, node_id: str, error: str):
         """Marks a node as errored"""
+        self._executing.discard(node_id)
         self.errors[node_id] = error
 
+    def is_executing(self) -> bool:
+        """Returns true if any nodes returned by `next()` have not yet been completed or errored"""
+        return len(self._executing) > 0
+
     def is_complete(self) -> bool:
         """Returns true if the graph is complete"""
         node_ids = set(self.graph.nx_graph_flat().nodes)
@@ -1026,6 +1039,13 @@ class GraphExecutionState(BaseModel):
         """Gets the deepest node that is ready to be executed"""
         g = self.execution_graph.nx_graph()
 
+        def is_ready(node_id: str) -> bool:
+            return (
+                node_id not in self.executed
+                and node_id not in self._executing
+                and all((e[0] in self.executed for e in g.in_edges(node_id)))
+            )
+
         # Perform a topological sort using depth-first search
         topo_order = list(nx.dfs_postorder_nodes(g))
 
@@ -1037,17 +1057,17 @@ class GraphExecutionState(BaseModel):
 
         # Prioritize IterateInvocation nodes and their children
         for iterate_node in iterate_nodes:
-            if iterate_node not in self.executed and all((e[0] in self.executed for e in g.in_edges(iterate_node))):
+            if is_ready(iterate_node):
                 return self.execution_graph.nodes[iterate_node]
 
             # Check the children of the IterateInvocation node
             for child_node in nx.dfs_postorder_nodes(g, iterate_node):
-                if child_node not in self.executed and all((e[0] in self.executed for e in g.in_edges(child_node))):
+                if is_ready(child_node):
                     return self.execution_graph.nodes[child_node]
 
         # If no IterateInvocation node or its children are ready, return the first ready node in the topological order
         for node in topo_order:
-            if node not in self.executed and all((e[0] in self.executed for e in g.in_edges(node))):
+            if is_ready(node):
                 return self.execution_graph.nodes[node]
 
         # If no node is found, return None
@@ -539,6 +539,17 @@ class UtilInterface(InvocationContextInterface):
         """
         return self._is_canceled()
 
+    def record_unet_passes(self, unet_passes: int, skipped_unet_passes: int) -> None:
+        """Records the UNet passes of a denoising run in the performance statistics of the current session.
+
+        Args:
+            unet_passes: The number of UNet passes that ran, with one pass per guidance branch and step.
+            skipped_unet_passes: The number of UNet passes that were skipped by guidance truncation.
+        """
+        self._services.performance_statistics.record_unet_passes(
+            self._data.queue_item.session_id, unet_passes, skipped_unet_passes
+        )
+
     def sd_step_callback(self, intermediate_state: PipelineIntermediateState, base_model: BaseModelType) -> None:
         """
         The step callback emits a progress event with the current step, the total number of
@@ -385,6 +385,8 @@ class LoRAModelRaw(RawModel):  # (torch.nn.Module):
     ):
         self._name = name
         self.layers = layers
+        # keys of the modules patched by each layer, per (model class, layer key prefix). See ModelPatcher.apply_lora().
+        self.key_index: Dict[Tuple[type, str], Dict[str, str]] = {}
 
     @property
     def name(self) -> str:
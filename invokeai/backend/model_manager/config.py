@@ -175,6 +175,13 @@ class ModelConfigBase(BaseModel):
         description="The original API response from the source, as stringified JSON.", default=None
     )
     cover_image: Optional[str] = Field(description="Url for image to preview model", default=None)
+    size: Optional[int] = Field(
+        description="Estimated size of the model in memory, in bytes, recorded when the model was probed.", default=None
+    )
+    submodel_sizes: Optional[Dict[SubModelType, int]] = Field(
+        description="Estimated sizes of the model's submodels in memory, in bytes, recorded when the model was probed.",
+        default=None,
+    )
 
     @staticmethod
     def json_schema_extra(schema: dict[str, Any], model_class: Type[BaseModel]) -> None:
@@ -8,7 +8,7 @@ from contextlib import contextmanager
 from dataclasses import dataclass
 from logging import Logger
 from pathlib import Path
-from typing import Any, Dict, Generator, Optional, Tuple
+from typing import Any, Callable, ContextManager, Dict, Generator, Hashable, Optional, Tuple
 
 import torch
 
@@ -81,6 +81,37 @@ class LoadedModelWithoutConfig:
         finally:
             self._locker.unlock()
 
+    @contextmanager
+    def patched_model_on_device(
+        self,
+        patch_key: Optional[Hashable],
+        patch: Callable[[Optional[Dict[str, torch.Tensor]], AnyModel], ContextManager[Any]],
+    ) -> Generator[Tuple[Optional[Dict[str, torch.Tensor]], AnyModel], None, None]:
+        """Like `model_on_device()`, but with patches such as LoRAs applied to the model.
+
+        If the model cache holds a copy of the model patched by an earlier call with an equal patch key, that copy is
+        returned and no patches are applied. Otherwise the patches are applied, and on exit, a copy of the patched model
+        is kept in the cache (room permitting) before the patches are removed.
+
+        :param patch_key: Identifies the patches. Calls with equal keys must apply identical patches. If None, the
+        patched model is not cached.
+        :param patch: Given the model's state dict and the model on the execution device, returns a context manager
+        that applies the patches on entry and removes them on exit.
+        """
+        locked_model = self._locker.lock()
+        try:
+            state_dict = self._locker.get_state_dict()
+            patched_model = self._locker.get_patched(patch_key) if patch_key is not None else None
+            if patched_model is not None:
+                yield (state_dict, patched_model)
+            else:
+                with patch(state_dict, locked_model):
+                    yield (state_dict, locked_model)
+                    if patch_key is not None:
+                        self._locker.put_patched(patch_key, locked_model)
+        finally:
+            self._locker.unlock()
+
     @property
     def model(self) -> AnyModel:
         """Return the model without locking it."""
@@ -1,10 +1,10 @@
 # Copyright (c) 2024, Lincoln D. Stein and the InvokeAI Development Team
 """Default implementation of model loading in InvokeAI."""
 
-import threading
+from contextlib import suppress
 from logging import Logger
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
 
 from invokeai.app.services.config import InvokeAIAppConfig
 from invokeai.backend.model_manager import (
@@ -17,12 +17,15 @@ from invokeai.backend.model_manager.config import DiffusersConfigBase, ModelType
 from invokeai.backend.model_manager.load.convert_cache import ModelConvertCacheBase
 from invokeai.backend.model_manager.load.load_base import LoadedModel, ModelLoaderBase
 from invokeai.backend.model_manager.load.model_cache.model_cache_base import ModelCacheBase, ModelLockerBase
-from invokeai.backend.model_manager.load.model_util import calc_model_size_by_fs
+from invokeai.backend.model_manager.load.model_util import (
+    calc_model_size_by_fs,
+    find_safetensors_files,
+    get_recorded_model_size,
+)
 from invokeai.backend.model_manager.load.optimizations import skip_torch_weight_init
 from invokeai.backend.util.devices import TorchDevice
 
 
-# TO DO: The loader is not thread safe!
 class ModelLoader(ModelLoaderBase):
     """Default implementation of ModelLoaderBase."""
 
@@ -37,7 +40,6 @@ class ModelLoader(ModelLoaderBase):
         self._app_config = app_config
         self._logger = logger
         self._ram_cache = ram_cache
-        self._lock = threading.Lock()
         self._convert_cache = convert_cache
         self._torch_dtype = TorchDevice.choose_torch_dtype()
 
@@ -51,11 +53,22 @@ class ModelLoader(ModelLoaderBase):
         :param model config: Configuration record for this model
         :param submodel_type: an ModelType enum indicating the portion of
                the model to retrieve (e.g. ModelType.Vae)
-        """
-        with self._lock:
-            if model_config.type is ModelType.Main and not submodel_type:
-                raise InvalidModelConfigException("submodel_type is required when loading a main model")
 
+        Models already in the RAM cache are returned without taking any lock. Otherwise, concurrent
+        requests for the same model wait for a single load, while different models load in parallel.
+        """
+        if model_config.type is ModelType.Main and not submodel_type:
+            raise InvalidModelConfigException("submodel_type is required when loading a main model")
+
+        if self._ram_cache.exists(model_config.key, submodel_type):
+            with suppress(IndexError):  # evicted since we checked
+                locker = self._ram_cache.get(
+                    model_config.key, submodel_type, stats_name=self._stats_name(model_config, submodel_type)
+                )
+                return LoadedModel(config=model_config, _locker=locker)
+
+        # Lock on the model rather than the submodel, because converting a checkpoint puts all of its submodels.
+        with self._ram_cache.load_lock(model_config.key):
             model_path = self._get_model_path(model_config)
 
             if not model_path.exists():
@@ -79,27 +92,51 @@ class ModelLoader(ModelLoaderBase):
         model_base = self._app_config.models_path
         return (model_base / config.path).resolve()
 
+    @staticmethod
+    def _stats_name(config: AnyModelConfig, submodel_type: Optional[SubModelType] = None) -> str:
+        return ":".join([config.base, config.type, config.name, (submodel_type or "")])
+
     def _convert_and_load(
         self, config: AnyModelConfig, model_path: Path, submodel_type: Optional[SubModelType] = None
     ) -> ModelLockerBase:
-        stats_name = ":".join([config.base, config.type, config.name, (submodel_type or "")])
+        stats_name = self._stats_name(config, submodel_type)
 
+        # another thread may have loaded the model while we waited for the load lock
         try:
             return self._ram_cache.get(config.key, submodel_type, stats_name=stats_name)
         except IndexError:
             pass
 
         cache_path: Path = self._convert_cache.cache_path(str(model_path))
+        weight_files: Optional[List[Path]] = None
         if self._needs_conversion(config, model_path, cache_path):
             loaded_model = self._do_convert(config, model_path, cache_path, submodel_type)
         else:
             config.path = str(cache_path) if cache_path.exists() else str(self._get_model_path(config))
+            weight_files = self.get_weight_files(config, Path(config.path), submodel_type)
+            mmapped = self._app_config.mmap_safetensors and bool(weight_files)
+            if mmapped:
+                # Memory-mapped weights are read from the weight files as they are used, so the model is built from
+                # its config without its weights, rather than loaded into RAM and then replaced by the mapping.
+                model_skeleton = self._load_model_skeleton(config, submodel_type)
+                if model_skeleton is not None:
+                    assert weight_files is not None
+                    if self._ram_cache.put_mmapped(config.key, model_skeleton, weight_files, submodel_type):
+                        return self._ram_cache.get(config.key, submodel_type, stats_name=stats_name)
+                    # the weight files do not match the model, so it is loaded and cached in RAM
+                    mmapped, weight_files = False, None
+            # Make room for the model before reading it, rather than when it is put in the cache, so that the evicted
+            # models and the new one are not in RAM at the same time. Memory-mapped weights need no room.
+            recorded_size = get_recorded_model_size(config, submodel_type)
+            if recorded_size and not mmapped:
+                self._ram_cache.make_room(recorded_size)
             loaded_model = self._load_model(config, submodel_type)
 
         self._ram_cache.put(
             config.key,
             submodel_type=submodel_type,
             model=loaded_model,
+            weight_files=weight_files,
         )
 
         return self._ram_cache.get(
@@ -111,17 +148,29 @@ class ModelLoader(ModelLoaderBase):
     def get_size_fs(
         self, config: AnyModelConfig, model_path: Path, submodel_type: Optional[SubModelType] = None
     ) -> int:
-        """Get the size of the model on disk."""
+        """Get the size of the model on disk, as recorded in its config if it was."""
+        if (recorded_size := get_recorded_model_size(config, submodel_type)) is not None:
+            return recorded_size
         return calc_model_size_by_fs(
             model_path=model_path,
             subfolder=submodel_type.value if submodel_type else None,
             variant=config.repo_variant if isinstance(config, DiffusersConfigBase) else None,
         )
 
+    def get_weight_files(
+        self, config: AnyModelConfig, model_path: Path, submodel_type: Optional[SubModelType] = None
+    ) -> List[Path]:
+        """Get the safetensors files holding the model's weights, which the RAM cache may memory-map."""
+        return find_safetensors_files(
+            model_path=model_path,
+            subfolder=submodel_type.value if submodel_type else None,
+            variant=config.repo_variant if isinstance(config, DiffusersConfigBase) else None,
+        )
+
     def _do_convert(
         self, config: AnyModelConfig, model_path: Path, cache_path: Path, submodel_type: Optional[SubModelType] = None
     ) -> AnyModel:
-        self.convert_cache.make_room(calc_model_size_by_fs(model_path))
+        self.convert_cache.make_room(config.size if config.size is not None else calc_model_size_by_fs(model_path))
         pipeline = self._convert_model(config, model_path, cache_path if self.convert_cache.max_size > 0 else None)
         if submodel_type:
             # Proactively load the various submodels into the RAM cache so that we don't have to re-convert
@@ -140,6 +189,15 @@ class ModelLoader(ModelLoaderBase):
     def _convert_model(self, config: AnyModelConfig, model_path: Path, output_path: Optional[Path] = None) -> AnyModel:
         raise NotImplementedError
 
+    # This may be implemented in subclasses whose models can be built without their weights
+    def _load_model_skeleton(
+        self,
+        config: AnyModelConfig,
+        submodel_type: Optional[SubModelType] = None,
+    ) -> Optional[AnyModel]:
+        """Return the model built from its config on the meta device, without reading its weights, or None."""
+        return None
+
     # This needs to be implemented in the subclass
     def _load_model(
         self,
@@ -1,6 +1,23 @@
 """Init file for ModelCache."""
 
-from .model_cache_base import ModelCacheBase, CacheStats  # noqa F401
+from .model_cache_base import ModelCacheBase, CacheStats, DeviceProfile  # noqa F401
 from .model_cache_default import ModelCache  # noqa F401
+from .eviction_policy import (  # noqa F401
+    EVICTION_POLICIES,
+    EvictionPolicy,
+    GDSFEvictionPolicy,
+    LRUEvictionPolicy,
+    PinUntilIdleEvictionPolicy,
+)
 
-_all__ = ["ModelCacheBase", "ModelCache", "CacheStats"]
+_all__ = [
+    "ModelCacheBase",
+    "ModelCache",
+    "CacheStats",
+    "DeviceProfile",
+    "EvictionPolicy",
+    "LRUEvictionPolicy",
+    "GDSFEvictionPolicy",
+    "PinUntilIdleEvictionPolicy",
+    "EVICTION_POLICIES",
+]
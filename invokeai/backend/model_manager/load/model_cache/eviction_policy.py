@@ -0,0 +1,100 @@
+"""
+Eviction policies for the model RAM cache.
+
+A policy is told about every model that is put into, retrieved from or removed from the cache,
+and when the cache needs room, it names the models to evict, in order. Recording an access is O(1)
+for all policies, so cache hits cost the same no matter how many models are cached.
+"""
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Iterator, Literal, Mapping, Type
+
+from .model_cache_base import CacheRecord
+
+EVICTION_POLICY = Literal["lru", "gdsf", "pin_until_idle"]
+
+
+class EvictionPolicy(ABC):
+    """Decides which models to evict when the RAM cache needs room."""
+
+    @abstractmethod
+    def touch(self, record: CacheRecord) -> None:
+        """Record that a model was put into the cache or retrieved from it."""
+        pass
+
+    @abstractmethod
+    def remove(self, key: str) -> None:
+        """Record that a model was removed from the cache."""
+        pass
+
+    @abstractmethod
+    def victims(self, records: Mapping[str, CacheRecord]) -> Iterator[str]:
+        """Return the keys of the cached models in the order in which they should be evicted.
+
+        :param records: The cached models, by key. The caller may remove models while iterating.
+        """
+        pass
+
+
+class LRUEvictionPolicy(EvictionPolicy):
+    """Evict the least recently used models first."""
+
+    def __init__(self) -> None:
+        self._order: OrderedDict[str, None] = OrderedDict()
+
+    def touch(self, record: CacheRecord) -> None:
+        self._order[record.key] = None
+        self._order.move_to_end(record.key)
+
+    def remove(self, key: str) -> None:
+        self._order.pop(key, None)
+
+    def victims(self, records: Mapping[str, CacheRecord]) -> Iterator[str]:
+        return iter(list(self._order))
+
+
+class PinUntilIdleEvictionPolicy(LRUEvictionPolicy):
+    """Evict the least recently used models first, but never models that are locked for use on a device.
+
+    Evicting a model while it is in use frees no memory, since its user still holds it, and forces it to be loaded
+    from disk again on its next use.
+    """
+
+    def victims(self, records: Mapping[str, CacheRecord]) -> Iterator[str]:
+        return (x for x in super().victims(records) if x in records and records[x].locks == 0)
+
+
+class GDSFEvictionPolicy(EvictionPolicy):
+    """Greedy-Dual-Size-Frequency: evict models that are used rarely relative to their size first.
+
+    Each model's priority is the cache's inflation value plus its access count divided by its size. The inflation
+    value is raised to the priority of each evicted model, so that models that were used often long ago eventually
+    age out. Small, frequently used models such as LoRAs and embeddings are kept in preference to large ones.
+    """
+
+    def __init__(self) -> None:
+        self._inflation = 0.0
+        self._priority: Dict[str, float] = {}
+        self._frequency: Dict[str, int] = {}
+
+    def touch(self, record: CacheRecord) -> None:
+        frequency = self._frequency.get(record.key, 0) + 1
+        self._frequency[record.key] = frequency
+        self._priority[record.key] = self._inflation + frequency / max(record.size, 1)
+
+    def remove(self, key: str) -> None:
+        self._frequency.pop(key, None)
+        priority = self._priority.pop(key, None)
+        if priority is not None:
+            self._inflation = max(self._inflation, priority)
+
+    def victims(self, records: Mapping[str, CacheRecord]) -> Iterator[str]:
+        return iter(sorted(self._priority, key=self._priority.__getitem__))
+
+
+EVICTION_POLICIES: Dict[str, Type[EvictionPolicy]] = {
+    "lru": LRUEvictionPolicy,
+    "gdsf": GDSFEvictionPolicy,
+    "pin_until_idle": PinUntilIdleEvictionPolicy,
+}
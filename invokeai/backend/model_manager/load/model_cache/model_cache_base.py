@@ -7,16 +7,20 @@ grows larger than a preset maximum, then the least recently used
 model will be cleared and (re)loaded from disk when next needed.
 """
 
+import time
 from abc import ABC, abstractmethod
 from contextlib import contextmanager
 from dataclasses import dataclass, field
 from logging import Logger
-from typing import Dict, Generator, Generic, Optional, Set, TypeVar, Any, Union
+from pathlib import Path
+from typing import Dict, Generator, Generic, Hashable, List, Optional, Set, TypeVar, Any, Union
 
 import torch
 
 from invokeai.backend.model_manager.config import AnyModel, SubModelType
 
+from .quantization import StateDictValue
+
 
 class ModelLockerBase(ABC):
     """Base class for the model locker used by the loader."""
@@ -36,6 +40,16 @@ class ModelLockerBase(ABC):
         """Return the state dict (if any) for the cached model."""
         pass
 
+    @abstractmethod
+    def get_patched(self, patch_key: Hashable) -> Optional[AnyModel]:
+        """Return a copy of the locked model with the indicated patches applied, if one is cached on the execution device."""
+        pass
+
+    @abstractmethod
+    def put_patched(self, patch_key: Hashable, model: AnyModel) -> None:
+        """Keep a copy of the locked model, with the indicated patches applied, on the execution device."""
+        pass
+
     @property
     @abstractmethod
     def model(self) -> Optional[AnyModel]:
@@ -58,6 +72,7 @@ class ModelCacheRecord():
     key: Unique key for each model, same as used in the models database.
     model: Read-only copy of the model *without weights* residing in the "meta device"
     size: Size of the model
+    locks: Number of callers currently using the model on an execution device
 
     Before a model is executed, the state_dict template is copied into VRAM,
     and then injected into the model. When the model is finished, the VRAM
@@ -73,6 +88,7 @@ class ModelCacheRecord():
     key: str
     size: int
     model: AnyModel
+    locks: int = 0  # number of callers currently using the model on an execution device
 
 @dataclass
 class ModelConfigCacheRecord():
@@ -83,6 +99,7 @@ class ModelConfigCacheRecord():
     state_dict: A read-only copy of the model's state dict in RAM. It will be
                 used as a template for creating a copy in the VRAM.
     size: Size of the model
+    locks: Number of callers currently using the model on an execution device
 
     Before a model is executed, the state_dict template is copied into VRAM,
     and then injected into the model. When the model is finished, the VRAM
@@ -98,8 +115,12 @@ class ModelConfigCacheRecord():
     key: str
     size: int
     config: Dict[str, Any]  # configuration for the model
-    state_dict: Dict[str, torch.Tensor]
+    state_dict: Dict[str, StateDictValue]
     cls: type
+    pinned: bool = False  # whether the state_dict is in pinned (page-locked) memory
+    mmapped: bool = False  # whether the state_dict is memory-mapped from the model's safetensors files
+    quantized_size: Optional[int] = None  # the size of the state_dict in RAM, if its weights were quantized
+    locks: int = 0  # number of callers currently using the model on an execution device
 
 CacheRecord = Union[ModelConfigCacheRecord, ModelCacheRecord]
 
@@ -116,6 +137,53 @@ class CacheStats(object):
     loaded_model_sizes: Dict[str, int] = field(default_factory=dict)
 
 
+@dataclass
+class DeviceProfile(object):
+    """Capacity profile of an execution device, used to route sessions to devices that can run them."""
+
+    device: torch.device
+    total_memory: int = 0  # total device memory in bytes; 0 if unknown
+    free_memory: int = 0  # free device memory in bytes, as of the last poll
+    throughput: Optional[float] = None  # matrix multiplication throughput in FLOP/s, as benchmarked; None if unknown
+    errors: int = 0  # consecutive device errors
+    last_oom: Optional[float] = None  # time of the last out-of-memory error
+    quarantined: bool = False  # taken out of service after repeated errors
+    quarantined_at: Optional[float] = None  # time of the quarantine, or of the last failed health probe
+
+    def poll_memory(self) -> None:
+        """Update the memory figures of CUDA devices. Other devices are left unknown."""
+        if self.device.type != "cuda" or not torch.cuda.is_available():
+            return
+        self.free_memory, self.total_memory = torch.cuda.mem_get_info(self.device)
+
+    def probe(self) -> None:
+        """Check that the device responds, by polling its memory and running a small kernel on it.
+
+        May raise a RuntimeError.
+        """
+        self.poll_memory()
+        if self.device.type == "cuda" and torch.cuda.is_available():
+            torch.ones(1, device=self.device).add_(1)
+            torch.cuda.synchronize(self.device)
+
+    def benchmark(self, size: int = 2048, iterations: int = 8) -> None:
+        """Measure the half precision matrix multiplication throughput of CUDA devices. Other devices are left unknown.
+
+        The throughput depends on the device only, unlike the duration of sessions, which depends on their graphs.
+        """
+        if self.device.type != "cuda" or not torch.cuda.is_available():
+            return
+        a = torch.randn(size, size, device=self.device, dtype=torch.float16)
+        b = torch.randn(size, size, device=self.device, dtype=torch.float16)
+        torch.matmul(a, b)  # warm up
+        torch.cuda.synchronize(self.device)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            torch.matmul(a, b)
+        torch.cuda.synchronize(self.device)
+        self.throughput = 2 * size**3 * iterations / (time.perf_counter() - start)
+
+
 class ModelCacheBase(ABC, Generic[T]):
     """Virtual base class for RAM model cache."""
 
@@ -133,8 +201,79 @@ class ModelCacheBase(ABC, Generic[T]):
 
     @contextmanager
     @abstractmethod
-    def reserve_execution_device(self, timeout: int = 0) -> Generator[torch.device, None, None]:
-        """Reserve an execution device (GPU) under the current thread id."""
+    def reserve_execution_device(
+        self, timeout: int = 0, model_keys: Optional[Set[str]] = None, required_memory: int = 0
+    ) -> Generator[torch.device, None, None]:
+        """Reserve an execution device (GPU) under the current thread id.
+
+        :param timeout: Time to wait for a device to become free
+        :param model_keys: Keys of the models that will be used on the device. If provided,
+        the free device that already holds most of these models in VRAM is preferred.
+        :param required_memory: Estimated peak memory needed on the device, in bytes.
+        """
+        pass
+
+    @property
+    @abstractmethod
+    def device_profiles(self) -> Dict[torch.device, "DeviceProfile"]:
+        """Return the capacity profiles of the execution devices."""
+        pass
+
+    @abstractmethod
+    def estimate_model_footprint(self, model_keys: Set[str]) -> int:
+        """Return the combined size of the cached models with the indicated keys."""
+        pass
+
+    @abstractmethod
+    def lock_entry(self, cache_entry: CacheRecord) -> None:
+        """Count a lock on the indicated cache entry. Locked entries are not evicted."""
+        pass
+
+    @abstractmethod
+    def unlock_entry(self, cache_entry: CacheRecord) -> None:
+        """Release a lock taken with lock_entry()."""
+        pass
+
+    @abstractmethod
+    def get_patched(self, cache_entry: CacheRecord, patch_key: Hashable, device: torch.device) -> Optional[AnyModel]:
+        """Return a patched copy of the model on the indicated device, kept by an earlier put_patched() call.
+
+        :param cache_entry: The CacheRecord of the unpatched model
+        :param patch_key: Identifies the patches. Copies put with equal keys must have identical patches applied.
+        :param device: The execution device
+        """
+        pass
+
+    @abstractmethod
+    def put_patched(self, cache_entry: CacheRecord, patch_key: Hashable, device: torch.device, model: AnyModel) -> None:
+        """Keep a copy of a patched model on the indicated device, if it fits in the patched-model cache."""
+        pass
+
+    @abstractmethod
+    def prefetch_to_vram(self, model_keys: Set[str]) -> Optional[torch.device]:
+        """Copy cached models into the VRAM tier of the free execution device that would be chosen to run them.
+
+        :param model_keys: Keys of the models to prefetch.
+        :return: The device the models were copied to, if any.
+        """
+        pass
+
+    @abstractmethod
+    def record_device_error(self, error: BaseException) -> bool:
+        """Count an error raised while running on the current execution device against the device.
+
+        Returns true if the device is quarantined.
+        """
+        pass
+
+    @abstractmethod
+    def record_device_success(self) -> None:
+        """Reset the consecutive error count of the current execution device."""
+        pass
+
+    @abstractmethod
+    def poll_device_health(self) -> None:
+        """Poll the memory of the execution devices, counting failures to respond as device errors."""
         pass
 
     @abstractmethod
@@ -142,9 +281,8 @@ class ModelCacheBase(ABC, Generic[T]):
         """
         Return an execution device that has been reserved for current thread.
 
-        Note that reservations are done using the current thread's TID.
-        It might be better to do this using the session ID, but that involves
-        too many detailed changes to model manager calls.
+        Reservations are bound to the current context, falling back to the
+        current thread's TID.
 
         May generate a ValueError if no GPU has been reserved.
         """
@@ -196,16 +334,43 @@ class ModelCacheBase(ABC, Generic[T]):
         """Make enough room in the cache to accommodate a new model of indicated size."""
         pass
 
+    @contextmanager
+    @abstractmethod
+    def load_lock(self, key: str) -> Generator[None, None, None]:
+        """Serialize the loading of the model with the indicated key.
+
+        Threads loading the same model wait for each other, so that the model is loaded once. Loads of different models
+        proceed in parallel. Callers should check the cache again once they hold the lock.
+
+        :param key: The model's key, without a submodel type
+        """
+        pass
+
     @abstractmethod
     def put(
         self,
         key: str,
         model: T,
         submodel_type: Optional[SubModelType] = None,
+        weight_files: Optional[List[Path]] = None,
     ) -> None:
         """Store model under key and optional submodel_type."""
         pass
 
+    @abstractmethod
+    def put_mmapped(
+        self,
+        key: str,
+        model: T,
+        weight_files: List[Path],
+        submodel_type: Optional[SubModelType] = None,
+    ) -> bool:
+        """Store a model whose weights are memory-mapped from its weight files, returning false if they cannot be.
+
+        The model need not hold its weights: it may have been built on the meta device.
+        """
+        pass
+
     @abstractmethod
     def get(
         self,
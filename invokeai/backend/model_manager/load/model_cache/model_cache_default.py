@@ -24,23 +24,41 @@ import math
 import sys
 import threading
 import time
-from contextlib import contextmanager, suppress
+from collections import OrderedDict
+from contextlib import contextmanager
 from logging import Logger
-from threading import BoundedSemaphore
-from typing import Dict, Generator, List, Optional, Set
+from pathlib import Path
+from typing import Dict, Generator, Hashable, List, Optional, Set, Tuple
 
 import torch
 from diffusers.configuration_utils import ConfigMixin
 
 from invokeai.backend.model_manager import AnyModel, SubModelType
 from invokeai.backend.model_manager.load.memory_snapshot import MemorySnapshot, get_pretty_snapshot_diff
-from invokeai.backend.model_manager.load.model_util import calc_model_size_by_data
+from invokeai.backend.model_manager.load.model_util import calc_model_size_by_data, mmap_safetensors
 from invokeai.backend.util.devices import TorchDevice
 from invokeai.backend.util.logging import InvokeAILogger
 
 from ..optimizations import skip_torch_weight_init
-from .model_cache_base import CacheRecord, ModelCacheRecord, ModelConfigCacheRecord, CacheStats, ModelCacheBase, ModelLockerBase
+from .eviction_policy import EvictionPolicy, LRUEvictionPolicy
+from .model_cache_base import (
+    CacheRecord,
+    CacheStats,
+    DeviceProfile,
+    ModelCacheBase,
+    ModelCacheRecord,
+    ModelConfigCacheRecord,
+    ModelLockerBase,
+)
 from .model_locker import ModelLocker
+from .quantization import (
+    CACHE_QUANTIZATION,
+    QuantizedTensor,
+    StateDictValue,
+    dequantize_state_dict,
+    quantize_state_dict,
+    state_dict_nbytes,
+)
 
 # Maximum size of the cache, in gigs
 # Default is roughly enough to hold three fp16 diffusers models in RAM simultaneously
@@ -61,38 +79,96 @@ class ModelCache(ModelCacheBase[AnyModel]):
         self,
         max_cache_size: float = DEFAULT_MAX_CACHE_SIZE,
         max_vram_cache_size: float = DEFAULT_MAX_VRAM_CACHE_SIZE,
+        max_pinned_cache_size: float = 0.0,
+        max_patched_cache_size: float = 0.0,
+        mmap_weights: bool = False,
         storage_device: torch.device = torch.device("cpu"),
         precision: torch.dtype = torch.float16,
         log_memory_usage: bool = False,
+        device_error_threshold: int = 0,
+        device_quarantine_cooldown: float = 600.0,
+        eviction_policy: Optional[EvictionPolicy] = None,
+        quantization: Optional[CACHE_QUANTIZATION] = None,
         logger: Optional[Logger] = None,
     ):
         """
         Initialize the model RAM cache.
 
         :param max_cache_size: Maximum size of the RAM cache [6.0 GB]
+        :param max_vram_cache_size: Maximum size of the VRAM cache kept on each execution device [0.25 GB]
+        :param max_pinned_cache_size: Maximum size of the RAM cache kept in pinned memory, used only when CUDA is
+            available [0 GB]
+        :param max_patched_cache_size: Maximum size of the patched copies of models (e.g. with LoRAs applied) kept on each
+            execution device for reuse by later sessions [0 GB]
+        :param mmap_weights: If True, the state dicts of models whose weights are stored in safetensors files are
+            memory-mapped from the files instead of held in RAM. Mapped models do not count against max_cache_size.
         :param storage_device: Torch device to save inactive model in [torch.device('cpu')]
         :param precision: Precision for loaded models [torch.float16]
         :param log_memory_usage: If True, a memory snapshot will be captured before and after every model cache
             operation, and the result will be logged (at debug level). There is a time cost to capturing the memory
             snapshots, so it is recommended to disable this feature unless you are actively inspecting the model cache's
             behaviour.
+        :param device_error_threshold: Quarantine an execution device after this many consecutive device errors, as
+            long as another device remains in service. Out-of-memory errors are not counted. Zero never quarantines
+            devices.
+        :param device_quarantine_cooldown: Seconds after which a quarantined device is probed, and returned to service
+            if it responds [600]
+        :param eviction_policy: Policy that chooses which models to evict when the RAM cache is full
+            [LRUEvictionPolicy()]
+        :param quantization: If set, when the RAM cache is full, the weights of the models the eviction policy would
+            evict first are quantized to this 8-bit type, and only models that are already quantized are evicted. The
+            weights are dequantized when the model is moved to an execution device. [None]
         """
         self._precision: torch.dtype = precision
+        self._device_error_threshold = device_error_threshold
+        self._device_quarantine_cooldown = device_quarantine_cooldown
         self._max_cache_size: float = max_cache_size
         self._max_vram_cache_size: float = max_vram_cache_size
+        self._max_patched_cache_size: float = max_patched_cache_size
+        self._max_pinned_cache_size: float = max_pinned_cache_size
+        self._pinned_cache_size: int = 0
+        self._mmap_weights = mmap_weights
+        self._quantization = quantization
         self._storage_device: torch.device = storage_device
         self._ram_lock = threading.Lock()
+        # per-model locks held while a model is loaded from disk, with the number of threads using each
+        self._load_locks_lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._load_lock_users: Dict[str, int] = {}
         self._logger = logger or InvokeAILogger.get_logger(self.__class__.__name__)
         self._log_memory_usage = log_memory_usage
         self._stats: Optional[CacheStats] = None
 
         self._cached_models: Dict[str, CacheRecord[AnyModel]] = {}
-        self._cache_stack: List[str] = []
+        self._cache_bytes: int = 0  # total size of the cached models, maintained as they are added and removed
+        self._eviction_policy: EvictionPolicy = eviction_policy or LRUEvictionPolicy()
 
         # device to thread id
         self._device_lock = threading.Lock()
+        self._device_released = threading.Condition(self._device_lock)
         self._execution_devices: Dict[torch.device, int] = {x: 0 for x in TorchDevice.execution_devices()}
-        self._free_execution_device = BoundedSemaphore(len(self._execution_devices))
+        self._device_profiles: Dict[torch.device, DeviceProfile] = {
+            x: DeviceProfile(device=x) for x in self._execution_devices
+        }
+        # The devices are benchmarked the first time they are ranked, rather than here, since benchmarking creates a
+        # CUDA context on each device. Caches that never choose between devices, like that of the main process when
+        # sessions run in worker processes, never benchmark them.
+        self._devices_benchmarked = False
+
+        # per-device VRAM tier: models that stay resident on an execution device between lockings,
+        # ordered from least to most recently used
+        self._vram_lock = threading.Lock()
+        self._vram_cache: Dict[torch.device, OrderedDict[str, ModelCacheRecord]] = {
+            x: OrderedDict() for x in self._execution_devices
+        }
+        # per-device patched-model tier: copies of models with patches (e.g. LoRAs) applied, keyed by the model's cache
+        # key and the patches, ordered from least to most recently used. Also guarded by the VRAM lock.
+        self._patched_cache: Dict[torch.device, OrderedDict[Tuple[str, Hashable], ModelCacheRecord]] = {
+            x: OrderedDict() for x in self._execution_devices
+        }
+
+        # per-device CUDA streams used to upload pinned state dicts without blocking other work on the device
+        self._copy_streams: Dict[torch.device, torch.cuda.Stream] = {}
 
         self.logger.info(
             f"Using rendering device(s): {', '.join(sorted([str(x) for x in self._execution_devices.keys()]))}"
@@ -118,12 +194,14 @@ class ModelCache(ModelCacheBase[AnyModel]):
         """
         Return an execution device that has been reserved for current thread.
 
-        Note that reservations are done using the current thread's TID.
-        It would be better to do this using the session ID, but that involves
-        too many detailed changes to model manager calls.
+        The device bound to the current context by `reserve_execution_device()`
+        is returned directly. Otherwise, the reservation made by the current
+        thread's TID is looked up.
 
         May generate a ValueError if no GPU has been reserved.
         """
+        if (device := TorchDevice.bound_execution_device()) is not None:
+            return device
         current_thread = threading.current_thread().ident
         assert current_thread is not None
         assigned = [x for x, tid in self._execution_devices.items() if current_thread == tid]
@@ -131,13 +209,42 @@ class ModelCache(ModelCacheBase[AnyModel]):
             raise ValueError(f"No GPU has been reserved for the use of thread {current_thread}")
         return assigned[0]
 
+    @property
+    def device_profiles(self) -> Dict[torch.device, DeviceProfile]:
+        """Return the capacity profiles of the execution devices."""
+        return dict(self._device_profiles)
+
+    def estimate_model_footprint(self, model_keys: Set[str]) -> int:
+        """Return the combined size of the cached models (including all their submodels) with the indicated keys.
+
+        Models that are not yet in the RAM cache do not contribute to the estimate.
+        """
+        with self._ram_lock:
+            return sum(
+                x.size for k, x in self._cached_models.items() if k in model_keys or k.rsplit(":", 1)[0] in model_keys
+            )
+
     @contextmanager
-    def reserve_execution_device(self, timeout: Optional[int] = None) -> Generator[torch.device, None, None]:
+    def reserve_execution_device(
+        self,
+        timeout: Optional[int] = None,
+        model_keys: Optional[Set[str]] = None,
+        required_memory: int = 0,
+    ) -> Generator[torch.device, None, None]:
         """Reserve an execution device (e.g. GPU) for exclusive use by a generation thread.
 
-        Note that the reservation is done using the current thread's TID.
-        It would be better to do this using the session ID, but that involves
-        too many detailed changes to model manager calls.
+        :param timeout: Time to wait for a device to become free
+        :param model_keys: Keys of the models that will be used on the device. If provided,
+        the free device that already holds most of these models in its VRAM cache is chosen.
+        Otherwise the fastest free device, then the one with the least-used VRAM cache, is chosen.
+        :param required_memory: Estimated peak memory needed on the device, in bytes. Only devices
+        that can fit it are considered. If another device could fit it, but it is busy, wait for it.
+
+        May raise a TimeoutError if no suitable device becomes free within the timeout.
+
+        The reservation is recorded under the current thread's TID, and the device
+        is bound to the current context, so that `TorchDevice.choose_torch_device()`
+        finds it without a lookup, including from work started in a copy of the context.
         """
         device = None
         with self._device_lock:
@@ -151,11 +258,22 @@ class ModelCache(ModelCacheBase[AnyModel]):
 
         # no device already assigned. Get one.
         if device is None:
-            self._free_execution_device.acquire(timeout=timeout)
-            with self._device_lock:
-                free_device = [x for x, tid in self._execution_devices.items() if tid == 0]
-                self._execution_devices[free_device[0]] = current_thread
-                device = free_device[0]
+            with self._device_released:
+                self._lift_quarantines()
+                in_service = [x for x in self._execution_devices if not self._device_profiles[x].quarantined]
+                fitting = [x for x in in_service if self._fits(x, required_memory)]
+                if not fitting:
+                    self.logger.warning(
+                        f"No execution device has {(required_memory/GIG):.2f} GB available. Using the largest one."
+                    )
+                    fitting = [max(in_service, key=lambda x: self._device_profiles[x].total_memory)]
+                if not self._device_released.wait_for(
+                    lambda: any(self._execution_devices[x] == 0 for x in fitting), timeout=timeout
+                ):
+                    raise TimeoutError("Timed out waiting for a free execution device")
+                free_device = [x for x in fitting if self._execution_devices[x] == 0]
+                device = self._choose_free_device(free_device, model_keys or set())
+                self._execution_devices[device] = current_thread
 
         # we are outside the lock region now
         self.logger.info(f"Reserved torch device {device} for execution thread {current_thread}")
@@ -163,14 +281,229 @@ class ModelCache(ModelCacheBase[AnyModel]):
         # Tell TorchDevice to use this object to get the torch device.
         TorchDevice.set_model_cache(self)
         try:
-            yield device
+            with TorchDevice.bind_execution_device(device):
+                yield device
         finally:
-            with self._device_lock:
+            with self._device_released:
                 self.logger.info(f"Released torch device {device}")
                 self._execution_devices[device] = 0
-                self._free_execution_device.release()
+                self._device_released.notify_all()
                 torch.cuda.empty_cache()
 
+    def record_device_error(self, error: BaseException) -> bool:
+        """Count an error raised while running on the current execution device against the device.
+
+        Only CUDA errors are counted. Out-of-memory errors usually come from jobs too large for the device, so they are
+        recorded, but not counted. Returns true if the device is quarantined.
+        """
+        if not _is_device_error(error):
+            return False
+        try:
+            device = self.get_execution_device()
+        except ValueError:  # not running on a reserved device
+            return False
+        return self._count_device_error(device, error)
+
+    def record_device_success(self) -> None:
+        """Reset the consecutive error count of the current execution device."""
+        try:
+            device = self.get_execution_device()
+        except ValueError:  # not running on a reserved device
+            return
+        with self._device_lock:
+            if profile := self._device_profiles.get(device):
+                profile.errors = 0
+
+    def poll_device_health(self) -> None:
+        """Poll the memory of the execution devices, counting failures to respond as device errors.
+
+        Quarantined devices whose cooldown has passed are probed, and returned to service if they respond.
+        """
+        with self._device_lock:
+            self._lift_quarantines()
+        for device, profile in self._device_profiles.items():
+            if profile.quarantined:
+                continue
+            try:
+                with self._device_lock:
+                    profile.poll_memory()
+            except RuntimeError as e:
+                self.logger.warning(f"Execution device {device} failed to report its memory: {e}")
+                self._count_device_error(device, e)
+
+    def _count_device_error(self, device: torch.device, error: BaseException) -> bool:
+        with self._device_lock:
+            profile = self._device_profiles.get(device)
+            if profile is None:
+                return False
+            if isinstance(error, torch.cuda.OutOfMemoryError):
+                profile.last_oom = time.time()
+                return profile.quarantined
+            profile.errors += 1
+            in_service = [x for x, p in self._device_profiles.items() if not p.quarantined and x != device]
+            if (
+                not profile.quarantined
+                and self._device_error_threshold > 0
+                and profile.errors >= self._device_error_threshold
+                and in_service
+            ):
+                profile.quarantined = True
+                profile.quarantined_at = time.time()
+                self.logger.error(f"Quarantined execution device {device} after {profile.errors} consecutive errors")
+            return profile.quarantined
+
+    def _lift_quarantines(self) -> None:
+        """Return quarantined devices to service once their cooldown has passed, if they respond to a health probe.
+
+        A device that fails the probe stays quarantined for another cooldown. Call with the device lock held.
+        """
+        now = time.time()
+        for device, profile in self._device_profiles.items():
+            if not profile.quarantined or now - (profile.quarantined_at or 0) < self._device_quarantine_cooldown:
+                continue
+            try:
+                profile.probe()
+            except RuntimeError as e:
+                self.logger.warning(f"Quarantined execution device {device} failed its health probe: {e}")
+                profile.quarantined_at = now
+                continue
+            profile.quarantined = False
+            profile.quarantined_at = None
+            profile.errors = 0
+            self.logger.info(f"Returned execution device {device} to service after its quarantine")
+
+    def lock_entry(self, cache_entry: CacheRecord) -> None:
+        """Count a lock on the indicated cache entry. Locked entries are not evicted."""
+        with self._ram_lock:
+            cache_entry.locks += 1
+
+    def unlock_entry(self, cache_entry: CacheRecord) -> None:
+        """Release a lock taken with lock_entry()."""
+        with self._ram_lock:
+            cache_entry.locks = max(cache_entry.locks - 1, 0)
+
+    def get_patched(self, cache_entry: CacheRecord, patch_key: Hashable, device: torch.device) -> Optional[AnyModel]:
+        """Return a patched copy of the model on the indicated device, kept by an earlier put_patched() call."""
+        with self._vram_lock:
+            patched_cache = self._patched_cache.get(device)
+            if patched_cache is None or (patched_entry := patched_cache.get((cache_entry.key, patch_key))) is None:
+                return None
+            patched_cache.move_to_end((cache_entry.key, patch_key))
+            self.logger.debug(f"Reusing patched {cache_entry.key} resident on {device}")
+            return patched_entry.model
+
+    def put_patched(self, cache_entry: CacheRecord, patch_key: Hashable, device: torch.device, model: AnyModel) -> None:
+        """Keep a copy of a patched model on the indicated device, evicting least recently used patched copies as needed.
+
+        The model is copied, so the caller may unpatch it afterwards.
+        """
+        if device == self._storage_device or device not in self._patched_cache:
+            return
+        if cache_entry.size > self._max_patched_cache_size * GIG:
+            return
+        # The copy is made at the end of a session, when the memory use of the device peaks
+        profile = self._device_profiles[device]
+        profile.poll_memory()
+        if profile.total_memory and profile.free_memory < cache_entry.size:
+            return
+        with self._vram_lock:
+            if (cache_entry.key, patch_key) in self._patched_cache[device]:
+                return
+        # the copy is made on the device, which is much faster than patching the model again
+        patched_model = copy.deepcopy(model)
+        with self._vram_lock:
+            if cache_entry.key not in self._cached_models:  # evicted from RAM in the meantime
+                return
+            patched_cache = self._patched_cache[device]
+            current_size = sum(x.size for x in patched_cache.values())
+            while patched_cache and current_size + cache_entry.size > self._max_patched_cache_size * GIG:
+                _, evicted = patched_cache.popitem(last=False)
+                current_size -= evicted.size
+                self.logger.debug(f"Evicted patched {evicted.key} from {device}")
+            patched_cache[(cache_entry.key, patch_key)] = ModelCacheRecord(
+                key=cache_entry.key, size=cache_entry.size, model=patched_model
+            )
+
+    def prefetch_to_vram(self, model_keys: Set[str]) -> Optional[torch.device]:
+        """Copy cached models into the VRAM tier of the free execution device that would be chosen to run them.
+
+        Nothing is copied if every execution device is reserved, since their memory is in use. The chosen device is
+        reserved by the calling thread while the models are copied, so that no session starts on it in the meantime.
+        Models that are not in the RAM cache, or that do not fit in the VRAM tier, are skipped.
+
+        :param model_keys: Keys of the models to prefetch. All cached submodels of each model are prefetched.
+        :return: The device the models were copied to, if any.
+        """
+        current_thread = threading.current_thread().ident
+        assert current_thread is not None
+        with self._device_lock:
+            free_devices = [
+                x
+                for x, tid in self._execution_devices.items()
+                if tid == 0 and not self._device_profiles[x].quarantined and x in self._vram_cache
+            ]
+            if not free_devices:
+                return None
+            device = self._choose_free_device(free_devices, model_keys)
+            if device == self._storage_device:
+                return None
+            self._execution_devices[device] = current_thread
+        try:
+            with self._ram_lock:
+                cache_entries = [
+                    x for k, x in self._cached_models.items() if k in model_keys or k.rsplit(":", 1)[0] in model_keys
+                ]
+            for cache_entry in cache_entries:
+                if cache_entry.size > self._max_vram_cache_size * GIG:
+                    continue
+                self.model_to_device(cache_entry, device)
+        finally:
+            with self._device_released:
+                self._execution_devices[device] = 0
+                self._device_released.notify_all()
+        return device
+
+    def _choose_free_device(self, free_devices: List[torch.device], model_keys: Set[str]) -> torch.device:
+        """Pick the free device that holds the most of the indicated models, then the fastest, then the least used.
+
+        Devices whose throughput is unknown rank as if they had the mean throughput of the others. Call with the device
+        lock held.
+        """
+        if len(free_devices) > 1 and not self._devices_benchmarked:
+            self._devices_benchmarked = True
+            for profile in self._device_profiles.values():
+                if profile.throughput is None:
+                    profile.benchmark()
+        measured = [x.throughput for x in self._device_profiles.values() if x.throughput is not None]
+        neutral_throughput = sum(measured) / len(measured) if measured else 0.0
+        with self._vram_lock:
+
+            def _score(device: torch.device) -> tuple[int, float, int]:
+                vram_cache = self._vram_cache.get(device, {})
+                warm = sum(1 for x in vram_cache if x in model_keys or x.rsplit(":", 1)[0] in model_keys)
+                throughput = self._device_profiles[device].throughput
+                if throughput is None:
+                    throughput = neutral_throughput
+                return (-warm, -throughput, sum(x.size for x in vram_cache.values()))
+
+            return min(free_devices, key=_score)
+
+    def _fits(self, device: torch.device, required_memory: int) -> bool:
+        """Return true if the device has room for a session needing the indicated memory. Call with the device lock held.
+
+        Memory held by the device's VRAM cache and patched copies of models counts as available, since it can be evicted.
+        """
+        profile = self._device_profiles[device]
+        profile.poll_memory()
+        if not required_memory or not profile.total_memory:  # nothing to fit, or capacity unknown
+            return True
+        if self._execution_devices[device] != 0:  # busy; judge by capacity
+            return required_memory <= profile.total_memory
+        with self._vram_lock:
+            evictable = sum(x.size for x in self._vram_cache.get(device, {}).values())
+            evictable += sum(x.size for x in self._patched_cache.get(device, {}).values())
+        return required_memory <= profile.free_memory + evictable
+
     @property
     def max_cache_size(self) -> float:
         """Return the cap on cache size."""
@@ -190,6 +523,19 @@ class ModelCache(ModelCacheBase[AnyModel]):
     def max_vram_cache_size(self, value: float) -> None:
         """Set the cap on vram cache size."""
         self._max_vram_cache_size = value
+        with self._vram_lock:
+            for device in self._vram_cache:
+                self._make_vram_room(device, 0)
+
+    @property
+    def pinned_cache_size(self) -> int:
+        """Return the total size of the state dicts held in pinned memory."""
+        return self._pinned_cache_size
+
+    def vram_cache_size(self, device: torch.device) -> int:
+        """Get the total size of the models resident in the VRAM cache of the indicated device."""
+        with self._vram_lock:
+            return sum(x.size for x in self._vram_cache.get(device, {}).values())
 
     @property
     def stats(self) -> Optional[CacheStats]:
@@ -202,11 +548,8 @@ class ModelCache(ModelCacheBase[AnyModel]):
         self._stats = stats
 
     def cache_size(self) -> int:
-        """Get the total size of the models currently cached."""
-        total = 0
-        for cache_record in self._cached_models.values():
-            total += cache_record.size
-        return total
+        """Get the total size of the models currently cached, not counting memory-mapped models."""
+        return self._cache_bytes
 
     def exists(
         self,
@@ -217,36 +560,110 @@ class ModelCache(ModelCacheBase[AnyModel]):
         key = self._make_cache_key(key, submodel_type)
         return key in self._cached_models
 
+    @contextmanager
+    def load_lock(self, key: str) -> Generator[None, None, None]:
+        """Serialize the loading of the model with the indicated key."""
+        with self._load_locks_lock:
+            lock = self._load_locks.setdefault(key, threading.Lock())
+            self._load_lock_users[key] = self._load_lock_users.get(key, 0) + 1
+        try:
+            with lock:
+                yield
+        finally:
+            with self._load_locks_lock:
+                self._load_lock_users[key] -= 1
+                if self._load_lock_users[key] == 0:
+                    del self._load_lock_users[key]
+                    del self._load_locks[key]
+
     def put(
         self,
         key: str,
         model: AnyModel,
         submodel_type: Optional[SubModelType] = None,
+        weight_files: Optional[List[Path]] = None,
     ) -> None:
-        """Store model under key and optional submodel_type."""
+        """Store model under key and optional submodel_type.
+
+        :param weight_files: The safetensors files the model's weights were loaded from, if any. When the cache is
+            configured to memory-map weights, the cached state dict is mapped from these files.
+        """
+        key = self._make_cache_key(key, submodel_type)
+        if self.exists(key):
+            return
+        size = calc_model_size_by_data(model)
+
+        # Mapping and pinning the state dict can take a while, so it is done without holding the RAM lock.
+        if isinstance(model, torch.nn.Module):
+            state_dict = model.state_dict()
+            mapped_state_dict = self._mmap_state_dict(key, state_dict, weight_files)
+            mmapped = mapped_state_dict is not None
+            if mapped_state_dict is not None:
+                state_dict = mapped_state_dict
+            pinned = not mmapped and self._reserve_pinned(size)
+            if pinned:
+                state_dict = {k: v.pin_memory() for k, v in state_dict.items()}
+            cache_record: CacheRecord = ModelConfigCacheRecord(
+                key=key,
+                config=model.config,
+                cls=model.__class__,
+                state_dict=state_dict,
+                size=size,
+                pinned=pinned,
+                mmapped=mmapped,
+            )
+        else:
+            cache_record = ModelCacheRecord(
+                key=key,
+                model=model,
+                size=size,
+            )
+
+        self._quantize_for_room(self._ram_size(cache_record))
         with self._ram_lock:
-            key = self._make_cache_key(key, submodel_type)
-            if key in self._cached_models:
+            if key in self._cached_models:  # put by another thread in the meantime
+                if isinstance(cache_record, ModelConfigCacheRecord) and cache_record.pinned:
+                    self._pinned_cache_size -= size
                 return
-            size = calc_model_size_by_data(model)
-            self.make_room(size)
-
-            if isinstance(model, torch.nn.Module):
-                cache_record: CacheRecord = ModelConfigCacheRecord(
-                    key=key,
-                    config=model.config,
-                    cls=model.__class__,
-                    state_dict=model.state_dict(),
-                    size=size,
-                )
-            else:
-                cache_record = ModelCacheRecord(
-                    key=key,
-                    model=model,
-                    size=size,
-                )
+            self._make_room(self._ram_size(cache_record))
             self._cached_models[key] = cache_record
-            self._cache_stack.append(key)
+            self._cache_bytes += self._ram_size(cache_record)
+            self._eviction_policy.touch(cache_record)
+
+    def put_mmapped(
+        self,
+        key: str,
+        model: AnyModel,
+        weight_files: List[Path],
+        submodel_type: Optional[SubModelType] = None,
+    ) -> bool:
+        """Store a model whose weights are memory-mapped from its weight files, returning false if they cannot be.
+
+        Only the model's config, class and state dict layout are used, so the model may have been built on the meta
+        device without reading its weights. Nothing is stored if the weight files do not match the model.
+        """
+        key = self._make_cache_key(key, submodel_type)
+        if self.exists(key):
+            return True
+        if not isinstance(model, torch.nn.Module):
+            return False
+        mapped_state_dict = self._mmap_state_dict(key, model.state_dict(), weight_files)
+        if mapped_state_dict is None:
+            return False
+        cache_record = ModelConfigCacheRecord(
+            key=key,
+            config=model.config,
+            cls=model.__class__,
+            state_dict=mapped_state_dict,
+            size=calc_model_size_by_data(model),
+            mmapped=True,
+        )
+        with self._ram_lock:
+            # memory-mapped models use none of the RAM cache budget
+            if key not in self._cached_models:
+                self._cached_models[key] = cache_record
+                self._eviction_policy.touch(cache_record)
+        return True
 
     def get(
         self,
@@ -286,10 +703,7 @@ class ModelCache(ModelCacheBase[AnyModel]):
                     self.stats.loaded_model_sizes.get(stats_name, 0), cache_entry.size
                 )
 
-            # this moves the entry to the top (right end) of the stack
-            with suppress(Exception):
-                self._cache_stack.remove(key)
-            self._cache_stack.append(key)
+            self._eviction_policy.touch(cache_entry)
             return ModelLocker(
                 cache=self,
                 cache_entry=cache_entry,
@@ -316,6 +730,14 @@ class ModelCache(ModelCacheBase[AnyModel]):
         """
         self.logger.info(f"Called to move {cache_entry.key} to {target_device}")
 
+        # Models that are still resident in the target device's VRAM tier are reused as-is.
+        with self._vram_lock:
+            if vram_entry := self._vram_cache.get(target_device, {}).get(cache_entry.key):
+                self._vram_cache[target_device].move_to_end(cache_entry.key)
+                self.logger.debug(f"Reusing {cache_entry.key} resident on {target_device}")
+                return vram_entry.model
+
+        self._relieve_memory_pressure(target_device, cache_entry.size)
         start_model_to_time = time.time()
         snapshot_before = self._capture_memory_snapshot()
 
@@ -324,6 +746,7 @@ class ModelCache(ModelCacheBase[AnyModel]):
                 model_in_gpu = copy.deepcopy(cache_entry.model)
                 assert hasattr(model_in_gpu, "to")
                 model_in_gpu.to(target_device)
+                self._put_vram(cache_entry, model_in_gpu, target_device)
                 return model_in_gpu
             else:
                 return cache_entry.model  # what happens in CPU stays in CPU
@@ -339,7 +762,13 @@ class ModelCache(ModelCacheBase[AnyModel]):
                 assert hasattr(working_model, 'to')
                 assert hasattr(working_model, 'load_state_dict')
                 working_model.to(device=target_device, dtype=self._precision)
-                working_model.load_state_dict(cache_entry.state_dict)
+                state_dict = cache_entry.state_dict
+                if cache_entry.pinned and target_device.type == "cuda":
+                    self._upload_pinned_state_dict(working_model, state_dict, target_device)
+                elif any(isinstance(v, QuantizedTensor) for v in state_dict.values()):
+                    self._load_quantized_state_dict(working_model, state_dict, target_device)
+                else:
+                    working_model.load_state_dict(state_dict)
             except Exception as e:  # blow away cache entry
                 raise e
 
@@ -374,8 +803,197 @@ class ModelCache(ModelCacheBase[AnyModel]):
                     f" {(cache_entry.size/GIG):.3f} GB.\n"
                     f"{get_pretty_snapshot_diff(snapshot_before, snapshot_after)}"
                 )
+        self._put_vram(cache_entry, working_model, target_device)
         return working_model
 
+    def _mmap_state_dict(
+        self, key: str, state_dict: Dict[str, torch.Tensor], weight_files: Optional[List[Path]]
+    ) -> Optional[Dict[str, torch.Tensor]]:
+        """Return the model's state dict memory-mapped from its weight files, or None if it cannot be mapped.
+
+        The mapped state dict is only used if it holds exactly the tensors of the loaded model. The model loader may
+        have renamed, converted or tied weights, in which case the model is cached in RAM as usual.
+        """
+        if not self._mmap_weights or not weight_files:
+            return None
+        try:
+            mapped = mmap_safetensors(weight_files)
+        except (OSError, ValueError) as e:
+            self.logger.debug(f"Unable to memory-map the weights of {key}: {e}")
+            return None
+        if mapped.keys() != state_dict.keys() or any(mapped[k].shape != v.shape for k, v in state_dict.items()):
+            self.logger.debug(f"The weight files of {key} do not match the loaded model; caching it in RAM")
+            return None
+        self.logger.debug(f"Memory-mapped the weights of {key} from {', '.join(str(x) for x in weight_files)}")
+        return mapped
+
+    @staticmethod
+    def _ram_size(cache_entry: CacheRecord) -> int:
+        """Return the amount of the RAM cache budget used by a cache entry. Memory-mapped models use none."""
+        if isinstance(cache_entry, ModelConfigCacheRecord):
+            if cache_entry.mmapped:
+                return 0
+            if cache_entry.quantized_size is not None:
+                return cache_entry.quantized_size
+        return cache_entry.size
+
+    def _quantizable(self, cache_entry: Optional[CacheRecord]) -> bool:
+        """Return true if the weights of a cached model can be quantized. Call with the RAM lock held."""
+        return (
+            self._quantization is not None
+            and isinstance(cache_entry, ModelConfigCacheRecord)
+            and not cache_entry.mmapped
+            and not cache_entry.pinned
+            and cache_entry.quantized_size is None
+        )
+
+    def _quantize_for_room(self, size: int) -> None:
+        """Quantize the weights of the models that would be evicted first, until there is room for the indicated size.
+
+        Each model is picked under the RAM lock, but quantized without it, since quantizing a model takes a while. Its
+        record is only updated if it is still cached and unquantized by the time the quantized weights are ready.
+        """
+        if self._quantization is None:
+            return
+        while True:
+            with self._ram_lock:
+                if self.cache_size() + size <= self.max_cache_size * GIG:
+                    return
+                candidates = (self._cached_models.get(x) for x in self._eviction_policy.victims(self._cached_models))
+                cache_entry = next((x for x in candidates if self._quantizable(x)), None)
+                if cache_entry is None:
+                    return
+                assert isinstance(cache_entry, ModelConfigCacheRecord)
+                full_state_dict = cache_entry.state_dict
+
+            start = time.time()
+            state_dict = quantize_state_dict(full_state_dict, self._quantization)  # type: ignore[arg-type]
+
+            with self._ram_lock:
+                if (
+                    self._cached_models.get(cache_entry.key) is not cache_entry
+                    or cache_entry.state_dict is not full_state_dict
+                    or not self._quantizable(cache_entry)
+                ):
+                    continue  # evicted or quantized by another thread in the meantime
+                ram_size = self._ram_size(cache_entry)
+                # the size is set first, so that get_state_dict() never hands out the quantized weights for unpatching
+                cache_entry.quantized_size = min(state_dict_nbytes(state_dict), ram_size)
+                cache_entry.state_dict = state_dict
+                freed = ram_size - cache_entry.quantized_size
+                self._cache_bytes -= freed
+                # models resident on the execution devices were made from the full precision weights
+                self._drop_vram(cache_entry.key)
+            self.logger.debug(
+                f"Quantized {cache_entry.key} to {self._quantization} in {(time.time() - start):.2f}s, freeing"
+                f" {(freed/GIG):.2f} GB"
+            )
+
+    def _load_quantized_state_dict(
+        self, model: torch.nn.Module, state_dict: Dict[str, StateDictValue], device: torch.device
+    ) -> None:
+        """Dequantize a state dict into the weights of a model on a device, one tensor at a time.
+
+        Dequantizing the whole state dict first would need room for a second copy of the model on the device.
+        """
+        target = model.state_dict()
+        if target.keys() != state_dict.keys():  # let load_state_dict() report the mismatch
+            model.load_state_dict(dequantize_state_dict(state_dict, device))
+            return
+        with torch.no_grad():
+            for k, v in state_dict.items():
+                target[k].copy_(v.dequantize(device) if isinstance(v, QuantizedTensor) else v)
+
+    def _reserve_pinned(self, size: int) -> bool:
+        """Reserve room for a state dict of the indicated size in the pinned memory budget, returning true if it fits."""
+        if not torch.cuda.is_available():
+            return False
+        with self._ram_lock:
+            if self._pinned_cache_size + size > self._max_pinned_cache_size * GIG:
+                return False
+            self._pinned_cache_size += size
+            return True
+
+    def _upload_pinned_state_dict(
+        self, model: torch.nn.Module, state_dict: Dict[str, torch.Tensor], device: torch.device
+    ) -> None:
+        """Copy a pinned state dict into the weights of a model on a CUDA device, on the device's copy stream.
+
+        The copies are asynchronous, so several devices can upload from the same pinned buffers concurrently.
+        """
+        target = model.state_dict()
+        if target.keys() != state_dict.keys():  # let load_state_dict() report the mismatch
+            model.load_state_dict(state_dict)
+            return
+        with self._device_lock:
+            stream = self._copy_streams.get(device)
+            if stream is None:
+                stream = self._copy_streams[device] = torch.cuda.Stream(device=device)
+        # the model's weights were allocated on the current stream
+        stream.wait_stream(torch.cuda.current_stream(device))
+        with torch.no_grad(), torch.cuda.stream(stream):
+            for k, v in state_dict.items():
+                target[k].copy_(v, non_blocking=True)
+        stream.synchronize()
+
+    def _put_vram(self, cache_entry: CacheRecord, model: AnyModel, device: torch.device) -> None:
+        """Retain a copy of the model on its execution device, evicting least recently used models as needed."""
+        if device == self._storage_device or device not in self._vram_cache:
+            return
+        with self._vram_lock:
+            if cache_entry.key not in self._cached_models:  # evicted from RAM while we were loading
+                return
+            if cache_entry.size > self._max_vram_cache_size * GIG:
+                return
+            self._make_vram_room(device, cache_entry.size)
+            self._vram_cache[device][cache_entry.key] = ModelCacheRecord(
+                key=cache_entry.key, size=cache_entry.size, model=model
+            )
+
+    def _make_vram_room(self, device: torch.device, size: int) -> None:
+        """Evict models from the device's VRAM tier until a model of indicated size fits. Call with the VRAM lock held."""
+        vram_cache = self._vram_cache[device]
+        maximum_size = self._max_vram_cache_size * GIG
+        current_size = sum(x.size for x in vram_cache.values())
+        models_cleared = 0
+        while vram_cache and current_size + size > maximum_size:
+            _, vram_entry = vram_cache.popitem(last=False)
+            current_size -= vram_entry.size
+            models_cleared += 1
+            self.logger.debug(f"Evicted {vram_entry.key} from VRAM cache of {device}")
+        if models_cleared > 0:
+            TorchDevice.empty_cache()
+
+    def _relieve_memory_pressure(self, device: torch.device, size: int) -> None:
+        """Evict device-resident copies of models, patched copies first, until the device has the indicated memory free.
+
+        Only the devices that report their free memory (CUDA devices) are relieved.
+        """
+        profile = self._device_profiles.get(device)
+        if profile is None:
+            return
+        profile.poll_memory()
+        if not profile.total_memory or profile.free_memory >= size:
+            return
+        freed = 0
+        with self._vram_lock:
+            for tier in (self._patched_cache[device], self._vram_cache[device]):
+                while tier and profile.free_memory + freed < size:
+                    _, evicted = tier.popitem(last=False)
+                    freed += evicted.size
+                    self.logger.debug(f"Evicted {evicted.key} from {device} to free memory")
+        if freed:
+            TorchDevice.empty_cache()
+
+    def _drop_vram(self, key: str) -> None:
+        """Remove all device-resident copies of the model with the indicated cache key, patched or not."""
+        with self._vram_lock:
+            for vram_cache in self._vram_cache.values():
+                vram_cache.pop(key, None)
+            for patched_cache in self._patched_cache.values():
+                for patched_key in [x for x in patched_cache if x[0] == key]:
+                    del patched_cache[patched_key]
+
     def print_cuda_stats(self) -> None:
         """Log CUDA diagnostics."""
         vram = "%4.2fG" % (torch.cuda.memory_allocated() / GIG)
@@ -386,6 +1004,15 @@ class ModelCache(ModelCacheBase[AnyModel]):
 
     def make_room(self, size: int) -> None:
         """Make enough room in the cache to accommodate a new model of indicated size."""
+        self._quantize_for_room(size)
+        with self._ram_lock:
+            self._make_room(size)
+
+    def _make_room(self, size: int) -> None:
+        """Make room in the cache by evicting models. The caller must hold the RAM lock.
+
+        Models are quantized before they are evicted, if the cache quantizes, by calling _quantize_for_room() first.
+        """
         # calculate how much memory this model will require
         # multiplier = 2 if self.precision==torch.float32 else 1
         bytes_needed = size
@@ -401,13 +1028,23 @@ class ModelCache(ModelCacheBase[AnyModel]):
         self.logger.debug(f"Before making_room: cached_models={len(self._cached_models)}")
 
         models_cleared = 0
-        while current_size + bytes_needed > maximum_size:
-            model_key = self._cache_stack.pop(0)
-            cache_entry = self._cached_models[model_key]
-            current_size -= cache_entry.size
-            models_cleared += 1
-            self._delete_cache_entry(cache_entry)
-            del cache_entry
+        if current_size + bytes_needed > maximum_size:
+            for model_key in self._eviction_policy.victims(self._cached_models):
+                cache_entry = self._cached_models.get(model_key)
+                if cache_entry is None or self._ram_size(cache_entry) == 0:
+                    continue
+                current_size -= self._ram_size(cache_entry)
+                models_cleared += 1
+                self._delete_cache_entry(cache_entry)
+                del cache_entry
+                if current_size + bytes_needed <= maximum_size:
+                    break
+
+        if current_size + bytes_needed > maximum_size:
+            self.logger.warning(
+                f"Unable to free enough room in the model cache: {(current_size/GIG):.2f}/{self.max_cache_size:.2f} GB"
+                f" in use, need an additional {(bytes_needed/GIG):.2f} GB"
+            )
 
         if models_cleared > 0:
             if self.stats:
@@ -427,9 +1064,20 @@ class ModelCache(ModelCacheBase[AnyModel]):
             raise torch.cuda.OutOfMemoryError
 
     def _delete_cache_entry(self, cache_entry: CacheRecord) -> None:
-        self._cache_stack.remove(cache_entry.key)
+        self._eviction_policy.remove(cache_entry.key)
         del self._cached_models[cache_entry.key]
+        self._cache_bytes -= self._ram_size(cache_entry)
+        self._drop_vram(cache_entry.key)
+        if isinstance(cache_entry, ModelConfigCacheRecord) and cache_entry.pinned:
+            self._pinned_cache_size -= cache_entry.size
 
     @staticmethod
     def _device_name(device: torch.device) -> str:
         return f"{device.type}:{device.index}"
+
+
+def _is_device_error(error: BaseException) -> bool:
+    """Return true if the error indicates a problem with the execution device, rather than with the work given to it."""
+    return isinstance(error, torch.cuda.OutOfMemoryError) or (
+        isinstance(error, RuntimeError) and "CUDA error" in str(error)
+    )
@@ -2,7 +2,7 @@
 Base class and implementation of a class that moves models in and out of VRAM.
 """
 
-from typing import Dict, Optional
+from typing import Dict, Hashable, Optional, cast
 
 import torch
 
@@ -38,26 +38,40 @@ class ModelLocker(ModelLockerBase):
     def get_state_dict(self) -> Optional[Dict[str, torch.Tensor]]:
         """Return the state dict (if any) for the cached model."""
         assert isinstance(self._cache_entry, ModelConfigCacheRecord)
-        return self._cache_entry.state_dict
+        if self._cache_entry.quantized_size is not None:
+            return None  # the quantized weights are not the weights of the model on the device
+        return cast(Dict[str, torch.Tensor], self._cache_entry.state_dict)
+
+    def get_patched(self, patch_key: Hashable) -> Optional[AnyModel]:
+        """Return a copy of the locked model with the indicated patches applied, if one is cached on the execution device."""
+        return self._cache.get_patched(self._cache_entry, patch_key, self._cache.get_execution_device())
+
+    def put_patched(self, patch_key: Hashable, model: AnyModel) -> None:
+        """Keep a copy of the locked model, with the indicated patches applied, on the execution device."""
+        self._cache.put_patched(self._cache_entry, patch_key, self._cache.get_execution_device(), model)
 
     def lock(self) -> AnyModel:
         """Move the model into the execution device (GPU) and lock it."""
+        self._cache.lock_entry(self._cache_entry)
         try:
             device = self._cache.get_execution_device()
             model_on_device = self._cache.model_to_device(self._cache_entry, device)
             self._cache.logger.debug(f"Moved {self._cache_entry.key} to {device}")
             self._cache.print_cuda_stats()
         except torch.cuda.OutOfMemoryError:
+            self._cache.unlock_entry(self._cache_entry)
             self._cache.logger.warning("Insufficient GPU memory to load model. Aborting")
             raise
         except Exception:
+            self._cache.unlock_entry(self._cache_entry)
             raise
 
         return model_on_device
 
-    # It is no longer necessary to move the model out of VRAM
-    # because it will be removed when it goes out of scope
-    # in the caller's context
+    # It is not necessary to move the model out of VRAM. Either it is
+    # retained in the execution device's VRAM cache for reuse, or it
+    # will be removed when it goes out of scope in the caller's context.
     def unlock(self) -> None:
         """Call upon exit from context."""
+        self._cache.unlock_entry(self._cache_entry)
         self._cache.print_cuda_stats()
@@ -0,0 +1,78 @@
+"""
+Quantized storage of cached state dicts.
+
+When the RAM cache needs room, the state dicts of cold models can be quantized to 8 bits instead of being evicted. The
+weight matrices and convolution kernels are stored as int8 or fp8 with one scale per output channel, which halves the
+size of an fp16 model. Vectors such as biases and norms are small and sensitive to rounding, so they are kept as-is.
+Quantized tensors are dequantized to their original dtype on the execution device when the model is loaded into it.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Literal, Mapping, Union
+
+import torch
+
+CACHE_QUANTIZATION = Literal["int8", "fp8"]
+
+_QUANTIZED_DTYPES: Dict[str, torch.dtype] = {"int8": torch.int8, "fp8": torch.float8_e4m3fn}
+
+
+@dataclass
+class QuantizedTensor:
+    """A tensor quantized with one scale per slice along its first dimension."""
+
+    data: torch.Tensor
+    scale: torch.Tensor  # float32, broadcastable to data
+    dtype: torch.dtype  # the dtype of the original tensor
+
+    @property
+    def shape(self) -> torch.Size:
+        return self.data.shape
+
+    def nbytes(self) -> int:
+        return self.data.nelement() * self.data.element_size() + self.scale.nelement() * self.scale.element_size()
+
+    def dequantize(self, device: torch.device) -> torch.Tensor:
+        # move the 8-bit data to the target device before expanding it, so that fewer bytes cross the bus
+        data = self.data.to(device=device, non_blocking=True)
+        return (data.to(torch.float32) * self.scale.to(device=device)).to(self.dtype)
+
+
+StateDictValue = Union[torch.Tensor, QuantizedTensor]
+
+
+def quantize_tensor(tensor: torch.Tensor, quantization: CACHE_QUANTIZATION) -> QuantizedTensor:
+    """Quantize a tensor with a scale per output channel (the first dimension)."""
+    qdtype = _QUANTIZED_DTYPES[quantization]
+    qmax = 127.0 if qdtype == torch.int8 else torch.finfo(qdtype).max
+    values = tensor.to(torch.float32)
+    absmax = values.abs().amax(dim=tuple(range(1, values.dim())), keepdim=True)
+    scale = torch.where(absmax > 0, absmax / qmax, torch.ones_like(absmax))
+    scaled = values / scale
+    if qdtype == torch.int8:
+        data = scaled.round_().clamp_(-127, 127).to(torch.int8)
+    else:
+        data = scaled.to(qdtype)
+    return QuantizedTensor(data=data, scale=scale, dtype=tensor.dtype)
+
+
+def is_quantizable(tensor: torch.Tensor) -> bool:
+    """Return true if a tensor is a floating point weight matrix or kernel that is worth quantizing."""
+    return tensor.dim() >= 2 and tensor.is_floating_point() and tensor.element_size() > 1
+
+
+def quantize_state_dict(
+    state_dict: Mapping[str, torch.Tensor], quantization: CACHE_QUANTIZATION
+) -> Dict[str, StateDictValue]:
+    """Return a copy of a state dict with its weight matrices and kernels quantized."""
+    return {k: quantize_tensor(v, quantization) if is_quantizable(v) else v for k, v in state_dict.items()}
+
+
+def dequantize_state_dict(state_dict: Mapping[str, StateDictValue], device: torch.device) -> Dict[str, torch.Tensor]:
+    """Return a copy of a state dict with its quantized tensors restored to their original dtype on the device."""
+    return {k: v.dequantize(device) if isinstance(v, QuantizedTensor) else v for k, v in state_dict.items()}
+
+
+def state_dict_nbytes(state_dict: Mapping[str, StateDictValue]) -> int:
+    """Return the number of bytes held by the tensors of a state dict."""
+    return sum(v.nbytes() if isinstance(v, QuantizedTensor) else v.nelement() * v.element_size() for v in state_dict.values())
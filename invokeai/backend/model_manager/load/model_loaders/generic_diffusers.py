@@ -5,8 +5,10 @@ import sys
 from pathlib import Path
 from typing import Any, Optional
 
+import torch
 from diffusers.configuration_utils import ConfigMixin
 from diffusers.models.modeling_utils import ModelMixin
+from transformers import PreTrainedModel
 
 from invokeai.backend.model_manager import (
     AnyModel,
@@ -49,6 +51,25 @@ class GenericDiffusersLoader(ModelLoader):
                 raise e
         return result
 
+    def _load_model_skeleton(
+        self,
+        config: AnyModelConfig,
+        submodel_type: Optional[SubModelType] = None,
+    ) -> Optional[AnyModel]:
+        model_path = Path(config.path)
+        load_class = self.get_hf_load_class(model_path, submodel_type)
+        if submodel_type is not None:
+            model_path = model_path / submodel_type.value
+        with torch.device("meta"):
+            if isinstance(load_class, type) and issubclass(load_class, ModelMixin):
+                result = load_class.from_config(load_class.load_config(model_path))
+            elif isinstance(load_class, type) and issubclass(load_class, PreTrainedModel):
+                result = load_class(load_class.config_class.from_pretrained(model_path))
+            else:
+                return None
+        # the size of the cached model is that of the loaded one
+        return result.to(dtype=self._torch_dtype)
+
     # TO DO: Add exception handling
     def get_hf_load_class(self, model_path: Path, submodel_type: Optional[SubModelType] = None) -> ModelMixin:
         """Given the model path and submodel, returns the diffusers ModelMixin subclass needed to load."""
@@ -2,13 +2,15 @@
 """Various utility functions needed by the loader and caching system."""
 
 import json
+import mmap
+import struct
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Set
 
 import torch
 from diffusers import DiffusionPipeline
 
-from invokeai.backend.model_manager.config import AnyModel
+from invokeai.backend.model_manager.config import AnyModel, AnyModelConfig, SubModelType
 from invokeai.backend.onnx.onnx_runtime import IAIOnnxRuntimeModel
 
 
@@ -59,20 +61,7 @@ def calc_model_size_by_fs(model_path: Path, subfolder: Optional[str] = None, var
     if not model_path.exists():
         return 0
 
-    all_files = [f for f in model_path.iterdir() if (model_path / f).is_file()]
-
-    fp16_files = {f for f in all_files if ".fp16." in f.name or ".fp16-" in f.name}
-    bit8_files = {f for f in all_files if ".8bit." in f.name or ".8bit-" in f.name}
-    other_files = set(all_files) - fp16_files - bit8_files
-
-    if not variant:  # ModelRepoVariant.DEFAULT evaluates to empty string for compatability with HF
-        files = other_files
-    elif variant == "fp16":
-        files = fp16_files
-    elif variant == "8bit":
-        files = bit8_files
-    else:
-        raise NotImplementedError(f"Unknown variant: {variant}")
+    files = _variant_files(model_path, variant)
 
     # try read from index if exists
     index_postfix = ".index.json"
@@ -111,3 +100,109 @@ def calc_model_size_by_fs(model_path: Path, subfolder: Optional[str] = None, var
         return model_size
 
     return 0  # scheduler/feature_extractor/tokenizer - models without loading to gpu
+
+
+def calc_submodel_sizes_by_fs(model_path: Path, variant: Optional[str] = None) -> Dict[SubModelType, int]:
+    """Estimate the sizes of the submodels of a diffusers pipeline on disk in bytes, by submodel type.
+
+    Models that are single files, or folders without submodel folders, have no submodels.
+    """
+    if not model_path.is_dir():
+        return {}
+    return {
+        submodel_type: calc_model_size_by_fs(model_path, submodel_type.value, variant)
+        for submodel_type in SubModelType
+        if (model_path / submodel_type.value).is_dir()
+    }
+
+
+def get_recorded_model_size(config: AnyModelConfig, submodel_type: Optional[SubModelType] = None) -> Optional[int]:
+    """Return the size of a model or submodel recorded in its config when it was probed, if any.
+
+    The submodels of checkpoint models are only known once the checkpoint is converted, so they have no recorded size.
+    """
+    if submodel_type is None:
+        return config.size
+    if config.submodel_sizes is None:
+        return None
+    return config.submodel_sizes.get(submodel_type)
+
+
+def _variant_files(model_path: Path, variant: Optional[str] = None) -> Set[Path]:
+    """Return the files in a diffusers model folder that belong to the indicated variant."""
+    all_files = [f for f in model_path.iterdir() if (model_path / f).is_file()]
+
+    fp16_files = {f for f in all_files if ".fp16." in f.name or ".fp16-" in f.name}
+    bit8_files = {f for f in all_files if ".8bit." in f.name or ".8bit-" in f.name}
+    other_files = set(all_files) - fp16_files - bit8_files
+
+    if not variant:  # ModelRepoVariant.DEFAULT evaluates to empty string for compatability with HF
+        return other_files
+    elif variant == "fp16":
+        return fp16_files
+    elif variant == "8bit":
+        return bit8_files
+    else:
+        raise NotImplementedError(f"Unknown variant: {variant}")
+
+
+def find_safetensors_files(
+    model_path: Path, subfolder: Optional[str] = None, variant: Optional[str] = None
+) -> List[Path]:
+    """Return the safetensors files holding the weights of a diffusers model or submodel, or of a single-file model."""
+    if model_path.is_file():
+        return [model_path] if model_path.suffix == ".safetensors" else []
+    if subfolder is not None:
+        model_path = model_path / subfolder
+    if not model_path.exists():
+        return []
+    return sorted(model_path / f for f in _variant_files(model_path, variant) if f.suffix == ".safetensors")
+
+
+# safetensors dtype names
+_SAFETENSORS_DTYPES: Dict[str, torch.dtype] = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+if hasattr(torch, "float8_e4m3fn"):
+    _SAFETENSORS_DTYPES.update({"F8_E4M3": torch.float8_e4m3fn, "F8_E5M2": torch.float8_e5m2})
+
+
+def mmap_safetensors(files: List[Path]) -> Dict[str, torch.Tensor]:
+    """Return the tensors stored in the indicated safetensors files, backed by private memory maps of the files.
+
+    No tensor data is read until it is used. Pages are shared through the OS page cache with every process that maps
+    the same files, and can be dropped by the OS under memory pressure. The tensors must be treated as read-only.
+    Raises a ValueError if a file is not a valid safetensors file.
+    """
+    state_dict: Dict[str, torch.Tensor] = {}
+    for file in files:
+        with open(file, "rb") as f:
+            (header_size,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_size))
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        data_start = 8 + header_size
+        for name, info in header.items():
+            if name == "__metadata__":
+                continue
+            dtype = _SAFETENSORS_DTYPES.get(info["dtype"])
+            if dtype is None:
+                raise ValueError(f"{file}: unsupported dtype {info['dtype']} for tensor {name}")
+            begin, end = info["data_offsets"]
+            shape = info["shape"]
+            if end == begin:
+                state_dict[name] = torch.empty(shape, dtype=dtype)
+                continue
+            # torch.frombuffer() holds a reference to the map, which stays open as long as any of its tensors are alive
+            count = (end - begin) // dtype.itemsize
+            tensor = torch.frombuffer(buffer, dtype=dtype, count=count, offset=data_start + begin)
+            state_dict[name] = tensor.reshape(shape)
+    return state_dict
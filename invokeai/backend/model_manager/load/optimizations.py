@@ -1,8 +1,15 @@
+import threading
 from contextlib import contextmanager
-from typing import Any, Generator
+from typing import Any, Generator, List
 
 import torch
 
+# The patch is shared by all threads: it is applied by the first thread to enter skip_torch_weight_init() and removed
+# by the last one to leave it.
+_patch_lock = threading.Lock()
+_patch_users = 0
+_saved_functions: List[Any] = []
+
 
 def _no_op(*args: Any, **kwargs: Any) -> None:
     pass
@@ -16,16 +23,26 @@ def skip_torch_weight_init() -> Generator[None, None, None]:
     distribution) when __init__ is called. This weight initialization step can take a significant amount of time, and is
     completely unnecessary if the intent is to load checkpoint weights from disk for the layer. This context manager
     monkey-patches common torch layers to skip the weight initialization step.
+
+    The context manager may be entered by several threads at once. The layers stay patched until the last of them
+    leaves it.
     """
+    global _patch_users, _saved_functions
     torch_modules = [torch.nn.Linear, torch.nn.modules.conv._ConvNd, torch.nn.Embedding]
-    saved_functions = [hasattr(m, "reset_parameters") and m.reset_parameters for m in torch_modules]
 
+    with _patch_lock:
+        if _patch_users == 0:
+            _saved_functions = [hasattr(m, "reset_parameters") and m.reset_parameters for m in torch_modules]
+            for torch_module in torch_modules:
+                assert hasattr(torch_module, "reset_parameters")
+                torch_module.reset_parameters = _no_op
+        _patch_users += 1
     try:
-        for torch_module in torch_modules:
-            assert hasattr(torch_module, "reset_parameters")
-            torch_module.reset_parameters = _no_op
         yield None
     finally:
-        for torch_module, saved_function in zip(torch_modules, saved_functions, strict=True):
-            assert hasattr(torch_module, "reset_parameters")
-            torch_module.reset_parameters = saved_function
+        with _patch_lock:
+            _patch_users -= 1
+            if _patch_users == 0:
+                for torch_module, saved_function in zip(torch_modules, _saved_functions, strict=True):
+                    assert hasattr(torch_module, "reset_parameters")
+                    torch_module.reset_parameters = saved_function
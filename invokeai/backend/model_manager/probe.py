@@ -26,6 +26,7 @@ from .config import (
     ModelVariantType,
     SchedulerPredictionType,
 )
+from .load.model_util import calc_model_size_by_fs, calc_submodel_sizes_by_fs
 from .util.model_util import lora_token_vector_length, read_checkpoint_meta
 
 CkptType = Dict[str | int, Any]
@@ -174,6 +175,16 @@ class ModelProbe(object):
         if format_type == ModelFormat.Diffusers and isinstance(probe, FolderProbeBase):
             fields["repo_variant"] = fields.get("repo_variant") or probe.get_repo_variant()
 
+        # Record the sizes of the model and its submodels, so that loading and scheduling decisions need not walk the
+        # model's files.
+        if fields.get("size") is None:
+            variant = fields.get("repo_variant")
+            submodel_sizes = calc_submodel_sizes_by_fs(model_path, variant)
+            fields["submodel_sizes"] = submodel_sizes or None
+            fields["size"] = (
+                sum(submodel_sizes.values()) if submodel_sizes else calc_model_size_by_fs(model_path, None, variant)
+            )
+
         # additional fields needed for main and controlnet models
         if (
             fields["type"] in [ModelType.Main, ModelType.ControlNet, ModelType.VAE]
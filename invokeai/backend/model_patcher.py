@@ -5,10 +5,11 @@ from __future__ import annotations
 
 import pickle
 from contextlib import contextmanager
-from typing import Any, Dict, Generator, Iterator, List, Optional, Tuple, Union
+from typing import Any, Callable, Dict, Generator, Iterator, List, Optional, Tuple, Union
 
 import numpy as np
 import torch
+import torch.nn.functional as F
 from diffusers import OnnxRuntimeModel, UNet2DConditionModel
 from transformers import CLIPTextModel, CLIPTextModelWithProjection, CLIPTokenizer
 
@@ -17,7 +18,7 @@ from invokeai.backend.model_manager import AnyModel
 from invokeai.backend.model_manager.load.optimizations import skip_torch_weight_init
 from invokeai.backend.onnx.onnx_runtime import IAIOnnxRuntimeModel
 
-from .lora import LoRAModelRaw
+from .lora import AnyLoRALayer, LoRALayer, LoRAModelRaw
 from .textual_inversion import TextualInversionManager, TextualInversionModelRaw
 
 """
@@ -60,6 +61,24 @@ class ModelPatcher:
 
         return (module_key, module)
 
+    @classmethod
+    def _get_lora_key_index(cls, model: torch.nn.Module, lora: LoRAModelRaw, prefix: str) -> Dict[str, str]:
+        """Return the keys of the model's modules patched by the LoRA's layers with the indicated prefix.
+
+        Resolving LoRA keys against a model is slow, so the index is built once per model class and prefix, and kept
+        with the LoRA in the model cache.
+        """
+        index_key = (type(model), prefix)
+        key_index = lora.key_index.get(index_key)
+        if key_index is None:
+            key_index = {
+                layer_key: cls._resolve_lora_key(model, layer_key, prefix)[0]
+                for layer_key in lora.layers
+                if layer_key.startswith(prefix)
+            }
+            lora.key_index[index_key] = key_index
+        return key_index
+
     @classmethod
     @contextmanager
     def apply_lora_unet(
@@ -67,12 +86,14 @@ class ModelPatcher:
         unet: UNet2DConditionModel,
         loras: Iterator[Tuple[LoRAModelRaw, float]],
         model_state_dict: Optional[Dict[str, torch.Tensor]] = None,
+        runtime: bool = False,
     ) -> Generator[None, None, None]:
         with cls.apply_lora(
             unet,
             loras=loras,
             prefix="lora_unet_",
             model_state_dict=model_state_dict,
+            runtime=runtime,
         ):
             yield
 
@@ -83,8 +104,11 @@ class ModelPatcher:
         text_encoder: CLIPTextModel,
         loras: Iterator[Tuple[LoRAModelRaw, float]],
         model_state_dict: Optional[Dict[str, torch.Tensor]] = None,
+        runtime: bool = False,
     ) -> Generator[None, None, None]:
-        with cls.apply_lora(text_encoder, loras=loras, prefix="lora_te_", model_state_dict=model_state_dict):
+        with cls.apply_lora(
+            text_encoder, loras=loras, prefix="lora_te_", model_state_dict=model_state_dict, runtime=runtime
+        ):
             yield
 
     @classmethod
@@ -95,6 +119,7 @@ class ModelPatcher:
         loras: Iterator[Tuple[LoRAModelRaw, float]],
         prefix: str,
         model_state_dict: Optional[Dict[str, torch.Tensor]] = None,
+        runtime: bool = False,
     ) -> Generator[None, None, None]:
         """
         Apply one or more LoRAs to a model.
@@ -103,35 +128,51 @@ class ModelPatcher:
         :param loras: An iterator that returns the LoRA to patch in and its patch weight.
         :param prefix: A string prefix that precedes keys used in the LoRAs weight layers.
         :model_state_dict: Read-only copy of the model's state dict in CPU, for unpatching purposes.
+        :param runtime: If True, LoRA and LoCon layers patching linear and convolution modules are applied by forward
+            hooks that add their low-rank outputs to the modules' outputs, instead of being merged into the modules'
+            weights. This needs no full-size delta or restore copy of each weight. Other layers are always merged.
         """
         original_weights = {}
+        hook_handles = []
         try:
             with torch.no_grad():
+                assert isinstance(model, torch.nn.Module)
+                # Group the layers of all the LoRAs by the module they patch, so that the deltas of stacked LoRAs are
+                # summed and added to each module's weight once.
+                patches: Dict[str, Tuple[torch.nn.Module, List[Tuple[AnyLoRALayer, float]]]] = {}
                 for lora, lora_weight in loras:
                     # assert lora.device.type == "cpu"
+                    key_index = cls._get_lora_key_index(model, lora, prefix)
                     for layer_key, layer in lora.layers.items():
                         if not layer_key.startswith(prefix):
                             continue
+                        module_key = key_index[layer_key]
+                        if module_key not in patches:
+                            try:
+                                module = model.get_submodule(module_key)
+                            except AttributeError:  # the index was built for another model of the same class
+                                module_key, module = cls._resolve_lora_key(model, layer_key, prefix)
+                                key_index[layer_key] = module_key
+                            patches.setdefault(module_key, (module, []))
+                        patches[module_key][1].append((layer, lora_weight))
+
+                for module_key, (module, layers) in patches.items():
+                    if runtime and (hook := cls._make_lora_forward_hook(module, layers)) is not None:
+                        hook_handles.append(module.register_forward_hook(hook))
+                        continue
 
-                        # TODO(ryand): A non-negligible amount of time is currently spent resolving LoRA keys. This
-                        # should be improved in the following ways:
-                        # 1. The key mapping could be more-efficiently pre-computed. This would save time every time a
-                        #    LoRA model is applied.
-                        # 2. From an API perspective, there's no reason that the `ModelPatcher` should be aware of the
-                        #    intricacies of Stable Diffusion key resolution. It should just expect the input LoRA
-                        #    weights to have valid keys.
-                        assert isinstance(model, torch.nn.Module)
-                        module_key, module = cls._resolve_lora_key(model, layer_key, prefix)
-
-                        # All of the LoRA weight calculations will be done on the same device as the module weight.
-                        # (Performance will be best if this is a CUDA device.)
-                        device = module.weight.device
-                        dtype = module.weight.dtype
-
-                        if module_key not in original_weights:
-                            if model_state_dict is None:  # no CPU copy of the state dict was provided
-                                original_weights[module_key] = module.weight.detach().to(device="cpu", copy=True)
+                    # All of the LoRA weight calculations will be done on the same device as the module weight.
+                    # (Performance will be best if this is a CUDA device.)
+                    device = module.weight.device
+                    dtype = module.weight.dtype
+
+                    if model_state_dict is not None:  # we were provided with the CPU copy of the state dict
+                        original_weights[module_key] = model_state_dict[module_key + ".weight"]
+                    else:
+                        original_weights[module_key] = module.weight.detach().to(device="cpu", copy=True)
 
+                    delta = None
+                    for layer, lora_weight in layers:
                         layer_scale = layer.alpha / layer.rank if (layer.alpha and layer.rank) else 1.0
 
                         # We intentionally move to the target device first, then cast. Experimentally, this was found to
@@ -150,20 +191,88 @@ class ModelPatcher:
                             assert hasattr(layer_weight, "reshape")
                             layer_weight = layer_weight.reshape(module.weight.shape)
 
-                        assert isinstance(layer_weight, torch.Tensor)  # mypy thinks layer_weight is a float|Any ??!
-                        module.weight += layer_weight.to(dtype=dtype, non_blocking=True)
+                        # the deltas are summed in float32, and rounded to the module's dtype once
+                        delta = layer_weight if delta is None else delta + layer_weight
+
+                    assert isinstance(delta, torch.Tensor)
+                    module.weight += delta.to(dtype=dtype, non_blocking=True)
 
             yield  # wait for context manager exit
 
         finally:
-            # LS check: for now, we are not reusing models in VRAM but re-copying them each time they are needed.
-            # Therefore it should not be necessary to copy the original model weights back.
-            # This needs to be fixed before resurrecting the VRAM cache.
+            for handle in hook_handles:
+                handle.remove()
+            # Models may be retained in the execution device's VRAM cache and reused by later sessions, so the
+            # original weights must always be copied back.
             assert hasattr(model, "get_submodule")  # mypy not picking up fact that torch.nn.Module has get_submodule()
             with torch.no_grad():
                 for module_key, weight in original_weights.items():
                     model.get_submodule(module_key).weight.copy_(weight, non_blocking=True)
 
+    @staticmethod
+    def _make_lora_forward_hook(
+        module: torch.nn.Module, layers: List[Tuple[AnyLoRALayer, float]]
+    ) -> Optional[Callable[[torch.nn.Module, Tuple[Any, ...], torch.Tensor], torch.Tensor]]:
+        """Return a forward hook that adds `up(down(x)) * scale` for each of the layers to the module's output, or None
+        if the layers must be merged into the module's weight instead.
+
+        Only LoRA and LoCon layers patching linear and (ungrouped, zero-padded) 2D convolution modules are supported.
+        The factors are copied to the module's device and dtype once, when the hook is made.
+        """
+        device = module.weight.device
+        dtype = module.weight.dtype
+
+        def to_module(t: torch.Tensor, scale: float = 1.0) -> torch.Tensor:
+            # move to the target device first, then cast, as in apply_lora()
+            return (t.to(device=device) * scale).to(dtype=dtype)
+
+        factors: List[Tuple[torch.Tensor, Optional[torch.Tensor], torch.Tensor]] = []
+        for layer, lora_weight in layers:
+            if not isinstance(layer, LoRALayer):
+                return None
+            scale = lora_weight * (layer.alpha / layer.rank if (layer.alpha and layer.rank) else 1.0)
+            rank = layer.down.shape[0]
+            if isinstance(module, torch.nn.Linear):
+                down = layer.down.reshape(rank, -1)
+                up = layer.up.reshape(layer.up.shape[0], -1)
+                if layer.mid is not None or down.shape[1] != module.in_features or up.shape != (module.out_features, rank):
+                    return None
+                factors.append((to_module(down), None, to_module(up, scale)))
+            elif isinstance(module, torch.nn.Conv2d):
+                if module.groups != 1 or module.padding_mode != "zeros" or layer.up.dim() != 4:
+                    return None
+                up = layer.up.reshape(layer.up.shape[0], layer.up.shape[1], 1, 1)
+                if layer.mid is not None:
+                    down = layer.down.reshape(rank, layer.down.shape[1], 1, 1)
+                    mid: Optional[torch.Tensor] = layer.mid
+                    kernel_size = tuple(layer.mid.shape[2:])
+                else:
+                    down = layer.down
+                    mid = None
+                    kernel_size = tuple(down.shape[2:])
+                if down.dim() != 4 or kernel_size != module.kernel_size or down.shape[1] != module.in_channels:
+                    return None
+                factors.append((to_module(down), None if mid is None else to_module(mid), to_module(up, scale)))
+            else:
+                return None
+
+        def hook(module: torch.nn.Module, args: Tuple[Any, ...], output: torch.Tensor) -> torch.Tensor:
+            x = args[0]
+            for down, mid, up in factors:
+                if isinstance(module, torch.nn.Linear):
+                    output = output + F.linear(F.linear(x, down), up)
+                    continue
+                assert isinstance(module, torch.nn.Conv2d)
+                if mid is None:
+                    h = F.conv2d(x, down, stride=module.stride, padding=module.padding, dilation=module.dilation)
+                else:
+                    h = F.conv2d(x, down)
+                    h = F.conv2d(h, mid, stride=module.stride, padding=module.padding, dilation=module.dilation)
+                output = output + F.conv2d(h, up)
+            return output
+
+        return hook
+
     @classmethod
     @contextmanager
     def apply_ti(
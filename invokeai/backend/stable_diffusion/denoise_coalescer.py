@@ -0,0 +1,112 @@
+"""
+Coalesce the denoising of several sessions into shared UNet batches.
+
+A group of sessions that run side by side on the same execution device each enter the group with `member()`. Members
+take turns running their nodes, so that they never use the device's models at the same time. When a member reaches a
+denoising step it calls `run()`, which hands its turn to the next member. Once every member still running is waiting in
+`run()`, the requests are grouped by their batch key and each group is denoised as a single batch by the member holding
+the turn. Each member then resumes with its own slice of the result.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from threading import Condition, Lock
+from typing import Any, Callable, Generator, Generic, Hashable, List, Optional, TypeVar, Union
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# The coalescing group of the session running in the current thread, if any
+_current_coalescer: ContextVar[Optional["DenoiseCoalescer"]] = ContextVar("current_coalescer", default=None)
+
+
+@dataclass
+class _Pending(Generic[T, R]):
+    key: Hashable
+    request: T
+    run_batch: Callable[[List[T]], List[Union[R, BaseException]]]
+    done: bool = False
+    result: Any = field(default=None)
+
+
+class DenoiseCoalescer:
+    """Rendezvous point for the denoising requests of a group of sessions sharing an execution device."""
+
+    def __init__(self, size: int):
+        """
+        :param size: The number of sessions in the group. Each must enter the group with `member()`.
+        """
+        self._active = size
+        self._turn = Lock()
+        self._condition = Condition()
+        self._pending: List[_Pending[Any, Any]] = []
+
+    @classmethod
+    def current(cls) -> Optional["DenoiseCoalescer"]:
+        """Return the coalescing group of the session running in the current thread, if any."""
+        return _current_coalescer.get()
+
+    @contextmanager
+    def member(self) -> Generator[None, None, None]:
+        """Run the body as a member of the group, holding the group's turn except while waiting in `run()`."""
+        token = _current_coalescer.set(self)
+        self._turn.acquire()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._active -= 1
+                self._run_pending_if_ready()
+            self._turn.release()
+            _current_coalescer.reset(token)
+
+    def run(
+        self,
+        key: Hashable,
+        request: T,
+        run_batch: Callable[[List[T]], List[Union[R, BaseException]]],
+    ) -> R:
+        """Add a request to the next batch with the same key, wait for the batch to run and return this request's result.
+
+        Must be called by a member of the group, holding its turn.
+
+        :param key: Only requests with equal keys are batched together.
+        :param request: The request.
+        :param run_batch: Runs a batch of requests, returning a result or an exception for each, in order. The function
+        passed with the first request of a batch is used to run it.
+        """
+        pending = _Pending(key=key, request=request, run_batch=run_batch)
+        with self._condition:
+            self._pending.append(pending)
+            ran = self._run_pending_if_ready()
+        if not ran:
+            # let the other members run until they reach their own denoising step, or finish
+            self._turn.release()
+            try:
+                with self._condition:
+                    self._condition.wait_for(lambda: pending.done)
+            finally:
+                self._turn.acquire()
+        if isinstance(pending.result, BaseException):
+            raise pending.result
+        return pending.result
+
+    def _run_pending_if_ready(self) -> bool:
+        """Run the pending requests if every active member is waiting on one. Call with the condition and turn held."""
+        if not self._pending or len(self._pending) < self._active:
+            return False
+        pending, self._pending = self._pending, []
+        batches: dict[Hashable, List[_Pending[Any, Any]]] = {}
+        for p in pending:
+            batches.setdefault(p.key, []).append(p)
+        for batch in batches.values():
+            try:
+                results = batch[0].run_batch([p.request for p in batch])
+            except BaseException as e:
+                results = [e] * len(batch)
+            for p, result in zip(batch, results, strict=True):
+                p.result = result
+                p.done = True
+        self._condition.notify_all()
+        return True
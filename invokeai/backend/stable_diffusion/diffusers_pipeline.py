@@ -23,7 +23,10 @@ from transformers import CLIPFeatureExtractor, CLIPTextModel, CLIPTokenizer
 from invokeai.app.services.config.config_default import get_config
 from invokeai.backend.stable_diffusion.diffusion.conditioning_data import IPAdapterData, TextConditioningData
 from invokeai.backend.stable_diffusion.diffusion.shared_invokeai_diffusion import InvokeAIDiffuserComponent
+from invokeai.backend.stable_diffusion.diffusion.token_merging import TokenMergingSettings
 from invokeai.backend.stable_diffusion.diffusion.unet_attention_patcher import UNetAttentionPatcher, UNetIPAdapterData
+from invokeai.backend.stable_diffusion.diffusion.unet_feature_cache import GuidanceBranch, UNetFeatureCache
+from invokeai.backend.stable_diffusion.unet_compiler import UNetCompiler, get_unet_compiler
 from invokeai.backend.util.attention import auto_detect_slice_size
 from invokeai.backend.util.devices import TorchDevice
 
@@ -216,6 +219,8 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
         self.invokeai_diffuser = InvokeAIDiffuserComponent(self.unet, self._unet_forward)
         self.control_model = control_model
         self.use_ip_adapter = False
+        self._unet_compiler: Optional[UNetCompiler] = None
+        self._feature_cache: Optional[UNetFeatureCache] = None
 
     def _adjust_memory_efficient_attention(self, latents: torch.Tensor):
         """
@@ -299,6 +304,7 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
         masked_latents: Optional[torch.Tensor] = None,
         gradient_mask: Optional[bool] = False,
         seed: int,
+        feature_reuse_interval: int = 1,
     ) -> torch.Tensor:
         if init_timestep.shape[0] == 0:
             return latents
@@ -346,6 +352,7 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
                 ip_adapter_data=ip_adapter_data,
                 t2i_adapter_data=t2i_adapter_data,
                 callback=callback,
+                feature_reuse_interval=feature_reuse_interval,
             )
         finally:
             self.invokeai_diffuser.model_forward_callback = self._unet_forward
@@ -374,8 +381,22 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
         ip_adapter_data: Optional[list[IPAdapterData]] = None,
         t2i_adapter_data: Optional[list[T2IAdapterData]] = None,
         callback: Callable[[PipelineIntermediateState], None] = None,
+        feature_reuse_interval: int = 1,
     ) -> torch.Tensor:
         self._adjust_memory_efficient_attention(latents)
+        self._feature_cache = UNetFeatureCache(self.unet, feature_reuse_interval) if feature_reuse_interval > 1 else None
+        config = get_config()
+        token_merging = (
+            TokenMergingSettings(config.token_merging_ratios, latents.shape[-2], latents.shape[-1])
+            if config.token_merging_ratios and any(ratio > 0 for ratio in config.token_merging_ratios)
+            else None
+        )
+        compile_mode = config.unet_compile_mode
+        # the compiled UNet would not see the patched forwards of the feature cache, and the merging attention
+        # processors are new objects in each run, which would recompile it every time
+        use_compiler = compile_mode != "off" and self._feature_cache is None and token_merging is None
+        unet_compiler = get_unet_compiler(compile_mode) if use_compiler else None
+        self._unet_compiler = unet_compiler if unet_compiler is not None and unet_compiler.supports(self.unet) else None
         if additional_guidance is None:
             additional_guidance = []
 
@@ -392,16 +413,20 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
         self.use_ip_adapter = use_ip_adapter
         attn_ctx = nullcontext()
 
-        if use_ip_adapter or use_regional_prompting:
+        if use_ip_adapter or use_regional_prompting or token_merging is not None:
             ip_adapters: Optional[List[UNetIPAdapterData]] = (
                 [{"ip_adapter": ipa.ip_adapter_model, "target_blocks": ipa.target_blocks} for ipa in ip_adapter_data]
                 if use_ip_adapter
                 else None
             )
-            unet_attention_patcher = UNetAttentionPatcher(ip_adapters)
+            # Token merging alone only needs the self-attention processors, so the others keep the attention type
+            unet_attention_patcher = UNetAttentionPatcher(
+                ip_adapters, token_merging, keep_other_processors=not use_ip_adapter and not use_regional_prompting
+            )
             attn_ctx = unet_attention_patcher.apply_ip_adapter_attention(self.invokeai_diffuser.model)
+        feature_cache_ctx = self._feature_cache.apply() if self._feature_cache is not None else nullcontext()
 
-        with attn_ctx:
+        with attn_ctx, feature_cache_ctx:
             if callback is not None:
                 callback(
                     PipelineIntermediateState(
@@ -461,6 +486,8 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
     ):
         # invokeai_diffuser has batched timesteps, but diffusers schedulers expect a single value
         timestep = t[0]
+        if self._feature_cache is not None:
+            self._feature_cache.begin_step(step_index)
         if additional_guidance is None:
             additional_guidance = []
 
@@ -572,6 +599,7 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
         t,
         text_embeddings,
         cross_attention_kwargs: Optional[dict[str, Any]] = None,
+        guidance_branch: Optional[GuidanceBranch] = None,
         **kwargs,
     ):
         """predict the noise residual"""
@@ -586,6 +614,14 @@ class StableDiffusionGeneratorPipeline(StableDiffusionPipeline):
                 initial_image_latents=torch.zeros_like(latents[:1], device=latents.device, dtype=latents.dtype),
             ).add_mask_channels(latents)
 
+        if self._feature_cache is not None:
+            self._feature_cache.begin_call(latents, guidance_branch)
+
+        if self._unet_compiler is not None:
+            return self._unet_compiler(
+                self.unet, latents, t, text_embeddings, cross_attention_kwargs=cross_attention_kwargs, **kwargs
+            )
+
         # First three args should be positional, not keywords, so torch hooks can see them.
         return self.unet(
             latents,
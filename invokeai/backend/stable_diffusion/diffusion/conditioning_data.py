@@ -1,11 +1,14 @@
 import math
 from dataclasses import dataclass
-from typing import List, Optional, Union
+from typing import TYPE_CHECKING, List, Optional, Union
 
 import torch
 
 from invokeai.backend.ip_adapter.ip_adapter import IPAdapter
 
+if TYPE_CHECKING:
+    from invokeai.backend.stable_diffusion.diffusion.conditioning_plan import ConditioningPlan
+
 
 @dataclass
 class BasicConditioningInfo:
@@ -104,6 +107,8 @@ class TextConditioningData:
         cond_regions: Optional[TextConditioningRegions],
         guidance_scale: Union[float, List[float]],
         guidance_rescale_multiplier: float = 0,
+        guidance_truncate_after: float = 1.0,
+        guidance_truncate_similarity: Optional[float] = None,
     ):
         self.uncond_text = uncond_text
         self.cond_text = cond_text
@@ -117,7 +122,55 @@ class TextConditioningData:
         # For models trained using zero-terminal SNR ("ztsnr"), it's suggested to use guidance_rescale_multiplier of 0.7.
         # See [Common Diffusion Noise Schedules and Sample Steps are Flawed](https://arxiv.org/pdf/2305.08891.pdf).
         self.guidance_rescale_multiplier = guidance_rescale_multiplier
+        # Guidance truncation, after [Adaptive Guidance](https://arxiv.org/abs/2312.12487): late in denoising, the
+        # conditioned and unconditioned predictions nearly agree, and the unconditioned pass can be skipped. It is
+        # skipped from the step at the `guidance_truncate_after` fraction of the steps, and after the first step at
+        # which the cosine similarity of the predictions reaches `guidance_truncate_similarity`, if set.
+        self.guidance_truncate_after = guidance_truncate_after
+        self.guidance_truncate_similarity = guidance_truncate_similarity
+        # The step-invariant UNet inputs derived from the conditioning. Made by the first denoising step if not set.
+        self.plan: Optional["ConditioningPlan"] = None
 
     def is_sdxl(self):
         assert isinstance(self.uncond_text, SDXLConditioningInfo) == isinstance(self.cond_text, SDXLConditioningInfo)
         return isinstance(self.cond_text, SDXLConditioningInfo)
+
+    @classmethod
+    def stack(cls, conditionings: List["TextConditioningData"]) -> "TextConditioningData":
+        """Stack the text conditioning of several generations into one batch, in order.
+
+        The conditionings must not use regional prompts, must have the same guidance settings, and their embeddings
+        must have the same shapes.
+        """
+        first = conditionings[0]
+        assert all(c.cond_regions is None and c.uncond_regions is None for c in conditionings)
+        assert all(
+            c.guidance_scale == first.guidance_scale
+            and c.guidance_rescale_multiplier == first.guidance_rescale_multiplier
+            and c.guidance_truncate_after == first.guidance_truncate_after
+            and c.guidance_truncate_similarity == first.guidance_truncate_similarity
+            for c in conditionings
+        )
+
+        def _stack_text(infos: List[Union[BasicConditioningInfo, SDXLConditioningInfo]]):
+            embeds = torch.cat([x.embeds for x in infos])
+            sdxl_infos = [x for x in infos if isinstance(x, SDXLConditioningInfo)]
+            if sdxl_infos:
+                assert len(sdxl_infos) == len(infos)
+                return SDXLConditioningInfo(
+                    embeds=embeds,
+                    pooled_embeds=torch.cat([x.pooled_embeds for x in sdxl_infos]),
+                    add_time_ids=torch.cat([x.add_time_ids for x in sdxl_infos]),
+                )
+            return BasicConditioningInfo(embeds=embeds)
+
+        return cls(
+            uncond_text=_stack_text([c.uncond_text for c in conditionings]),
+            cond_text=_stack_text([c.cond_text for c in conditionings]),
+            uncond_regions=None,
+            cond_regions=None,
+            guidance_scale=first.guidance_scale,
+            guidance_rescale_multiplier=first.guidance_rescale_multiplier,
+            guidance_truncate_after=first.guidance_truncate_after,
+            guidance_truncate_similarity=first.guidance_truncate_similarity,
+        )
@@ -0,0 +1,205 @@
+"""
+Step-invariant UNet inputs of a denoising run.
+
+The text embeddings, the SDXL added conditioning, the regional prompt masks and the IP-Adapter image embeddings do not
+change from one denoising step to the next. A `ConditioningPlan` prepares them once, for both the batched and the
+sequential classifier-free guidance passes, so that each step only looks them up.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import torch
+
+from invokeai.backend.stable_diffusion.diffusion.conditioning_data import (
+    IPAdapterData,
+    Range,
+    TextConditioningData,
+    TextConditioningRegions,
+)
+from invokeai.backend.stable_diffusion.diffusion.regional_ip_data import RegionalIPData
+from invokeai.backend.stable_diffusion.diffusion.regional_prompt_data import RegionalPromptData
+
+
+def concat_conditionings_for_batch(
+    unconditioning: torch.Tensor, conditioning: torch.Tensor
+) -> tuple[torch.Tensor, Optional[torch.Tensor]]:
+    """Concatenate the unconditioned and conditioned text embeddings into one batch, padding the shorter one with
+    zeros. Returns the batch and, if padding was needed, the encoder attention mask that hides the padding."""
+
+    def _pad_conditioning(cond, target_len, encoder_attention_mask):
+        conditioning_attention_mask = torch.ones((cond.shape[0], cond.shape[1]), device=cond.device, dtype=cond.dtype)
+
+        if cond.shape[1] < target_len:
+            conditioning_attention_mask = torch.cat(
+                [
+                    conditioning_attention_mask,
+                    torch.zeros((cond.shape[0], target_len - cond.shape[1]), device=cond.device, dtype=cond.dtype),
+                ],
+                dim=1,
+            )
+
+            cond = torch.cat(
+                [
+                    cond,
+                    torch.zeros(
+                        (cond.shape[0], target_len - cond.shape[1], cond.shape[2]),
+                        device=cond.device,
+                        dtype=cond.dtype,
+                    ),
+                ],
+                dim=1,
+            )
+
+        if encoder_attention_mask is None:
+            encoder_attention_mask = conditioning_attention_mask
+        else:
+            encoder_attention_mask = torch.cat(
+                [
+                    encoder_attention_mask,
+                    conditioning_attention_mask,
+                ]
+            )
+
+        return cond, encoder_attention_mask
+
+    encoder_attention_mask = None
+    if unconditioning.shape[1] != conditioning.shape[1]:
+        max_len = max(unconditioning.shape[1], conditioning.shape[1])
+        unconditioning, encoder_attention_mask = _pad_conditioning(unconditioning, max_len, encoder_attention_mask)
+        conditioning, encoder_attention_mask = _pad_conditioning(conditioning, max_len, encoder_attention_mask)
+
+    return torch.cat([unconditioning, conditioning]), encoder_attention_mask
+
+
+@dataclass
+class UNetPassConditioning:
+    """The step-invariant inputs of one UNet forward pass."""
+
+    embeds: torch.Tensor
+    encoder_attention_mask: Optional[torch.Tensor] = None
+    added_cond_kwargs: Optional[dict[str, torch.Tensor]] = None
+    regional_prompt_data: Optional[RegionalPromptData] = None
+    # prepared with placeholder scales, which are replaced with the scales of each step
+    regional_ip_data: Optional[RegionalIPData] = None
+
+    def cross_attention_kwargs(
+        self, ip_adapter_data: Optional[list[IPAdapterData]], step_index: int, total_step_count: int
+    ) -> dict[str, Any]:
+        """Return the cross-attention kwargs of the pass for a denoising step."""
+        cross_attention_kwargs: dict[str, Any] = {}
+        if self.regional_ip_data is not None:
+            assert ip_adapter_data is not None
+            scales = [ipa.scale_for_step(step_index, total_step_count) for ipa in ip_adapter_data]
+            cross_attention_kwargs["regional_ip_data"] = self.regional_ip_data.with_scales(scales)
+        if self.regional_prompt_data is not None:
+            cross_attention_kwargs["regional_prompt_data"] = self.regional_prompt_data
+            cross_attention_kwargs["percent_through"] = step_index / total_step_count
+        return cross_attention_kwargs
+
+
+class ConditioningPlan:
+    """The step-invariant UNet inputs of a denoising run, for the batched pass and for each of the sequential passes.
+
+    The batched pass holds the unconditioned and conditioned inputs concatenated in that order.
+    """
+
+    def __init__(
+        self,
+        conditioning_data: TextConditioningData,
+        ip_adapter_data: Optional[list[IPAdapterData]],
+        latent_height: int,
+        latent_width: int,
+        device: torch.device,
+        dtype: torch.dtype,
+    ):
+        """
+        Args:
+            conditioning_data: The text conditioning of the run.
+            ip_adapter_data: The IP-Adapters of the run, if any. Steps must pass the same list.
+            latent_height: The height of the latents.
+            latent_width: The width of the latents.
+            device: The device of the UNet.
+            dtype: The dtype of the UNet.
+        """
+        self.ip_adapter_data = ip_adapter_data
+        self.latent_size = (latent_height, latent_width)
+        self.device = device
+        self.dtype = dtype
+
+        uncond_text = conditioning_data.uncond_text
+        cond_text = conditioning_data.cond_text
+        both_embeds, encoder_attention_mask = concat_conditionings_for_batch(uncond_text.embeds, cond_text.embeds)
+        self.both = UNetPassConditioning(embeds=both_embeds, encoder_attention_mask=encoder_attention_mask)
+        self.uncond = UNetPassConditioning(embeds=uncond_text.embeds)
+        self.cond = UNetPassConditioning(embeds=cond_text.embeds)
+
+        if conditioning_data.is_sdxl():
+            self.both.added_cond_kwargs = {
+                "text_embeds": torch.cat(
+                    [
+                        # TODO: how to pad? just by zeros? or even truncate?
+                        uncond_text.pooled_embeds,
+                        cond_text.pooled_embeds,
+                    ],
+                    dim=0,
+                ),
+                "time_ids": torch.cat([uncond_text.add_time_ids, cond_text.add_time_ids], dim=0),
+            }
+            self.uncond.added_cond_kwargs = {
+                "text_embeds": uncond_text.pooled_embeds,
+                "time_ids": uncond_text.add_time_ids,
+            }
+            self.cond.added_cond_kwargs = {"text_embeds": cond_text.pooled_embeds, "time_ids": cond_text.add_time_ids}
+
+        uncond_regions = conditioning_data.uncond_regions
+        cond_regions = conditioning_data.cond_regions
+        if cond_regions is not None or uncond_regions is not None:
+            regions = []
+            for c, r in [(uncond_text, uncond_regions), (cond_text, cond_regions)]:
+                if r is None:
+                    # Create a dummy mask and range for text conditioning that doesn't have region masks.
+                    r = TextConditioningRegions(
+                        masks=torch.ones((1, 1, latent_height, latent_width), dtype=dtype),
+                        ranges=[Range(start=0, end=c.embeds.shape[1])],
+                    )
+                regions.append(r)
+            self.both.regional_prompt_data = RegionalPromptData(regions=regions, device=device, dtype=dtype)
+        if uncond_regions is not None:
+            self.uncond.regional_prompt_data = RegionalPromptData(regions=[uncond_regions], device=device, dtype=dtype)
+        if cond_regions is not None:
+            self.cond.regional_prompt_data = RegionalPromptData(regions=[cond_regions], device=device, dtype=dtype)
+
+        if ip_adapter_data is not None:
+            ip_adapter_conditioning = [ipa.ip_adapter_conditioning for ipa in ip_adapter_data]
+            uncond_embeds = [
+                x.uncond_image_prompt_embeds.to(device=device, dtype=dtype) for x in ip_adapter_conditioning
+            ]
+            cond_embeds = [x.cond_image_prompt_embeds.to(device=device, dtype=dtype) for x in ip_adapter_conditioning]
+            ip_masks = [ipa.mask for ipa in ip_adapter_data]
+
+            def _regional_ip_data(image_prompt_embeds: list[torch.Tensor]) -> RegionalIPData:
+                return RegionalIPData(
+                    image_prompt_embeds=image_prompt_embeds,
+                    scales=[0.0] * len(ip_adapter_data),
+                    masks=ip_masks,
+                    dtype=dtype,
+                    device=device,
+                )
+
+            # Note that we 'stack' to produce tensors of shape (batch_size, num_ip_images, seq_len, token_len).
+            self.both.regional_ip_data = _regional_ip_data(
+                [torch.stack([u, c]) for u, c in zip(uncond_embeds, cond_embeds, strict=True)]
+            )
+            # Note that we 'unsqueeze' to produce tensors of shape (batch_size=1, num_ip_images, seq_len, token_len).
+            self.uncond.regional_ip_data = _regional_ip_data([torch.unsqueeze(x, dim=0) for x in uncond_embeds])
+            self.cond.regional_ip_data = _regional_ip_data([torch.unsqueeze(x, dim=0) for x in cond_embeds])
+
+    def matches(self, ip_adapter_data: Optional[list[IPAdapterData]], sample: torch.Tensor) -> bool:
+        """Return true if the plan was made for the indicated IP-Adapters, and latents like the sample."""
+        return (
+            self.ip_adapter_data is ip_adapter_data
+            and self.latent_size == tuple(sample.shape[2:])
+            and self.device == sample.device
+            and self.dtype == sample.dtype
+        )
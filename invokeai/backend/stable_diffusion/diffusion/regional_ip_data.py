@@ -1,3 +1,5 @@
+import copy
+
 import torch
 
 
@@ -70,3 +72,10 @@ class RegionalIPData:
     def get_masks(self, query_seq_len: int) -> torch.Tensor:
         """Get the mask for the given query sequence length."""
         return self._masks_by_seq_len[query_seq_len]
+
+    def with_scales(self, scales: list[float]) -> "RegionalIPData":
+        """Return a copy of this object with other attention scales. The copy shares the embeddings and masks."""
+        assert len(scales) == len(self.scales)
+        regional_ip_data = copy.copy(self)
+        regional_ip_data.scales = scales
+        return regional_ip_data
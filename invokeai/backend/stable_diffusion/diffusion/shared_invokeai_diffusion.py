@@ -7,14 +7,8 @@ import torch
 from typing_extensions import TypeAlias
 
 from invokeai.app.services.config.config_default import get_config
-from invokeai.backend.stable_diffusion.diffusion.conditioning_data import (
-    IPAdapterData,
-    Range,
-    TextConditioningData,
-    TextConditioningRegions,
-)
-from invokeai.backend.stable_diffusion.diffusion.regional_ip_data import RegionalIPData
-from invokeai.backend.stable_diffusion.diffusion.regional_prompt_data import RegionalPromptData
+from invokeai.backend.stable_diffusion.diffusion.conditioning_data import IPAdapterData, TextConditioningData
+from invokeai.backend.stable_diffusion.diffusion.conditioning_plan import ConditioningPlan
 
 ModelForwardCallback: TypeAlias = Union[
     # x, t, conditioning, Optional[cross-attention kwargs]
@@ -47,12 +41,26 @@ class InvokeAIDiffuserComponent:
         """
         :param model: the unet model to pass through to cross attention control
         :param model_forward_callback: a lambda with arguments (x, sigma, conditioning_to_apply). will be called repeatedly. most likely, this should simply call model.forward(x, sigma, conditioning)
+            It is also passed the `guidance_branch` of each call, which must not be passed on to the model.
         """
         config = get_config()
         self.conditioning = None
         self.model = model
         self.model_forward_callback = model_forward_callback
         self.sequential_guidance = config.sequential_guidance
+        # The step at which the predictions converged, if guidance truncation by similarity is on.
+        self._guidance_converged_step: Optional[int] = None
+        # The UNet passes run and skipped by guidance truncation, with one pass per guidance branch and step.
+        self.unet_passes = 0
+        self.skipped_unet_passes = 0
+
+    def skips_unconditioned_pass(
+        self, conditioning_data: TextConditioningData, step_index: int, total_step_count: int
+    ) -> bool:
+        """Return true if guidance is truncated at a step, so that only the conditioned UNet pass runs."""
+        if step_index >= conditioning_data.guidance_truncate_after * total_step_count:
+            return True
+        return self._guidance_converged_step is not None and step_index > self._guidance_converged_step
 
     def do_controlnet_step(
         self,
@@ -64,6 +72,8 @@ class InvokeAIDiffuserComponent:
         conditioning_data: TextConditioningData,
     ):
         down_block_res_samples, mid_block_res_sample = None, None
+        # the ControlNets only use the text conditioning of the plan, which does not depend on the IP-Adapters
+        plan = conditioning_data.plan or self._get_conditioning_plan(conditioning_data, None, sample)
 
         # control_data should be type List[ControlNetData]
         # this loop covers both ControlNet (one ControlNetData in list)
@@ -78,6 +88,10 @@ class InvokeAIDiffuserComponent:
             #  cfg_injection = determines whether to apply ControlNet to only the conditional (if True)
             #      or the default both conditional and unconditional (if False)
             cfg_injection = control_mode == "more_control" or control_mode == "unbalanced"
+            # without an unconditioned pass, ControlNet only needs to run for the conditioned one
+            cfg_injection = cfg_injection or self.skips_unconditioned_pass(
+                conditioning_data, step_index, total_step_count
+            )
 
             first_control_step = math.floor(control_datum.begin_step_percent * total_step_count)
             last_control_step = math.ceil(control_datum.end_step_percent * total_step_count)
@@ -91,42 +105,8 @@ class InvokeAIDiffuserComponent:
                     #     classifier_free_guidance is <= 1.0 ?)
                     sample_model_input = torch.cat([sample] * 2)
 
-                added_cond_kwargs = None
-
-                if cfg_injection:  # only applying ControlNet to conditional instead of in unconditioned
-                    if conditioning_data.is_sdxl():
-                        added_cond_kwargs = {
-                            "text_embeds": conditioning_data.cond_text.pooled_embeds,
-                            "time_ids": conditioning_data.cond_text.add_time_ids,
-                        }
-                    encoder_hidden_states = conditioning_data.cond_text.embeds
-                    encoder_attention_mask = None
-                else:
-                    if conditioning_data.is_sdxl():
-                        added_cond_kwargs = {
-                            "text_embeds": torch.cat(
-                                [
-                                    # TODO: how to pad? just by zeros? or even truncate?
-                                    conditioning_data.uncond_text.pooled_embeds,
-                                    conditioning_data.cond_text.pooled_embeds,
-                                ],
-                                dim=0,
-                            ),
-                            "time_ids": torch.cat(
-                                [
-                                    conditioning_data.uncond_text.add_time_ids,
-                                    conditioning_data.cond_text.add_time_ids,
-                                ],
-                                dim=0,
-                            ),
-                        }
-                    (
-                        encoder_hidden_states,
-                        encoder_attention_mask,
-                    ) = self._concat_conditionings_for_batch(
-                        conditioning_data.uncond_text.embeds,
-                        conditioning_data.cond_text.embeds,
-                    )
+                # only apply ControlNet to the conditional pass when cfg_injection is set
+                pass_conditioning = plan.cond if cfg_injection else plan.both
                 if isinstance(control_datum.weight, list):
                     # if controlnet has multiple weights, use the weight for the current step
                     controlnet_weight = control_datum.weight[step_index]
@@ -138,11 +118,11 @@ class InvokeAIDiffuserComponent:
                 down_samples, mid_sample = control_datum.model(
                     sample=sample_model_input,
                     timestep=timestep,
-                    encoder_hidden_states=encoder_hidden_states,
+                    encoder_hidden_states=pass_conditioning.embeds,
                     controlnet_cond=control_datum.image_tensor,
                     conditioning_scale=controlnet_weight,  # controlnet specific, NOT the guidance scale
-                    encoder_attention_mask=encoder_attention_mask,
-                    added_cond_kwargs=added_cond_kwargs,
+                    encoder_attention_mask=pass_conditioning.encoder_attention_mask,
+                    added_cond_kwargs=pass_conditioning.added_cond_kwargs,
                     guess_mode=soft_injection,  # this is still called guess_mode in diffusers ControlNetModel
                     return_dict=False,
                 )
@@ -177,6 +157,29 @@ class InvokeAIDiffuserComponent:
         mid_block_additional_residual: Optional[torch.Tensor] = None,  # for ControlNet
         down_intrablock_additional_residuals: Optional[torch.Tensor] = None,  # for T2I-Adapter
     ):
+        if step_index == 0:
+            self._guidance_converged_step = None
+
+        if self.skips_unconditioned_pass(conditioning_data, step_index, total_step_count):
+            # The residuals are made for both guidance branches. Keep those of the conditioned one.
+            conditioned_next_x = self._apply_conditioned_pass(
+                x=sample,
+                sigma=timestep,
+                conditioning_data=conditioning_data,
+                ip_adapter_data=ip_adapter_data,
+                step_index=step_index,
+                total_step_count=total_step_count,
+                down_block_additional_residuals=self._cond_chunks(down_block_additional_residuals),
+                mid_block_additional_residual=(
+                    mid_block_additional_residual.chunk(2)[1] if mid_block_additional_residual is not None else None
+                ),
+                down_intrablock_additional_residuals=self._cond_chunks(down_intrablock_additional_residuals),
+            )
+            self.unet_passes += 1
+            self.skipped_unet_passes += 1
+            # with equal predictions, the guidance combination yields the conditioned prediction
+            return conditioned_next_x, conditioned_next_x
+
         if self.sequential_guidance:
             (
                 unconditioned_next_x,
@@ -207,55 +210,40 @@ class InvokeAIDiffuserComponent:
                 mid_block_additional_residual=mid_block_additional_residual,
                 down_intrablock_additional_residuals=down_intrablock_additional_residuals,
             )
+        self.unet_passes += 2
 
-        return unconditioned_next_x, conditioned_next_x
-
-    def _concat_conditionings_for_batch(self, unconditioning, conditioning):
-        def _pad_conditioning(cond, target_len, encoder_attention_mask):
-            conditioning_attention_mask = torch.ones(
-                (cond.shape[0], cond.shape[1]), device=cond.device, dtype=cond.dtype
-            )
-
-            if cond.shape[1] < max_len:
-                conditioning_attention_mask = torch.cat(
-                    [
-                        conditioning_attention_mask,
-                        torch.zeros((cond.shape[0], max_len - cond.shape[1]), device=cond.device, dtype=cond.dtype),
-                    ],
-                    dim=1,
-                )
-
-                cond = torch.cat(
-                    [
-                        cond,
-                        torch.zeros(
-                            (cond.shape[0], max_len - cond.shape[1], cond.shape[2]),
-                            device=cond.device,
-                            dtype=cond.dtype,
-                        ),
-                    ],
-                    dim=1,
-                )
+        threshold = conditioning_data.guidance_truncate_similarity
+        if threshold is not None and self._similarity(unconditioned_next_x, conditioned_next_x) >= threshold:
+            self._guidance_converged_step = step_index
 
-            if encoder_attention_mask is None:
-                encoder_attention_mask = conditioning_attention_mask
-            else:
-                encoder_attention_mask = torch.cat(
-                    [
-                        encoder_attention_mask,
-                        conditioning_attention_mask,
-                    ]
-                )
+        return unconditioned_next_x, conditioned_next_x
 
-            return cond, encoder_attention_mask
+    @staticmethod
+    def _similarity(unconditioned_next_x: torch.Tensor, conditioned_next_x: torch.Tensor) -> float:
+        """Return the lowest cosine similarity of the conditioned and unconditioned predictions of the batch."""
+        similarity = torch.nn.functional.cosine_similarity(
+            unconditioned_next_x.flatten(start_dim=1).float(), conditioned_next_x.flatten(start_dim=1).float(), dim=1
+        )
+        return similarity.min().item()
 
-        encoder_attention_mask = None
-        if unconditioning.shape[1] != conditioning.shape[1]:
-            max_len = max(unconditioning.shape[1], conditioning.shape[1])
-            unconditioning, encoder_attention_mask = _pad_conditioning(unconditioning, max_len, encoder_attention_mask)
-            conditioning, encoder_attention_mask = _pad_conditioning(conditioning, max_len, encoder_attention_mask)
+    @staticmethod
+    def _cond_chunks(residuals: Optional[list[torch.Tensor]]) -> Optional[list[torch.Tensor]]:
+        """Return the conditioned halves of residuals made for both guidance branches."""
+        return [r.chunk(2)[1] for r in residuals] if residuals is not None else None
 
-        return torch.cat([unconditioning, conditioning]), encoder_attention_mask
+    def _get_conditioning_plan(
+        self,
+        conditioning_data: TextConditioningData,
+        ip_adapter_data: Optional[list[IPAdapterData]],
+        sample: torch.Tensor,
+    ) -> ConditioningPlan:
+        """Return the conditioning plan of the denoising run, making it if it was not made for this run."""
+        plan = conditioning_data.plan
+        if plan is None or not plan.matches(ip_adapter_data, sample):
+            _, _, h, w = sample.shape
+            plan = ConditioningPlan(conditioning_data, ip_adapter_data, h, w, device=sample.device, dtype=sample.dtype)
+            conditioning_data.plan = plan
+        return plan
 
     # methods below are called from do_diffusion_step and should be considered private to this class.
 
@@ -274,82 +262,21 @@ class InvokeAIDiffuserComponent:
         """Runs the conditioned and unconditioned UNet forward passes in a single batch for faster inference speed at
         the cost of higher memory usage.
         """
+        plan = self._get_conditioning_plan(conditioning_data, ip_adapter_data, x)
         x_twice = torch.cat([x] * 2)
         sigma_twice = torch.cat([sigma] * 2)
 
-        cross_attention_kwargs = {}
-        if ip_adapter_data is not None:
-            ip_adapter_conditioning = [ipa.ip_adapter_conditioning for ipa in ip_adapter_data]
-            # Note that we 'stack' to produce tensors of shape (batch_size, num_ip_images, seq_len, token_len).
-            image_prompt_embeds = [
-                torch.stack([ipa_conditioning.uncond_image_prompt_embeds, ipa_conditioning.cond_image_prompt_embeds])
-                for ipa_conditioning in ip_adapter_conditioning
-            ]
-            scales = [ipa.scale_for_step(step_index, total_step_count) for ipa in ip_adapter_data]
-            ip_masks = [ipa.mask for ipa in ip_adapter_data]
-            regional_ip_data = RegionalIPData(
-                image_prompt_embeds=image_prompt_embeds, scales=scales, masks=ip_masks, dtype=x.dtype, device=x.device
-            )
-            cross_attention_kwargs["regional_ip_data"] = regional_ip_data
-
-        added_cond_kwargs = None
-        if conditioning_data.is_sdxl():
-            added_cond_kwargs = {
-                "text_embeds": torch.cat(
-                    [
-                        # TODO: how to pad? just by zeros? or even truncate?
-                        conditioning_data.uncond_text.pooled_embeds,
-                        conditioning_data.cond_text.pooled_embeds,
-                    ],
-                    dim=0,
-                ),
-                "time_ids": torch.cat(
-                    [
-                        conditioning_data.uncond_text.add_time_ids,
-                        conditioning_data.cond_text.add_time_ids,
-                    ],
-                    dim=0,
-                ),
-            }
-
-        if conditioning_data.cond_regions is not None or conditioning_data.uncond_regions is not None:
-            # TODO(ryand): We currently initialize RegionalPromptData for every denoising step. The text conditionings
-            # and masks are not changing from step-to-step, so this really only needs to be done once. While this seems
-            # painfully inefficient, the time spent is typically negligible compared to the forward inference pass of
-            # the UNet. The main reason that this hasn't been moved up to eliminate redundancy is that it is slightly
-            # awkward to handle both standard conditioning and sequential conditioning further up the stack.
-            regions = []
-            for c, r in [
-                (conditioning_data.uncond_text, conditioning_data.uncond_regions),
-                (conditioning_data.cond_text, conditioning_data.cond_regions),
-            ]:
-                if r is None:
-                    # Create a dummy mask and range for text conditioning that doesn't have region masks.
-                    _, _, h, w = x.shape
-                    r = TextConditioningRegions(
-                        masks=torch.ones((1, 1, h, w), dtype=x.dtype),
-                        ranges=[Range(start=0, end=c.embeds.shape[1])],
-                    )
-                regions.append(r)
-
-            cross_attention_kwargs["regional_prompt_data"] = RegionalPromptData(
-                regions=regions, device=x.device, dtype=x.dtype
-            )
-            cross_attention_kwargs["percent_through"] = step_index / total_step_count
-
-        both_conditionings, encoder_attention_mask = self._concat_conditionings_for_batch(
-            conditioning_data.uncond_text.embeds, conditioning_data.cond_text.embeds
-        )
         both_results = self.model_forward_callback(
             x_twice,
             sigma_twice,
-            both_conditionings,
-            cross_attention_kwargs=cross_attention_kwargs,
-            encoder_attention_mask=encoder_attention_mask,
+            plan.both.embeds,
+            cross_attention_kwargs=plan.both.cross_attention_kwargs(ip_adapter_data, step_index, total_step_count),
+            encoder_attention_mask=plan.both.encoder_attention_mask,
+            guidance_branch="both",
             down_block_additional_residuals=down_block_additional_residuals,
             mid_block_additional_residual=mid_block_additional_residual,
             down_intrablock_additional_residuals=down_intrablock_additional_residuals,
-            added_cond_kwargs=added_cond_kwargs,
+            added_cond_kwargs=plan.both.added_cond_kwargs,
         )
         unconditioned_next_x, conditioned_next_x = both_results.chunk(2)
         return unconditioned_next_x, conditioned_next_x
@@ -391,103 +318,61 @@ class InvokeAIDiffuserComponent:
         if mid_block_additional_residual is not None:
             uncond_mid_block, cond_mid_block = mid_block_additional_residual.chunk(2)
 
-        #####################
-        # Unconditioned pass
-        #####################
-
-        cross_attention_kwargs = {}
-
-        # Prepare IP-Adapter cross-attention kwargs for the unconditioned pass.
-        if ip_adapter_data is not None:
-            ip_adapter_conditioning = [ipa.ip_adapter_conditioning for ipa in ip_adapter_data]
-            # Note that we 'unsqueeze' to produce tensors of shape (batch_size=1, num_ip_images, seq_len, token_len).
-            image_prompt_embeds = [
-                torch.unsqueeze(ipa_conditioning.uncond_image_prompt_embeds, dim=0)
-                for ipa_conditioning in ip_adapter_conditioning
-            ]
-
-            scales = [ipa.scale_for_step(step_index, total_step_count) for ipa in ip_adapter_data]
-            ip_masks = [ipa.mask for ipa in ip_adapter_data]
-            regional_ip_data = RegionalIPData(
-                image_prompt_embeds=image_prompt_embeds, scales=scales, masks=ip_masks, dtype=x.dtype, device=x.device
-            )
-            cross_attention_kwargs["regional_ip_data"] = regional_ip_data
-
-        # Prepare SDXL conditioning kwargs for the unconditioned pass.
-        added_cond_kwargs = None
-        if conditioning_data.is_sdxl():
-            added_cond_kwargs = {
-                "text_embeds": conditioning_data.uncond_text.pooled_embeds,
-                "time_ids": conditioning_data.uncond_text.add_time_ids,
-            }
-
-        # Prepare prompt regions for the unconditioned pass.
-        if conditioning_data.uncond_regions is not None:
-            cross_attention_kwargs["regional_prompt_data"] = RegionalPromptData(
-                regions=[conditioning_data.uncond_regions], device=x.device, dtype=x.dtype
-            )
-            cross_attention_kwargs["percent_through"] = step_index / total_step_count
+        plan = self._get_conditioning_plan(conditioning_data, ip_adapter_data, x)
 
         # Run unconditioned UNet denoising (i.e. negative prompt).
         unconditioned_next_x = self.model_forward_callback(
             x,
             sigma,
-            conditioning_data.uncond_text.embeds,
-            cross_attention_kwargs=cross_attention_kwargs,
+            plan.uncond.embeds,
+            cross_attention_kwargs=plan.uncond.cross_attention_kwargs(ip_adapter_data, step_index, total_step_count),
+            guidance_branch="uncond",
             down_block_additional_residuals=uncond_down_block,
             mid_block_additional_residual=uncond_mid_block,
             down_intrablock_additional_residuals=uncond_down_intrablock,
-            added_cond_kwargs=added_cond_kwargs,
+            added_cond_kwargs=plan.uncond.added_cond_kwargs,
         )
 
-        ###################
-        # Conditioned pass
-        ###################
-
-        cross_attention_kwargs = {}
-
-        if ip_adapter_data is not None:
-            ip_adapter_conditioning = [ipa.ip_adapter_conditioning for ipa in ip_adapter_data]
-            # Note that we 'unsqueeze' to produce tensors of shape (batch_size=1, num_ip_images, seq_len, token_len).
-            image_prompt_embeds = [
-                torch.unsqueeze(ipa_conditioning.cond_image_prompt_embeds, dim=0)
-                for ipa_conditioning in ip_adapter_conditioning
-            ]
+        conditioned_next_x = self._apply_conditioned_pass(
+            x=x,
+            sigma=sigma,
+            conditioning_data=conditioning_data,
+            ip_adapter_data=ip_adapter_data,
+            step_index=step_index,
+            total_step_count=total_step_count,
+            down_block_additional_residuals=cond_down_block,
+            mid_block_additional_residual=cond_mid_block,
+            down_intrablock_additional_residuals=cond_down_intrablock,
+        )
+        return unconditioned_next_x, conditioned_next_x
 
-            scales = [ipa.scale_for_step(step_index, total_step_count) for ipa in ip_adapter_data]
-            ip_masks = [ipa.mask for ipa in ip_adapter_data]
-            regional_ip_data = RegionalIPData(
-                image_prompt_embeds=image_prompt_embeds, scales=scales, masks=ip_masks, dtype=x.dtype, device=x.device
-            )
-            cross_attention_kwargs["regional_ip_data"] = regional_ip_data
-
-        # Prepare SDXL conditioning kwargs for the conditioned pass.
-        added_cond_kwargs = None
-        if conditioning_data.is_sdxl():
-            added_cond_kwargs = {
-                "text_embeds": conditioning_data.cond_text.pooled_embeds,
-                "time_ids": conditioning_data.cond_text.add_time_ids,
-            }
-
-        # Prepare prompt regions for the conditioned pass.
-        if conditioning_data.cond_regions is not None:
-            cross_attention_kwargs["regional_prompt_data"] = RegionalPromptData(
-                regions=[conditioning_data.cond_regions], device=x.device, dtype=x.dtype
-            )
-            cross_attention_kwargs["percent_through"] = step_index / total_step_count
+    def _apply_conditioned_pass(
+        self,
+        x: torch.Tensor,
+        sigma,
+        conditioning_data: TextConditioningData,
+        ip_adapter_data: Optional[list[IPAdapterData]],
+        step_index: int,
+        total_step_count: int,
+        down_block_additional_residuals: Optional[list[torch.Tensor]] = None,  # for ControlNet
+        mid_block_additional_residual: Optional[torch.Tensor] = None,  # for ControlNet
+        down_intrablock_additional_residuals: Optional[list[torch.Tensor]] = None,  # for T2I-Adapter
+    ) -> torch.Tensor:
+        """Runs the conditioned UNet forward pass alone. The residuals are those of the conditioned pass."""
+        plan = self._get_conditioning_plan(conditioning_data, ip_adapter_data, x)
 
         # Run conditioned UNet denoising (i.e. positive prompt).
-        conditioned_next_x = self.model_forward_callback(
+        return self.model_forward_callback(
             x,
             sigma,
-            conditioning_data.cond_text.embeds,
-            cross_attention_kwargs=cross_attention_kwargs,
-            down_block_additional_residuals=cond_down_block,
-            mid_block_additional_residual=cond_mid_block,
-            down_intrablock_additional_residuals=cond_down_intrablock,
-            added_cond_kwargs=added_cond_kwargs,
+            plan.cond.embeds,
+            cross_attention_kwargs=plan.cond.cross_attention_kwargs(ip_adapter_data, step_index, total_step_count),
+            guidance_branch="cond",
+            down_block_additional_residuals=down_block_additional_residuals,
+            mid_block_additional_residual=mid_block_additional_residual,
+            down_intrablock_additional_residuals=down_intrablock_additional_residuals,
+            added_cond_kwargs=plan.cond.added_cond_kwargs,
         )
-        return unconditioned_next_x, conditioned_next_x
 
     def _combine(self, unconditioned_next_x, conditioned_next_x, guidance_scale):
         # to scale how much effect conditioning has, calculate the changes it does and then scale that
@@ -0,0 +1,172 @@
+"""
+Token merging for the self-attention layers of the UNet, after [ToMe for SD](https://arxiv.org/abs/2303.17604).
+
+Neighbouring spatial tokens are often nearly identical, and self-attention costs grow with the square of the number of
+tokens. Before a self-attention layer, the tokens are split into destination tokens (one per 2x2 window) and source
+tokens, and the source tokens most similar to a destination token are averaged into it. Attention runs on the merged
+tokens, and its output is unmerged by copying the output of each destination token to the source tokens merged into it.
+"""
+
+import math
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import torch
+from diffusers.models.attention_processor import Attention
+
+from invokeai.backend.stable_diffusion.diffusion.custom_atttention import CustomAttnProcessor2_0
+
+# The size of the windows that hold one destination token each.
+_STRIDE_X = 2
+_STRIDE_Y = 2
+# The number of UNet resolution levels that are searched for the size of a token grid.
+_MAX_LEVELS = 8
+
+MergeFn = Callable[[torch.Tensor], torch.Tensor]
+
+
+@dataclass
+class TokenMergingSettings:
+    """The token merging of a denoising run."""
+
+    # ratios[i] is the fraction of the tokens that are merged at the i'th resolution level of the UNet, from the
+    # highest resolution down. The levels past the end of the list are not merged.
+    ratios: list[float]
+    latent_height: int
+    latent_width: int
+
+    def get_level(self, seq_len: int) -> Optional[tuple[int, int, int]]:
+        """Return the resolution level, height and width of a grid of `seq_len` tokens, or None if it is not one of
+        the grids of the UNet."""
+        for level in range(_MAX_LEVELS):
+            downscale_factor = 2**level
+            # the UNet downsamples with ceil_mode, like the latents
+            h = math.ceil(self.latent_height / downscale_factor)
+            w = math.ceil(self.latent_width / downscale_factor)
+            if h * w == seq_len:
+                return level, h, w
+            if h * w < seq_len:
+                break
+        return None
+
+    def get_merge_count(self, seq_len: int) -> tuple[int, int, int]:
+        """Return the number of tokens to merge in a grid of `seq_len` tokens, and the height and width of the grid."""
+        level = self.get_level(seq_len)
+        if level is None or level[0] >= len(self.ratios):
+            return 0, 0, 0
+        level_index, h, w = level
+        return int(seq_len * self.ratios[level_index]), h, w
+
+
+def _do_nothing(x: torch.Tensor) -> torch.Tensor:
+    return x
+
+
+def bipartite_soft_matching_2d(metric: torch.Tensor, h: int, w: int, r: int) -> tuple[MergeFn, MergeFn]:
+    """Match the tokens of a grid for merging, by the cosine similarity of their `metric`.
+
+    The destination tokens are the top left tokens of the 2x2 windows of the grid. Each of the other tokens is matched
+    with its most similar destination token, and the `r` most similar source tokens are merged.
+
+    :param metric: The tokens to match, of shape (batch_size, h * w, channels).
+    :param h: The height of the grid.
+    :param w: The width of the grid.
+    :param r: The number of tokens to merge.
+    :return: The functions that merge and unmerge tokens of shape (batch_size, h * w, channels).
+    """
+    batch_size, seq_len, _ = metric.shape
+    if r <= 0:
+        return _do_nothing, _do_nothing
+
+    with torch.no_grad():
+        hsy, wsx = h // _STRIDE_Y, w // _STRIDE_X
+        # Mark the destination tokens with -1, so that they sort first. The rows and columns that do not fill a window
+        # hold source tokens only.
+        window_view = torch.zeros(hsy, wsx, _STRIDE_Y * _STRIDE_X, device=metric.device, dtype=torch.int64)
+        window_view[:, :, 0] = -1
+        window_view = window_view.view(hsy, wsx, _STRIDE_Y, _STRIDE_X).transpose(1, 2)
+        window_view = window_view.reshape(hsy * _STRIDE_Y, wsx * _STRIDE_X)
+        if hsy * _STRIDE_Y < h or wsx * _STRIDE_X < w:
+            index_grid = torch.zeros(h, w, device=metric.device, dtype=torch.int64)
+            index_grid[: hsy * _STRIDE_Y, : wsx * _STRIDE_X] = window_view
+        else:
+            index_grid = window_view
+        sorted_idx = index_grid.reshape(1, -1, 1).argsort(dim=1, stable=True)
+
+        num_dst = hsy * wsx
+        a_idx = sorted_idx[:, num_dst:, :]  # source tokens
+        b_idx = sorted_idx[:, :num_dst, :]  # destination tokens
+
+        def split(x: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+            c = x.shape[-1]
+            src = torch.gather(x, dim=1, index=a_idx.expand(batch_size, seq_len - num_dst, c))
+            dst = torch.gather(x, dim=1, index=b_idx.expand(batch_size, num_dst, c))
+            return src, dst
+
+        metric = metric / metric.norm(dim=-1, keepdim=True)
+        a, b = split(metric)
+        scores = a @ b.transpose(-1, -2)
+
+        r = min(a.shape[1], r)
+        node_max, node_idx = scores.max(dim=-1)
+        edge_idx = node_max.argsort(dim=-1, descending=True)[..., None]
+        unm_idx = edge_idx[..., r:, :]  # unmerged source tokens
+        src_idx = edge_idx[..., :r, :]  # merged source tokens
+        dst_idx = torch.gather(node_idx[..., None], dim=-2, index=src_idx)
+
+    def merge(x: torch.Tensor) -> torch.Tensor:
+        src, dst = split(x)
+        n, t1, c = src.shape
+        unm = torch.gather(src, dim=-2, index=unm_idx.expand(n, t1 - r, c))
+        src = torch.gather(src, dim=-2, index=src_idx.expand(n, r, c))
+        dst = dst.scatter_reduce(-2, dst_idx.expand(n, r, c), src, reduce="mean")
+        return torch.cat([unm, dst], dim=1)
+
+    def unmerge(x: torch.Tensor) -> torch.Tensor:
+        unm_len = unm_idx.shape[1]
+        unm, dst = x[..., :unm_len, :], x[..., unm_len:, :]
+        c = unm.shape[-1]
+        src = torch.gather(dst, dim=-2, index=dst_idx.expand(batch_size, r, c))
+
+        out = torch.zeros(batch_size, seq_len, c, device=x.device, dtype=x.dtype)
+        source_idx = a_idx.expand(batch_size, a_idx.shape[1], 1)
+        out.scatter_(dim=-2, index=b_idx.expand(batch_size, num_dst, c), src=dst)
+        out.scatter_(
+            dim=-2, index=torch.gather(source_idx, dim=1, index=unm_idx).expand(batch_size, unm_len, c), src=unm
+        )
+        out.scatter_(dim=-2, index=torch.gather(source_idx, dim=1, index=src_idx).expand(batch_size, r, c), src=src)
+        return out
+
+    return merge, unmerge
+
+
+class ToMeAttnProcessor2_0(CustomAttnProcessor2_0):
+    """A CustomAttnProcessor2_0 for self-attention layers, that merges redundant tokens before attention and unmerges
+    them after.
+    """
+
+    def __init__(self, token_merging: TokenMergingSettings):
+        """Initialize a ToMeAttnProcessor2_0.
+        Args:
+            token_merging: The token merging of the denoising run.
+        """
+        super().__init__()
+        self._token_merging = token_merging
+
+    def __call__(
+        self,
+        attn: Attention,
+        hidden_states: torch.Tensor,
+        encoder_hidden_states: Optional[torch.Tensor] = None,
+        attention_mask: Optional[torch.Tensor] = None,
+        *args,
+        **kwargs,
+    ) -> torch.FloatTensor:
+        # Only the self-attention of token sequences, without masks, is merged.
+        if encoder_hidden_states is not None or attention_mask is not None or hidden_states.ndim != 3:
+            return super().__call__(attn, hidden_states, encoder_hidden_states, attention_mask, *args, **kwargs)
+
+        r, h, w = self._token_merging.get_merge_count(hidden_states.shape[1])
+        merge, unmerge = bipartite_soft_matching_2d(hidden_states, h, w, r)
+        merged_hidden_states = super().__call__(attn, merge(hidden_states), None, None, *args, **kwargs)
+        return unmerge(merged_hidden_states)
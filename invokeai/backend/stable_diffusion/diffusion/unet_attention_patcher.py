@@ -8,6 +8,7 @@ from invokeai.backend.stable_diffusion.diffusion.custom_atttention import (
     CustomAttnProcessor2_0,
     IPAdapterAttentionWeights,
 )
+from invokeai.backend.stable_diffusion.diffusion.token_merging import ToMeAttnProcessor2_0, TokenMergingSettings
 
 
 class UNetIPAdapterData(TypedDict):
@@ -18,18 +19,37 @@ class UNetIPAdapterData(TypedDict):
 class UNetAttentionPatcher:
     """A class for patching a UNet with CustomAttnProcessor2_0 attention layers."""
 
-    def __init__(self, ip_adapter_data: Optional[List[UNetIPAdapterData]]):
+    def __init__(
+        self,
+        ip_adapter_data: Optional[List[UNetIPAdapterData]],
+        token_merging: Optional[TokenMergingSettings] = None,
+        keep_other_processors: bool = False,
+    ):
+        """
+        Args:
+            ip_adapter_data: The IP-Adapters to apply, if any.
+            token_merging: The token merging to apply in the self-attention layers, if any.
+            keep_other_processors: Keep the UNet's own processors, such as those of the configured attention type, in
+                the layers that neither merge tokens nor apply IP-Adapters.
+        """
         self._ip_adapters = ip_adapter_data
+        self._token_merging = token_merging
+        self._keep_other_processors = keep_other_processors
 
     def _prepare_attention_processors(self, unet: UNet2DConditionModel):
         """Prepare a dict of attention processors that can be injected into a unet, and load the IP-Adapter attention
-        weights into them (if IP-Adapters are being applied).
+        weights into them (if IP-Adapters are being applied). The "attn1" processors merge tokens if token merging is
+        being applied. The other layers keep the UNet's processors if `keep_other_processors` was set.
         Note that the `unet` param is only used to determine attention block dimensions and naming.
         """
         # Construct a dict of attention processors based on the UNet's architecture.
         attn_procs = {}
-        for idx, name in enumerate(unet.attn_processors.keys()):
-            if name.endswith("attn1.processor") or self._ip_adapters is None:
+        for idx, (name, processor) in enumerate(unet.attn_processors.items()):
+            if name.endswith("attn1.processor") and self._token_merging is not None:
+                attn_procs[name] = ToMeAttnProcessor2_0(self._token_merging)
+            elif self._keep_other_processors and (name.endswith("attn1.processor") or self._ip_adapters is None):
+                attn_procs[name] = processor
+            elif name.endswith("attn1.processor") or self._ip_adapters is None:
                 # "attn1" processors do not use IP-Adapters.
                 attn_procs[name] = CustomAttnProcessor2_0()
             else:
@@ -0,0 +1,105 @@
+"""
+Step-level reuse of the deep UNet features, after [DeepCache](https://arxiv.org/abs/2312.00858).
+
+The features computed by the deep blocks of the UNet change slowly from one denoising step to the next. With feature
+reuse, the full UNet runs only every `interval` steps. At the other steps, only the shallow down and up blocks run: the
+deep down blocks, the mid block and the deep up blocks return the outputs they had at the last full step, and the first
+shallow up block combines the cached deep features with the fresh skip features of the shallow down blocks.
+"""
+
+from contextlib import contextmanager
+from typing import Any, Callable, Hashable, Iterator, Literal, Optional
+
+import torch
+from diffusers.models import UNet2DConditionModel
+
+# The number of down and up blocks, at the highest resolutions, that run at every step.
+DEFAULT_SHALLOW_DEPTH = 1
+
+# The guidance branches run by a UNet call: the unconditioned or conditioned pass alone, or both batched together.
+GuidanceBranch = Literal["uncond", "cond", "both"]
+
+
+class UNetFeatureCache:
+    """Caches the outputs of the deep blocks of a UNet, and reuses them between the full steps of a denoising run.
+
+    Each guidance branch has its own cached features, so that a conditioned pass never reuses the features of an
+    unconditioned one, such as when guidance truncation drops the unconditioned pass of sequential guidance. Calls whose
+    branch is not given are told apart by their order in the step. A call whose latents differ in shape from those of
+    the cached call runs the full UNet.
+    """
+
+    def __init__(self, unet: UNet2DConditionModel, interval: int, shallow_depth: int = DEFAULT_SHALLOW_DEPTH):
+        """
+        :param unet: The UNet.
+        :param interval: The full UNet runs every `interval` steps. Higher intervals are faster, at a cost in quality.
+        :param shallow_depth: The number of down and up blocks that run at every step.
+        """
+        assert interval > 1
+        assert 0 < shallow_depth < len(unet.up_blocks)
+        self._unet = unet
+        self._interval = interval
+        self._shallow_depth = shallow_depth
+        self._refresh = True
+        self._call_index = 0
+        self._reuse = False
+        self._call_key: Hashable = None
+        # call key -> the shape of the latents of the call when its features were cached
+        self._cached_shapes: dict[Hashable, tuple[int, ...]] = {}
+        self.full_calls = 0
+        self.reused_calls = 0
+
+    def begin_step(self, step_index: int) -> None:
+        """Start a denoising step. The full UNet runs at the first step and every `interval` steps after."""
+        self._refresh = step_index % self._interval == 0
+        self._call_index = 0
+
+    def begin_call(self, sample: torch.Tensor, guidance_branch: Optional[GuidanceBranch] = None) -> None:
+        """Start a UNet call of the current step, with the indicated latents and guidance branch."""
+        self._call_key = guidance_branch if guidance_branch is not None else self._call_index
+        self._call_index += 1
+        shape = tuple(sample.shape)
+        self._reuse = not self._refresh and self._cached_shapes.get(self._call_key) == shape
+        if self._reuse:
+            self.reused_calls += 1
+        else:
+            self._cached_shapes[self._call_key] = shape
+            self.full_calls += 1
+
+    @contextmanager
+    def apply(self) -> Iterator[None]:
+        """Patch the deep blocks of the UNet to return their cached outputs in the calls that reuse features."""
+        depth = self._shallow_depth
+        deep_blocks: list[torch.nn.Module] = [*self._unet.down_blocks[depth:], *self._unet.up_blocks[:-depth]]
+        if self._unet.mid_block is not None:
+            deep_blocks.append(self._unet.mid_block)
+        # The output of the last deep up block is the input of the first shallow up block, which may scale it in place
+        # (FreeU does), so it is cached and reused as a copy.
+        feeding_block = self._unet.up_blocks[-depth - 1]
+
+        original_forwards: list[tuple[torch.nn.Module, Optional[Callable[..., Any]]]] = []
+        try:
+            for block in deep_blocks:
+                original_forwards.append((block, block.__dict__.get("forward")))
+                block.forward = self._make_forward(block.forward, copy=block is feeding_block)
+            yield
+        finally:
+            for block, forward in original_forwards:
+                if forward is None:
+                    del block.forward
+                else:
+                    block.forward = forward
+
+    def _make_forward(self, forward: Callable[..., Any], copy: bool) -> Callable[..., Any]:
+        # call key -> the output of the block in the call
+        outputs: dict[Hashable, Any] = {}
+
+        def _forward(*args: Any, **kwargs: Any) -> Any:
+            call_key = self._call_key
+            if self._reuse:
+                return outputs[call_key].clone() if copy else outputs[call_key]
+            output = forward(*args, **kwargs)
+            outputs[call_key] = output.clone() if copy else output
+            return output
+
+        return _forward
@@ -0,0 +1,144 @@
+"""
+Compiled execution of the UNet.
+
+When compilation is enabled, the UNet forward passes of the denoising steps run through `torch.compile`, optionally
+captured as CUDA graphs (the `reduce-overhead` mode). Compiled callables are specialized to the shapes of their inputs,
+so they are kept per UNet, which stands for a model on an execution device, and keyed by the shapes, dtypes and
+devices of the inputs. The key covers the latent size and batch, the guidance mode (the batched guidance pass doubles
+the batch), the SDXL conditioning and the residuals of the ControlNets and T2I-Adapters in use. The callables live as
+long as their UNet does, so a model that stays in the model cache reuses them across sessions.
+
+Passes that the compiled path does not support run eagerly: passes with cross-attention kwargs (regional prompts and
+IP-Adapters), UNets with runtime LoRA hooks, devices other than CPU and CUDA, and the keys whose compilation failed.
+"""
+
+import threading
+import weakref
+from functools import lru_cache
+from typing import Any, Callable, Hashable, Literal, Optional, Union
+
+import torch
+import torch._dynamo
+
+from invokeai.backend.util.logging import InvokeAILogger
+
+UNET_COMPILE_MODE = Literal["off", "default", "reduce-overhead", "max-autotune"]
+
+# The devices that `torch.compile` supports.
+_COMPILE_DEVICE_TYPES = {"cpu", "cuda"}
+
+
+def _call_unet(unet: torch.nn.Module, *args: Any, **kwargs: Any) -> Any:
+    # The UNet is an argument, not a closure variable, so that the compiled callables do not keep it alive.
+    return unet(*args, **kwargs).sample
+
+
+def get_compile_key(value: Any) -> Hashable:
+    """Return the key of the compiled callable that runs the UNet with the indicated inputs."""
+    if isinstance(value, torch.Tensor):
+        return (tuple(value.shape), value.dtype, value.device)
+    if isinstance(value, (list, tuple)):
+        return tuple(get_compile_key(x) for x in value)
+    if isinstance(value, dict):
+        return tuple((k, get_compile_key(v)) for k, v in sorted(value.items()))
+    return value
+
+
+def has_forward_hooks(module: torch.nn.Module) -> bool:
+    """Return true if a module or one of its submodules has forward hooks, which compiled callables do not track."""
+    return any(m._forward_hooks or m._forward_pre_hooks for m in module.modules())
+
+
+class UNetCompiler:
+    """Runs UNet forward passes through compiled callables, cached per UNet and input signature."""
+
+    def __init__(self, mode: UNET_COMPILE_MODE, backend: Union[str, Callable[..., Any]] = "inductor"):
+        """
+        :param mode: The `torch.compile` mode. `reduce-overhead` captures the compiled UNet as CUDA graphs.
+        :param backend: The `torch.compile` backend.
+        """
+        assert mode != "off"
+        self._mode = mode
+        self._backend = backend
+        # guards the dicts below; compilations take the lock of their UNet, so that UNets compile in parallel
+        self._lock = threading.Lock()
+        # unet -> compile key -> compiled callable, or None if the compilation failed
+        self._compiled: weakref.WeakKeyDictionary[torch.nn.Module, dict[Hashable, Optional[Callable[..., Any]]]] = (
+            weakref.WeakKeyDictionary()
+        )
+        self._compile_locks: weakref.WeakKeyDictionary[torch.nn.Module, threading.Lock] = weakref.WeakKeyDictionary()
+        self._logger = InvokeAILogger.get_logger(self.__class__.__name__)
+
+    def supports(self, unet: torch.nn.Module) -> bool:
+        """Return true if the forward passes of a UNet can be compiled, before looking at their inputs."""
+        device = next(unet.parameters()).device
+        return device.type in _COMPILE_DEVICE_TYPES and not has_forward_hooks(unet)
+
+    def compiled_keys(self, unet: torch.nn.Module) -> list[Hashable]:
+        """Return the keys of the callables that were compiled for a UNet."""
+        return [k for k, v in self._compiled.get(unet, {}).items() if v is not None]
+
+    def __call__(
+        self,
+        unet: torch.nn.Module,
+        latents: torch.Tensor,
+        t: torch.Tensor,
+        text_embeddings: torch.Tensor,
+        cross_attention_kwargs: Optional[dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> torch.Tensor:
+        """Run a UNet forward pass and return the predicted noise, compiled if possible and eagerly otherwise."""
+        if cross_attention_kwargs:
+            return _call_unet(unet, latents, t, text_embeddings, cross_attention_kwargs=cross_attention_kwargs, **kwargs)
+
+        key = get_compile_key((latents, t, text_embeddings, kwargs))
+        with self._lock:
+            compiled_by_key = self._compiled.setdefault(unet, {})
+            compile_lock = self._compile_locks.setdefault(unet, threading.Lock())
+        if key not in compiled_by_key:
+            # Each UNet stands for a model on one device, so a long compilation only holds up the sessions of its device
+            with compile_lock:
+                if key not in compiled_by_key:
+                    return self._compile(unet, compiled_by_key, key, latents, t, text_embeddings, **kwargs)
+
+        compiled = compiled_by_key[key]
+        if compiled is None:
+            return _call_unet(unet, latents, t, text_embeddings, **kwargs)
+        return self._run(compiled, unet, latents, t, text_embeddings, **kwargs)
+
+    def _compile(
+        self,
+        unet: torch.nn.Module,
+        compiled_by_key: dict[Hashable, Optional[Callable[..., Any]]],
+        key: Hashable,
+        *args: Any,
+        **kwargs: Any,
+    ) -> torch.Tensor:
+        """Compile a callable for a key by running it, and record the callable, or its failure."""
+        self._logger.info(f"Compiling the UNet for latents of shape {tuple(args[0].shape)}")
+        compiled = torch.compile(_call_unet, mode=self._mode, backend=self._backend, dynamic=False)
+        try:
+            result = self._run(compiled, unet, *args, **kwargs)
+        except Exception as e:
+            self._logger.warning(f"Unable to compile the UNet, running it eagerly: {e}")
+            compiled_by_key[key] = None
+            return _call_unet(unet, *args, **kwargs)
+        compiled_by_key[key] = compiled
+        return result
+
+    def _run(self, compiled: Callable[..., Any], unet: torch.nn.Module, *args: Any, **kwargs: Any) -> torch.Tensor:
+        result = compiled(unet, *args, **kwargs)
+        if self._mode == "reduce-overhead":
+            # the outputs of CUDA graphs are overwritten by their next replay
+            result = result.clone()
+        return result
+
+
+@lru_cache(maxsize=None)
+def get_unet_compiler(mode: UNET_COMPILE_MODE) -> UNetCompiler:
+    """Return the process-wide UNet compiler of a compile mode, so that compiled callables are reused across sessions."""
+    # The compiled callables share the code of `_call_unet`, so the recompilations of dynamo add up over all of the keys
+    # and UNets. Past its default limit of 8, dynamo would silently run the new keys eagerly. The limit is process-wide,
+    # so it is raised here, once the configured `unet_compile_mode` turns compilation on, and not by each compiler.
+    torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, 64)
+    return UNetCompiler(mode)
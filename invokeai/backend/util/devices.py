@@ -1,6 +1,8 @@
 """Torch Device class provides torch device selection services."""
 
-from typing import TYPE_CHECKING, Dict, Literal, Optional, Set, Union
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Dict, Generator, Literal, Optional, Set, Union
 
 import torch
 from deprecated import deprecated
@@ -17,6 +19,11 @@ CPU_DEVICE = torch.device("cpu")
 CUDA_DEVICE = torch.device("cuda")
 MPS_DEVICE = torch.device("mps")
 
+# The execution device reserved for the session running in the current context. Being context-local, the binding is
+# inherited by asyncio tasks, and by threads whose work is run in a copy of the context (`contextvars.copy_context()`),
+# such as thread pool jobs submitted from within a session.
+_execution_device: ContextVar[Optional[torch.device]] = ContextVar("execution_device", default=None)
+
 
 @deprecated("Use TorchDevice.choose_torch_dtype() instead.")  # type: ignore
 def choose_precision(device: torch.device) -> TorchPrecisionNames:
@@ -55,9 +62,26 @@ class TorchDevice:
         """Set the current model cache."""
         cls._model_cache = cache
 
+    @classmethod
+    @contextmanager
+    def bind_execution_device(cls, device: torch.device) -> Generator[None, None, None]:
+        """Bind the execution device for the current context, for the duration of the context manager."""
+        token = _execution_device.set(device)
+        try:
+            yield
+        finally:
+            _execution_device.reset(token)
+
+    @classmethod
+    def bound_execution_device(cls) -> Optional[torch.device]:
+        """Return the execution device bound to the current context, if any."""
+        return _execution_device.get()
+
     @classmethod
     def choose_torch_device(cls) -> torch.device:
         """Return the torch.device to use for accelerated inference."""
+        if (device := _execution_device.get()) is not None:
+            return device
         if cls._model_cache:
             return cls._model_cache.get_execution_device()
         else:
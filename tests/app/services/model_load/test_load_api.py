@@ -1,3 +1,5 @@
+import threading
+import time
 from pathlib import Path
 
 import pytest
@@ -58,6 +60,35 @@ def test_load_from_path(mock_context: InvocationContext, embedding_file: Path) -
     assert torch.equal(loaded_model_1.model["emb_params"], loaded_model_3.model["emb_params"])
 
 
+def test_concurrent_loads_from_path_are_deduplicated(
+    mm2_model_manager: ModelManagerServiceBase, tmp_path: Path
+) -> None:
+    load = mm2_model_manager.load
+    loads = []
+    cached_path = tmp_path / "cached.pt"
+    load.load_model_from_path(cached_path, loader=lambda path: {"cached": torch.ones(1)})
+
+    def slow_loader(path: Path) -> dict:
+        loads.append(path)
+        time.sleep(0.5)
+        return {"slow": torch.ones(1)}
+
+    slow_path = tmp_path / "slow.pt"
+    threads = [
+        threading.Thread(target=load.load_model_from_path, args=(slow_path,), kwargs={"loader": slow_loader})
+        for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+    # a cached model is returned while the slow model is still loading
+    start = time.time()
+    assert "cached" in load.load_model_from_path(cached_path).model
+    assert time.time() - start < 0.5
+    for thread in threads:
+        thread.join()
+    assert loads == [slow_path]
+
+
 @pytest.mark.skip(reason="This requires a test model to load")
 def test_load_from_dir(mock_context: InvocationContext, vae_directory: Path) -> None:
     loaded_model = mock_context.models.load_local_model(vae_directory)
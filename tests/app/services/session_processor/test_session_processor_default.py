@@ -0,0 +1,302 @@
+"""
+Test the scheduling of sessions by the default session processor.
+"""
+
+import time
+from dataclasses import dataclass, field
+from threading import Barrier, Event, Lock, Thread
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, Optional
+
+import pytest
+import torch
+
+from invokeai.app.services.config.config_default import InvokeAIAppConfig, get_config
+from invokeai.app.services.session_processor.session_processor_base import SessionRunnerBase
+from invokeai.app.services.session_processor.session_processor_common import DeviceQuarantinedException
+from invokeai.app.services.session_processor.session_processor_default import (
+    DefaultSessionProcessor,
+    DefaultSessionRunner,
+)
+from invokeai.app.services.shared.graph import Graph
+from invokeai.backend.model_manager.load import ModelCache
+from invokeai.backend.util.logging import InvokeAILogger
+
+
+@dataclass(eq=False)
+class StandInQueueItem:
+    """The parts of a queue item used by the processor."""
+
+    item_id: int
+    batch_id: str = "batch"
+    queue_id: str = "default"
+    status: str = "in_progress"
+    session_id: str = "session"
+    session: SimpleNamespace = field(default_factory=lambda: SimpleNamespace(id="session", graph=Graph()))
+
+
+class StandInSessionQueue:
+    """A session queue holding the indicated number of pending items."""
+
+    def __init__(self, count: int):
+        self._lock = Lock()
+        self.pending = [StandInQueueItem(item_id=i) for i in range(count)]
+        self.claimed: list[StandInQueueItem] = []
+
+    def dequeue(self, batch_id: Optional[str] = None) -> Optional[StandInQueueItem]:
+        with self._lock:
+            if not self.pending:
+                return None
+            item = self.pending.pop(0)
+            self.claimed.append(item)
+            return item
+
+    def requeue_queue_item(self, item_id: int) -> None:
+        with self._lock:
+            item = next(x for x in self.claimed if x.item_id == item_id)
+            self.claimed.remove(item)
+            self.pending.insert(0, item)
+
+    def set_queue_item_session(self, item_id: int, session: SimpleNamespace) -> StandInQueueItem:
+        return next(x for x in self.claimed if x.item_id == item_id)
+
+    def complete_queue_item(self, item_id: int) -> StandInQueueItem:
+        item = next(x for x in self.claimed if x.item_id == item_id)
+        item.status = "completed"
+        return item
+
+
+class StandInSessionRunner(SessionRunnerBase):
+    """Runs each session until it is canceled or released."""
+
+    def __init__(self) -> None:
+        self.release = Event()
+        self.cancel_events: dict[int, Event] = {}
+        # item id and whether it was canceled, in the order the sessions finished
+        self.finished: list[tuple[int, bool]] = []
+
+    def start(self, services, profiler=None) -> None:
+        pass
+
+    def run(self, queue_item, cancel_event: Event) -> None:
+        self.cancel_events[queue_item.item_id] = cancel_event
+        while not cancel_event.is_set() and not self.release.wait(0.01):
+            pass
+        self.finished.append((queue_item.item_id, cancel_event.is_set()))
+
+    def run_node(self, invocation, queue_item, cancel_event: Event) -> None:
+        raise NotImplementedError
+
+
+class StandInFanOutSession:
+    """A session of independent nodes."""
+
+    def __init__(self, node_count: int) -> None:
+        self.ready = [f"node_{i}" for i in range(node_count)]
+        self.node_count = node_count
+        self.completed: list[str] = []
+
+    def is_complete(self) -> bool:
+        return len(self.completed) == self.node_count
+
+
+class FanOutSessionRunner(DefaultSessionRunner):
+    """Runs the nodes of stand-in fan-out sessions, recording the device each node ran on."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.node_devices: dict[str, torch.device] = {}
+
+    def _next_invocation(self, queue_item):
+        with self._process_lock:
+            return queue_item.session.ready.pop(0) if queue_item.session.ready else None
+
+    def run_node(self, invocation, queue_item, cancel_event: Event) -> None:
+        self.node_devices[invocation] = self._services.model_manager.load.ram_cache.get_execution_device()
+        time.sleep(0.05)
+        with self._process_lock:
+            queue_item.session.completed.append(invocation)
+
+
+class StandInProfiler:
+    def __init__(self) -> None:
+        self.profiling: Optional[str] = None
+        self.profiled: list[str] = []
+
+    def start(self, profile_id: str) -> None:
+        self.profiling = profile_id
+
+    def stop(self) -> Path:
+        assert self.profiling is not None
+        self.profiled.append(self.profiling)
+        self.profiling = None
+        return Path("profile.prof")
+
+
+class StandInPerformanceStatistics:
+    def __init__(self) -> None:
+        self.tracked: set[str] = set()
+
+    def dump_stats(self, graph_execution_state_id: str, output_path: Path) -> None:
+        pass
+
+    def log_stats(self, graph_execution_state_id: str) -> None:
+        pass
+
+    def reset_stats(self, graph_execution_state_id: str) -> None:
+        self.tracked.remove(graph_execution_state_id)
+
+
+class QuarantiningSessionRunner(DefaultSessionRunner):
+    """Runs sessions of a single node, whose first run fails as if its device was quarantined, with profiling."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.stand_in_profiler = StandInProfiler()
+        self.runs = 0
+
+    def start(self, services, profiler=None) -> None:
+        super().start(services, profiler=self.stand_in_profiler)  # type: ignore
+
+    def _next_invocation(self, queue_item):
+        return "node" if queue_item.status == "in_progress" else None
+
+    def run_node(self, invocation, queue_item, cancel_event: Event) -> None:
+        self._services.performance_statistics.tracked.add(queue_item.session.id)
+        self.runs += 1
+        if self.runs == 1:
+            raise DeviceQuarantinedException("device lost")
+        queue_item.status = "ran"
+
+    def _is_session_done(self, queue_item, cancel_event: Event) -> bool:
+        return queue_item.status == "ran"
+
+
+def _wait_for(predicate: Callable[[], bool], timeout: float = 5.0) -> None:
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def two_devices():
+    config = get_config()
+    config.devices = ["cuda:0", "cuda:1"]
+    yield
+    config.devices = None
+
+
+def _start_processor(session_queue: StandInSessionQueue, session_runner: SessionRunnerBase) -> DefaultSessionProcessor:
+    services = SimpleNamespace(
+        configuration=InvokeAIAppConfig(use_memory_db=True),
+        logger=InvokeAILogger.get_logger(),
+        session_queue=session_queue,
+        performance_statistics=StandInPerformanceStatistics(),
+        model_manager=SimpleNamespace(load=SimpleNamespace(ram_cache=ModelCache())),
+    )
+    processor = DefaultSessionProcessor(session_runner=session_runner, polling_interval=0.05)  # type: ignore
+    processor.start(SimpleNamespace(services=services))  # type: ignore
+    return processor
+
+
+def test_canceling_an_item_leaves_concurrent_items_running(two_devices):
+    session_queue, session_runner = StandInSessionQueue(2), StandInSessionRunner()
+    processor = _start_processor(session_queue, session_runner)
+    try:
+        _wait_for(lambda: len(session_runner.cancel_events) == 2)
+        processor._cancel_queue_item(0)
+        _wait_for(lambda: len(session_runner.finished) == 1)
+        assert session_runner.finished == [(0, True)]
+        assert not session_runner.cancel_events[1].is_set()
+
+        session_runner.release.set()
+        _wait_for(lambda: len(session_runner.finished) == 2)
+        assert session_runner.finished[1] == (1, False)
+    finally:
+        processor.stop()
+
+
+def test_items_are_claimed_only_when_a_device_is_free(two_devices):
+    session_queue, session_runner = StandInSessionQueue(3), StandInSessionRunner()
+    processor = _start_processor(session_queue, session_runner)
+    try:
+        _wait_for(lambda: len(session_runner.cancel_events) == 2)
+        # both devices are busy, so the third item stays pending through several polling intervals
+        time.sleep(0.3)
+        assert len(session_queue.claimed) == 2
+        assert len(session_queue.pending) == 1
+
+        processor._cancel_queue_item(0)
+        _wait_for(lambda: len(session_runner.cancel_events) == 3)
+        assert not session_queue.pending
+        session_runner.release.set()
+        _wait_for(lambda: len(session_runner.finished) == 3)
+    finally:
+        processor.stop()
+
+
+def test_concurrent_fan_out_sessions_do_not_wait_on_each_others_devices(two_devices):
+    ram_cache = ModelCache()
+    session_runner = FanOutSessionRunner()
+    session_runner.start(
+        services=SimpleNamespace(  # type: ignore
+            configuration=InvokeAIAppConfig(parallel_nodes=True),
+            model_manager=SimpleNamespace(load=SimpleNamespace(ram_cache=ram_cache)),
+        )
+    )
+    queue_items = [StandInQueueItem(item_id=i, session=StandInFanOutSession(4)) for i in range(2)]  # type: ignore
+    # both sessions hold a device before they fan out
+    reserved = Barrier(2)
+
+    def run_session(queue_item: StandInQueueItem) -> None:
+        with ram_cache.reserve_execution_device():
+            reserved.wait()
+            session_runner._run_parallel(queue_item, Event(), max_nodes=2)  # type: ignore
+
+    threads = [Thread(target=run_session, args=(item,), daemon=True) for item in queue_items]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert not any(thread.is_alive() for thread in threads)
+    assert all(item.session.is_complete() for item in queue_items)
+
+
+def test_quarantined_devices_are_not_dispatched_to(two_devices):
+    session_queue, session_runner = StandInSessionQueue(3), StandInSessionRunner()
+    processor = _start_processor(session_queue, session_runner)
+    ram_cache = processor._invoker.services.model_manager.load.ram_cache
+    try:
+        _wait_for(lambda: len(session_runner.cancel_events) == 2)
+        quarantined = ram_cache._device_profiles[torch.device("cuda:0")]
+        quarantined.quarantined, quarantined.quarantined_at = True, time.time()
+        assert processor._dispatch_limit() == 1
+
+        # one session finishing frees a device, but only one device is in service, and the other session still runs
+        processor._cancel_queue_item(0)
+        time.sleep(0.3)
+        assert len(session_queue.claimed) == 2
+
+        processor._cancel_queue_item(1)
+        _wait_for(lambda: len(session_runner.cancel_events) == 3)
+        session_runner.release.set()
+        _wait_for(lambda: len(session_runner.finished) == 3)
+    finally:
+        processor.stop()
+
+
+def test_sessions_requeued_after_a_quarantine_stop_profiling(two_devices):
+    session_queue, session_runner = StandInSessionQueue(1), QuarantiningSessionRunner()
+    processor = _start_processor(session_queue, session_runner)
+    performance_statistics = processor._invoker.services.performance_statistics
+    try:
+        _wait_for(lambda: any(item.status == "completed" for item in session_queue.claimed))
+        assert session_runner.runs == 2
+        # the profile and stats of the quarantined run were closed before the session ran again
+        assert session_runner.stand_in_profiler.profiled == ["session", "session"]
+        assert session_runner.stand_in_profiler.profiling is None
+        assert not performance_statistics.tracked
+    finally:
+        processor.stop()
@@ -0,0 +1,111 @@
+"""
+Test the session worker processes used in the "process" session worker mode.
+"""
+
+import os
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+from invokeai.app.services.config.config_default import InvokeAIAppConfig
+from invokeai.app.services.session_processor.session_processor_common import SessionWorkerException
+from invokeai.app.services.session_processor.session_worker_process import (
+    SessionWorkerInvoker,
+    SessionWorkerProcess,
+    get_worker_config,
+)
+
+
+class StandInService:
+    def __init__(self) -> None:
+        self.started = False
+        self.stopped = False
+
+    def start(self, invoker) -> None:
+        self.started = True
+
+    def stop(self, invoker) -> None:
+        self.stopped = True
+
+
+class MissingItemSessionQueue:
+    def get_queue_item(self, item_id: int) -> None:
+        raise ValueError(f"No queue item {item_id}")
+
+
+def _exiting_services_factory(config, events, logger):
+    os._exit(3)
+
+
+def _missing_item_services_factory(config, events, logger):
+    return SimpleNamespace(
+        configuration=config,
+        logger=logger,
+        session_queue=MissingItemSessionQueue(),
+        model_manager=SimpleNamespace(store=None, load=SimpleNamespace(ram_cache=None)),
+    )
+
+
+def test_worker_processes_share_the_ram_cache_budget():
+    config = InvokeAIAppConfig(ram=12.0, vram=1.0)
+    worker_config = get_worker_config(config, 3)
+    assert worker_config.ram == 4.0
+    assert worker_config.vram == 1.0
+    assert worker_config.root_path == config.root_path
+    assert config.ram == 12.0
+
+
+def test_worker_invoker_leaves_installs_and_downloads_to_the_main_process():
+    store, install, load = StandInService(), StandInService(), StandInService()
+    download_queue, images = StandInService(), StandInService()
+    services = SimpleNamespace(
+        model_manager=SimpleNamespace(store=store, install=install, load=load),
+        download_queue=download_queue,
+        images=images,
+        session_processor=None,
+    )
+    invoker = SessionWorkerInvoker(services)  # type: ignore
+    assert store.started and load.started and images.started
+    assert not install.started and not download_queue.started
+
+    invoker.stop()
+    assert load.stopped and images.stopped
+    assert not install.stopped and not download_queue.stopped
+
+
+@pytest.mark.slow
+def test_dead_worker_process_is_restarted():
+    worker_process = SessionWorkerProcess(
+        device=torch.device("cpu"),
+        config=InvokeAIAppConfig(use_memory_db=True),
+        services_factory=_exiting_services_factory,
+        event_queue=None,  # type: ignore
+    )
+    worker_process.start()
+    first_process = worker_process._process
+    queue_item = SimpleNamespace(item_id=1)
+
+    with pytest.raises(RuntimeError, match="exited with code 3"):
+        worker_process.run(queue_item)  # type: ignore
+    assert worker_process._process is not first_process
+    assert worker_process._process.pid is not None  # the new process was started
+    assert worker_process.item_id is None
+
+
+@pytest.mark.slow
+def test_worker_errors_are_raised_in_the_main_process():
+    worker_process = SessionWorkerProcess(
+        device=torch.device("cpu"),
+        config=InvokeAIAppConfig(use_memory_db=True),
+        services_factory=_missing_item_services_factory,
+        event_queue=None,  # type: ignore
+    )
+    worker_process.start()
+    try:
+        with pytest.raises(SessionWorkerException, match="No queue item 1") as exc_info:
+            worker_process.run(SimpleNamespace(item_id=1))  # type: ignore
+        assert exc_info.value.error_type == "ValueError"
+        assert "get_queue_item" in exc_info.value.error_traceback
+    finally:
+        worker_process.stop()
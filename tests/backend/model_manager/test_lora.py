@@ -100,3 +100,88 @@ def test_apply_lora_change_device():
     # After unpatching, the original model weights should have been restored on the GPU.
     assert model["linear_layer_1"].weight.data.device.type == "cuda"
     torch.testing.assert_close(model["linear_layer_1"].weight.data, orig_linear_weight, check_device=False)
+
+
+def _make_lora(name: str, value: float, in_features: int = 4, out_features: int = 8, dim: int = 2) -> LoRAModelRaw:
+    layer = LoRALayer(
+        layer_key="linear_layer_1",
+        values={
+            "lora_down.weight": torch.full((dim, in_features), value, dtype=torch.float16),
+            "lora_up.weight": torch.ones((out_features, dim), dtype=torch.float16),
+        },
+    )
+    return LoRAModelRaw(name, {"linear_layer_1": layer})
+
+
+@torch.no_grad()
+def test_apply_stacked_loras():
+    """Test that the deltas of stacked LoRAs patching the same module are summed."""
+    model = torch.nn.ModuleDict({"linear_layer_1": torch.nn.Linear(4, 8, dtype=torch.float16)})
+    loras = [(_make_lora("lora_1", 1.0), 0.5), (_make_lora("lora_2", 2.0), 0.25)]
+
+    orig_linear_weight = model["linear_layer_1"].weight.data.detach().clone()
+    expected_patched_linear_weight = orig_linear_weight + 2 * (1.0 * 0.5 + 2.0 * 0.25)
+
+    with ModelPatcher.apply_lora(model, loras, prefix=""):
+        torch.testing.assert_close(model["linear_layer_1"].weight.data, expected_patched_linear_weight)
+
+    torch.testing.assert_close(model["linear_layer_1"].weight.data, orig_linear_weight)
+
+
+@torch.no_grad()
+def test_lora_keys_are_resolved_once(monkeypatch: pytest.MonkeyPatch):
+    """Test that the LoRA's layer keys are resolved against a model class once, and the index reused."""
+    model = torch.nn.ModuleDict({"linear_layer_1": torch.nn.Linear(4, 8, dtype=torch.float16)})
+    lora = _make_lora("lora", 1.0)
+    resolve_lora_key = ModelPatcher._resolve_lora_key
+    calls = []
+
+    def _counting_resolve_lora_key(*args, **kwargs):
+        calls.append(args)
+        return resolve_lora_key(*args, **kwargs)
+
+    monkeypatch.setattr(ModelPatcher, "_resolve_lora_key", staticmethod(_counting_resolve_lora_key))
+    for _ in range(3):
+        with ModelPatcher.apply_lora(model, [(lora, 1.0)], prefix=""):
+            pass
+    assert len(calls) == 1
+    assert lora.key_index[(torch.nn.ModuleDict, "")] == {"linear_layer_1": "linear_layer_1"}
+
+
+@pytest.mark.parametrize(
+    ["module", "values"],
+    [
+        (
+            torch.nn.Linear(4, 8),
+            {"lora_down.weight": torch.randn(2, 4), "lora_up.weight": torch.randn(8, 2), "alpha": torch.tensor(1.0)},
+        ),
+        (
+            torch.nn.Conv2d(4, 8, kernel_size=3, stride=2, padding=1),
+            {"lora_down.weight": torch.randn(2, 4, 3, 3), "lora_up.weight": torch.randn(8, 2, 1, 1)},
+        ),
+        (
+            torch.nn.Conv2d(4, 8, kernel_size=3, padding=1),
+            {
+                "lora_down.weight": torch.randn(2, 4, 1, 1),
+                "lora_mid.weight": torch.randn(2, 2, 3, 3),
+                "lora_up.weight": torch.randn(8, 2, 1, 1),
+            },
+        ),
+    ],
+)
+@torch.no_grad()
+def test_apply_lora_at_runtime(module: torch.nn.Module, values: dict):
+    """Test that LoRAs applied by forward hooks produce the same outputs as merged LoRAs, without changing weights."""
+    model = torch.nn.ModuleDict({"layer": module})
+    loras = [(LoRAModelRaw("lora", {"layer": LoRALayer(layer_key="layer", values=values)}), 0.75)] * 2
+    x = torch.randn(1, 4) if isinstance(module, torch.nn.Linear) else torch.randn(1, 4, 8, 8)
+    orig_weight = module.weight.detach().clone()
+
+    with ModelPatcher.apply_lora(model, loras, prefix=""):
+        expected = model["layer"](x)
+    with ModelPatcher.apply_lora(model, loras, prefix="", runtime=True):
+        assert torch.equal(module.weight, orig_weight)
+        torch.testing.assert_close(model["layer"](x), expected, rtol=1e-4, atol=1e-4)
+
+    assert not module._forward_hooks
+    assert torch.equal(module.weight, orig_weight)
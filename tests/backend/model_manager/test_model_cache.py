@@ -0,0 +1,524 @@
+"""
+Test the RAM/VRAM model cache.
+"""
+
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import pytest
+import torch
+from safetensors.torch import save_file
+
+from invokeai.app.services.config import get_config
+from invokeai.backend.model_manager.load import ModelCache
+from invokeai.backend.model_manager.load.load_base import LoadedModelWithoutConfig
+from invokeai.backend.model_manager.load.model_cache import (
+    GDSFEvictionPolicy,
+    LRUEvictionPolicy,
+    PinUntilIdleEvictionPolicy,
+    model_cache_default,
+)
+from invokeai.backend.model_manager.load.model_cache.model_cache_base import DeviceProfile, ModelCacheRecord
+from invokeai.backend.model_manager.load.model_cache.model_cache_default import GIG
+from invokeai.backend.model_manager.load.model_cache.quantization import quantize_tensor
+from invokeai.backend.model_manager.load.model_util import mmap_safetensors
+from invokeai.backend.util.devices import TorchDevice
+
+
+class DummyModel(torch.nn.Module):
+    """A tiny diffusers-style model that can be rebuilt from its config."""
+
+    def __init__(self, features: int = 8):
+        super().__init__()
+        self.config: Dict[str, Any] = {"features": features}
+        self.linear = torch.nn.Linear(features, features)
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "DummyModel":
+        return cls(**config)
+
+
+def _locked(cache: ModelCache, key: str) -> LoadedModelWithoutConfig:
+    return LoadedModelWithoutConfig(_locker=cache.get(key))
+
+
+@pytest.fixture
+def model_cache() -> ModelCache:
+    config = get_config()
+    config.devices = ["cpu"]
+    # Use a storage device that differs from the execution device so that the VRAM tier is exercised on CPU.
+    cache = ModelCache(max_cache_size=1.0, max_vram_cache_size=1.0, storage_device=torch.device("meta"))
+    yield cache
+    config.devices = None
+
+
+def test_vram_cache_reuses_resident_model(model_cache: ModelCache):
+    model_cache.put("dummy", DummyModel())
+    with model_cache.reserve_execution_device() as device:
+        with _locked(model_cache, "dummy") as model_1:
+            pass
+        with _locked(model_cache, "dummy") as model_2:
+            pass
+    assert model_1 is model_2
+    assert model_cache.vram_cache_size(device) > 0
+
+
+def test_vram_cache_respects_size_limit(model_cache: ModelCache):
+    model_cache.max_vram_cache_size = 0
+    model_cache.put("dummy", DummyModel())
+    with model_cache.reserve_execution_device() as device:
+        with _locked(model_cache, "dummy") as model_1:
+            pass
+        with _locked(model_cache, "dummy") as model_2:
+            pass
+    assert model_1 is not model_2
+    assert model_cache.vram_cache_size(device) == 0
+
+
+def test_vram_cache_evicts_least_recently_used(model_cache: ModelCache):
+    model_cache.put("dummy_1", DummyModel())
+    model_cache.put("dummy_2", DummyModel())
+    size = model_cache.get("dummy_1")._cache_entry.size
+    model_cache.max_vram_cache_size = 1.5 * size / GIG  # room for exactly one model
+    with model_cache.reserve_execution_device() as device:
+        with _locked(model_cache, "dummy_1") as model_1:
+            pass
+        with _locked(model_cache, "dummy_2"):
+            pass
+        assert model_cache.vram_cache_size(device) == size
+        with _locked(model_cache, "dummy_1") as model_1_again:
+            pass
+    assert model_1 is not model_1_again
+
+
+def test_vram_cache_dropped_with_ram_entry(model_cache: ModelCache):
+    model_cache.put("dummy", DummyModel())
+    with model_cache.reserve_execution_device() as device:
+        with _locked(model_cache, "dummy"):
+            pass
+        assert model_cache.vram_cache_size(device) > 0
+        model_cache.make_room(int(model_cache.max_cache_size * GIG))
+        assert model_cache.vram_cache_size(device) == 0
+
+
+def test_prefetch_reserves_the_device_while_copying(model_cache: ModelCache, monkeypatch: pytest.MonkeyPatch):
+    model_cache.put("dummy", DummyModel())
+    reservations = []
+
+    def model_to_device(cache_entry, target_device):
+        reservations.append(model_cache._execution_devices[target_device])
+
+    monkeypatch.setattr(model_cache, "model_to_device", model_to_device)
+    device = model_cache.prefetch_to_vram({"dummy"})
+    assert device == torch.device("cpu")
+    assert reservations == [threading.current_thread().ident]
+    assert model_cache._execution_devices[device] == 0
+
+    # nothing is prefetched to a reserved device
+    with model_cache.reserve_execution_device():
+        assert model_cache.prefetch_to_vram({"dummy"}) is None
+
+
+def test_reserve_prefers_device_holding_models():
+    config = get_config()
+    config.devices = ["cuda:0", "cuda:1"]
+    cache = ModelCache()
+    warm_device = torch.device("cuda:1")
+    cache._vram_cache[warm_device]["main:unet"] = ModelCacheRecord(key="main:unet", size=1, model=None)
+    with cache.reserve_execution_device(model_keys={"main"}) as device:
+        assert device == warm_device
+    with cache.reserve_execution_device(model_keys={"other"}) as device:
+        assert device == torch.device("cuda:0")  # least loaded
+    config.devices = None
+
+
+def test_reserve_prefers_device_that_fits_then_fastest():
+    config = get_config()
+    config.devices = ["cuda:0", "cuda:1"]
+    cache = ModelCache()
+    small, large = torch.device("cuda:0"), torch.device("cuda:1")
+    cache._device_profiles[small].total_memory = cache._device_profiles[small].free_memory = 2 * GIG
+    cache._device_profiles[large].total_memory = cache._device_profiles[large].free_memory = 8 * GIG
+    cache._device_profiles[small].throughput = 2.0
+    cache._device_profiles[large].throughput = 1.0
+    with cache.reserve_execution_device(required_memory=4 * GIG) as device:
+        assert device == large
+    with cache.reserve_execution_device(required_memory=GIG) as device:
+        assert device == small  # faster
+    config.devices = None
+
+
+def test_devices_of_unknown_throughput_rank_as_average():
+    config = get_config()
+    config.devices = ["cuda:0", "cuda:1", "cuda:2"]
+    cache = ModelCache()
+    slow, unknown, fast = torch.device("cuda:0"), torch.device("cuda:1"), torch.device("cuda:2")
+    cache._device_profiles[slow].throughput = 1.0
+    cache._device_profiles[fast].throughput = 3.0
+    assert cache._choose_free_device([slow, unknown, fast], set()) == fast
+    assert cache._choose_free_device([slow, unknown], set()) == unknown
+    config.devices = None
+
+
+def test_devices_are_benchmarked_the_first_time_they_are_ranked(monkeypatch: pytest.MonkeyPatch):
+    benchmarked: list[torch.device] = []
+    monkeypatch.setattr(DeviceProfile, "benchmark", lambda self: benchmarked.append(self.device))
+    config = get_config()
+    config.devices = ["cuda:0", "cuda:1"]
+    cache = ModelCache()
+    assert benchmarked == []
+    devices = [torch.device("cuda:0"), torch.device("cuda:1")]
+    cache._choose_free_device(devices[:1], set())
+    assert benchmarked == []  # a single free device is not ranked
+    cache._choose_free_device(devices, set())
+    cache._choose_free_device(devices, set())
+    assert sorted(benchmarked, key=str) == devices
+    config.devices = None
+
+
+def test_estimate_model_footprint(model_cache: ModelCache):
+    model_cache.put("main:unet", DummyModel())
+    model_cache.put("main:vae", DummyModel())
+    model_cache.put("other", DummyModel())
+    size = model_cache.get("other")._cache_entry.size
+    assert model_cache.estimate_model_footprint({"main"}) == 2 * size
+    assert model_cache.estimate_model_footprint({"other", "missing"}) == size
+
+
+def test_device_quarantined_after_repeated_errors():
+    config = get_config()
+    config.devices = ["cuda:0", "cuda:1"]
+    cache = ModelCache(device_error_threshold=2)
+    flaky = torch.device("cuda:0")
+    error = RuntimeError("CUDA error: an illegal memory access was encountered")
+    with TorchDevice.bind_execution_device(flaky):
+        assert not cache.record_device_error(ValueError("not a device error"))
+        assert not cache.record_device_error(error)
+        cache.record_device_success()
+        assert not cache.record_device_error(error)
+        assert cache.record_device_error(error)
+    assert cache.device_profiles[flaky].quarantined
+
+    # the last device in service is never quarantined
+    with TorchDevice.bind_execution_device(torch.device("cuda:1")):
+        for _ in range(3):
+            assert not cache.record_device_error(error)
+
+    with cache.reserve_execution_device() as device:
+        assert device == torch.device("cuda:1")
+    config.devices = None
+
+
+def test_out_of_memory_errors_do_not_quarantine_devices():
+    config = get_config()
+    config.devices = ["cuda:0", "cuda:1"]
+    cache = ModelCache(device_error_threshold=2)
+    device = torch.device("cuda:0")
+    with TorchDevice.bind_execution_device(device):
+        for _ in range(3):
+            assert not cache.record_device_error(torch.cuda.OutOfMemoryError("out of memory"))
+    assert not cache.device_profiles[device].quarantined
+    assert cache.device_profiles[device].last_oom is not None
+    config.devices = None
+
+
+def test_quarantined_device_returns_to_service_after_cooldown():
+    config = get_config()
+    config.devices = ["cuda:0", "cuda:1"]
+    cache = ModelCache(device_error_threshold=1, device_quarantine_cooldown=60)
+    flaky = torch.device("cuda:0")
+    with TorchDevice.bind_execution_device(flaky):
+        assert cache.record_device_error(RuntimeError("CUDA error: unspecified launch failure"))
+
+    cache.poll_device_health()
+    assert cache.device_profiles[flaky].quarantined  # still cooling down
+
+    cache._device_profiles[flaky].quarantined_at -= 60
+    cache.poll_device_health()
+    assert not cache.device_profiles[flaky].quarantined
+    assert cache.device_profiles[flaky].errors == 0
+    config.devices = None
+
+
+def test_pinned_memory_falls_back_without_cuda():
+    config = get_config()
+    config.devices = ["cpu"]
+    cache = ModelCache(max_pinned_cache_size=1.0, storage_device=torch.device("meta"))
+    cache.put("dummy", DummyModel())
+    assert not cache.get("dummy")._cache_entry.pinned
+    assert cache.pinned_cache_size == 0
+    with cache.reserve_execution_device():
+        with _locked(cache, "dummy") as model:
+            assert model.linear.weight.device == torch.device("cpu")
+    config.devices = None
+
+
+def test_cache_size_tracks_puts_and_evictions(model_cache: ModelCache):
+    model_cache.put("dummy_1", DummyModel())
+    size = model_cache.cache_size()
+    assert size > 0
+    model_cache.put("dummy_2", DummyModel())
+    assert model_cache.cache_size() == 2 * size
+    model_cache.max_cache_size = 2.5 * size / GIG  # room for two models
+    model_cache.put("dummy_3", DummyModel())
+    assert model_cache.cache_size() == 2 * size
+    assert not model_cache.exists("dummy_1")  # least recently used
+
+
+def test_make_room_evicts_only_what_is_needed(model_cache: ModelCache):
+    for i in range(4):
+        model_cache.put(f"dummy_{i}", DummyModel())
+    size = model_cache.get("dummy_0")._cache_entry.size  # dummy_0 is now the most recently used
+    model_cache.max_cache_size = 4 * size / GIG
+    model_cache.make_room(2 * size)
+    assert [model_cache.exists(f"dummy_{i}") for i in range(4)] == [True, False, False, True]
+    assert model_cache.cache_size() == 2 * size
+
+
+def test_lru_policy_orders_by_recency():
+    policy = LRUEvictionPolicy()
+    records = {k: ModelCacheRecord(key=k, size=1, model=None) for k in ("a", "b", "c")}
+    for record in records.values():
+        policy.touch(record)
+    policy.touch(records["a"])
+    assert list(policy.victims(records)) == ["b", "c", "a"]
+    policy.remove("c")
+    assert list(policy.victims(records)) == ["b", "a"]
+
+
+def test_gdsf_policy_prefers_evicting_large_rarely_used_models():
+    policy = GDSFEvictionPolicy()
+    records = {
+        "lora": ModelCacheRecord(key="lora", size=1, model=None),
+        "unet": ModelCacheRecord(key="unet", size=100, model=None),
+        "vae": ModelCacheRecord(key="vae", size=10, model=None),
+    }
+    for record in records.values():
+        policy.touch(record)
+    assert list(policy.victims(records)) == ["unet", "vae", "lora"]
+    for _ in range(20):
+        policy.touch(records["unet"])
+    assert list(policy.victims(records)) == ["vae", "unet", "lora"]
+
+
+def test_pin_until_idle_policy_skips_locked_models():
+    policy = PinUntilIdleEvictionPolicy()
+    records = {k: ModelCacheRecord(key=k, size=1, model=None) for k in ("a", "b")}
+    for record in records.values():
+        policy.touch(record)
+    records["a"].locks = 1
+    assert list(policy.victims(records)) == ["b"]
+
+
+def test_locked_models_are_pinned_until_idle():
+    config = get_config()
+    config.devices = ["cpu"]
+    cache = ModelCache(
+        max_cache_size=1.0, storage_device=torch.device("meta"), eviction_policy=PinUntilIdleEvictionPolicy()
+    )
+    cache.put("dummy_1", DummyModel())
+    cache.put("dummy_2", DummyModel())
+    with cache.reserve_execution_device():
+        with _locked(cache, "dummy_1"):
+            assert cache.get("dummy_1")._cache_entry.locks == 1
+            cache.make_room(int(cache.max_cache_size * GIG))
+            assert cache.exists("dummy_1")
+            assert not cache.exists("dummy_2")
+    assert cache.get("dummy_1")._cache_entry.locks == 0
+    config.devices = None
+
+
+def test_concurrent_locks_are_counted_exactly(model_cache: ModelCache):
+    model_cache.put("dummy", DummyModel())
+    cache_entry = model_cache.get("dummy")._cache_entry
+
+    def lock_and_unlock() -> None:
+        for _ in range(1000):
+            model_cache.lock_entry(cache_entry)
+            model_cache.unlock_entry(cache_entry)
+
+    threads = [threading.Thread(target=lock_and_unlock) for _ in range(8)]
+    model_cache.lock_entry(cache_entry)
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache_entry.locks == 1
+    model_cache.unlock_entry(cache_entry)
+    assert cache_entry.locks == 0
+
+
+def test_patched_models_are_reused(model_cache: ModelCache):
+    model_cache.put("dummy", DummyModel())
+    size = model_cache.get("dummy")._cache_entry.size
+    model_cache.max_vram_cache_size = 0
+    model_cache._max_patched_cache_size = 1.5 * size / GIG  # room for one patched copy
+    patches = []
+
+    @contextmanager
+    def patch(state_dict: Optional[Dict[str, torch.Tensor]], model: DummyModel):
+        patches.append(model)
+        with torch.no_grad():
+            model.linear.bias += 1
+        yield
+        with torch.no_grad():
+            model.linear.bias -= 1
+
+    with model_cache.reserve_execution_device():
+        with _locked(model_cache, "dummy").patched_model_on_device("lora_a", patch) as (_, model_1):
+            bias = model_1.linear.bias.clone()
+        with _locked(model_cache, "dummy").patched_model_on_device("lora_a", patch) as (_, model_2):
+            assert torch.equal(model_2.linear.bias, bias)
+        assert len(patches) == 1
+        with _locked(model_cache, "dummy").patched_model_on_device("lora_b", patch):
+            pass
+        with _locked(model_cache, "dummy").patched_model_on_device("lora_a", patch):
+            pass  # evicted by lora_b
+        with _locked(model_cache, "dummy").patched_model_on_device(None, patch):
+            pass
+    assert len(patches) == 4
+    assert model_2 is not model_1  # the cached copy, not the patched model itself
+
+
+def test_patched_models_give_way_under_memory_pressure(model_cache: ModelCache):
+    model_cache.put("dummy", DummyModel())
+    entry = model_cache.get("dummy")._cache_entry
+    model_cache._max_patched_cache_size = 1.0
+    device = torch.device("cpu")
+    # CPU devices do not report their memory, so the profile stands in for a device that does
+    profile = model_cache._device_profiles[device]
+    profile.total_memory, profile.free_memory = 10 * entry.size, entry.size - 1
+
+    # too little memory is free to copy the patched model
+    model_cache.put_patched(entry, "lora", device, DummyModel())
+    assert not model_cache._patched_cache[device]
+
+    profile.free_memory = entry.size
+    model_cache.put_patched(entry, "lora", device, DummyModel())
+    assert ("dummy", "lora") in model_cache._patched_cache[device]
+    # the patched copy may be evicted to fit a session
+    profile.free_memory = 0
+    with model_cache._device_lock:
+        assert model_cache._fits(device, entry.size)
+
+    # and is evicted when a model needs its memory
+    model_cache.model_to_device(entry, device)
+    assert not model_cache._patched_cache[device]
+
+
+def test_mmap_safetensors(tmp_path: Path):
+    tensors = {"a": torch.arange(6, dtype=torch.float16).reshape(2, 3), "b": torch.ones(4, dtype=torch.int64)}
+    save_file(tensors, tmp_path / "weights.safetensors")
+    mapped = mmap_safetensors([tmp_path / "weights.safetensors"])
+    assert mapped.keys() == tensors.keys()
+    for k, v in tensors.items():
+        assert torch.equal(mapped[k], v)
+
+
+def test_mmapped_weights_do_not_count_against_cache_size(tmp_path: Path):
+    config = get_config()
+    config.devices = ["cpu"]
+    cache = ModelCache(max_cache_size=1.0, mmap_weights=True, storage_device=torch.device("meta"))
+    model = DummyModel()
+    save_file(model.state_dict(), tmp_path / "model.safetensors")
+    save_file({"other": torch.zeros(1)}, tmp_path / "other.safetensors")
+
+    cache.put("mapped", model, weight_files=[tmp_path / "model.safetensors"])
+    cache.put("mismatched", DummyModel(), weight_files=[tmp_path / "other.safetensors"])
+    assert cache.get("mapped")._cache_entry.mmapped
+    assert not cache.get("mismatched")._cache_entry.mmapped
+    assert cache.cache_size() == cache.get("mismatched")._cache_entry.size
+
+    with cache.reserve_execution_device():
+        with _locked(cache, "mapped") as loaded:
+            assert torch.equal(loaded.linear.weight, model.linear.weight.to(loaded.linear.weight.dtype))
+    config.devices = None
+
+
+def test_models_built_without_weights_are_mapped_from_their_weight_files(tmp_path: Path):
+    config = get_config()
+    config.devices = ["cpu"]
+    cache = ModelCache(max_cache_size=1.0, mmap_weights=True, storage_device=torch.device("meta"))
+    model = DummyModel()
+    save_file(model.state_dict(), tmp_path / "model.safetensors")
+    save_file({"other": torch.zeros(1)}, tmp_path / "other.safetensors")
+    with torch.device("meta"):
+        skeleton = DummyModel()
+
+    assert not cache.put_mmapped("mismatched", skeleton, [tmp_path / "other.safetensors"])
+    assert not cache.exists("mismatched")
+    assert cache.put_mmapped("mapped", skeleton, [tmp_path / "model.safetensors"])
+    entry = cache.get("mapped")._cache_entry
+    assert entry.mmapped and entry.size == sum(v.nbytes for v in model.state_dict().values())
+    assert cache.cache_size() == 0
+
+    with cache.reserve_execution_device():
+        with _locked(cache, "mapped") as loaded:
+            assert torch.equal(loaded.linear.weight, model.linear.weight.to(loaded.linear.weight.dtype))
+    config.devices = None
+
+
+@pytest.mark.parametrize("quantization", ["int8", "fp8"])
+def test_quantize_tensor(quantization: str):
+    tensor = (torch.randn(8, 16) * torch.logspace(-3, 1, 8)[:, None]).to(torch.float16)
+    tensor[3] = 0
+    quantized = quantize_tensor(tensor, quantization)
+    assert quantized.data.element_size() == 1
+    restored = quantized.dequantize(torch.device("cpu"))
+    assert restored.dtype == torch.float16
+    # the error is relative to each channel's largest value
+    absmax = tensor.abs().amax(dim=1, keepdim=True).float()
+    assert ((restored.float() - tensor.float()).abs() <= absmax * 0.07 + 1e-6).all()
+    assert torch.equal(restored[3], tensor[3])
+
+
+def test_cold_models_are_quantized_before_eviction():
+    config = get_config()
+    config.devices = ["cpu"]
+    cache = ModelCache(max_cache_size=1.0, storage_device=torch.device("meta"), quantization="int8")
+    cache.put("dummy_1", DummyModel(features=64))
+    size = cache.cache_size()
+    cache.put("dummy_2", DummyModel(features=64))
+    cache.max_cache_size = 1.8 * size / GIG  # room for one model and a quantized one
+    cache.make_room(0)
+    entry_1 = cache.get("dummy_1")._cache_entry
+    assert entry_1.quantized_size is not None and entry_1.quantized_size < size * 0.6
+    assert cache.get("dummy_2")._cache_entry.quantized_size is None
+    assert cache.cache_size() == size + entry_1.quantized_size
+
+    with cache.reserve_execution_device():
+        loaded = LoadedModelWithoutConfig(_locker=cache.get("dummy_1"))
+        with loaded.model_on_device() as (state_dict, model):
+            assert state_dict is None  # LoRAs must unpatch from the model's own weights
+            assert model.linear.weight.dtype == torch.float16
+
+    # dummy_2 is now the least recently used: it is quantized, but that is not enough, so it is evicted
+    cache.max_cache_size = 0.5 * size / GIG
+    cache.make_room(0)
+    assert not cache.exists("dummy_2")
+    assert cache.cache_size() == entry_1.quantized_size
+    config.devices = None
+
+
+def test_models_are_quantized_without_holding_the_ram_lock(monkeypatch: pytest.MonkeyPatch):
+    config = get_config()
+    config.devices = ["cpu"]
+    cache = ModelCache(max_cache_size=1.0, storage_device=torch.device("meta"), quantization="int8")
+    cache.put("dummy_1", DummyModel(features=64))
+    size = cache.cache_size()
+    lock_held = []
+    quantize = model_cache_default.quantize_state_dict
+
+    def quantize_state_dict(state_dict, quantization):
+        lock_held.append(cache._ram_lock.locked())
+        return quantize(state_dict, quantization)
+
+    monkeypatch.setattr(model_cache_default, "quantize_state_dict", quantize_state_dict)
+    cache.put("dummy_2", DummyModel(features=64))
+    cache.max_cache_size = 1.8 * size / GIG
+    cache.make_room(0)
+    assert lock_held == [False]
+    assert cache.get("dummy_1")._cache_entry.quantized_size is not None
+    config.devices = None
@@ -0,0 +1,124 @@
+"""
+Micro-benchmarks of the RAM model cache.
+
+A session may use hundreds of small models such as LoRAs and textual inversions. Cache hits and size accounting must
+cost the same no matter how many models are cached. The quantized storage tier must fit more models in the same RAM
+budget, at a bounded cost when they are moved to an execution device. These tests are slow and timing-sensitive, so
+they are disabled by default. Run them with `pytest -m slow -s tests/backend/model_manager/test_model_cache_benchmark.py`.
+"""
+
+import time
+from typing import Callable
+
+import pytest
+import torch
+
+from invokeai.app.services.config import get_config
+from invokeai.backend.model_manager.load import ModelCache
+from invokeai.backend.model_manager.load.model_cache import EVICTION_POLICIES
+from invokeai.backend.model_manager.load.model_cache.model_cache_default import GIG
+
+HITS = 5000
+# The per-hit cost with many cached models may be at most this many times the cost with few, to allow for timing noise
+MAX_SLOWDOWN = 3.0
+
+
+class StandInModel:
+    """Stands in for a small model that is cached as-is, such as a LoRA or a textual inversion."""
+
+
+class StandInNetwork(torch.nn.Module):
+    """Stands in for a large model that is cached as a state dict, such as a UNet."""
+
+    def __init__(self, features: int = 1024, layers: int = 8):
+        super().__init__()
+        self.config = {"features": features, "layers": layers}
+        self.layers = torch.nn.Sequential(*[torch.nn.Linear(features, features) for _ in range(layers)]).half()
+
+    @classmethod
+    def from_config(cls, config: dict) -> "StandInNetwork":
+        return cls(**config)
+
+
+def _make_cache(policy: str, num_models: int) -> ModelCache:
+    cache = ModelCache(
+        max_cache_size=1.0, storage_device=torch.device("meta"), eviction_policy=EVICTION_POLICIES[policy]()
+    )
+    for i in range(num_models):
+        cache.put(f"lora_{i}", StandInModel())
+    return cache
+
+
+def _time_per_call(fn: Callable[[int], object], calls: int = HITS) -> float:
+    start = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    return (time.perf_counter() - start) / calls
+
+
+@pytest.fixture(autouse=True)
+def cpu_only():
+    config = get_config()
+    config.devices = ["cpu"]
+    yield
+    config.devices = None
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("policy", list(EVICTION_POLICIES))
+def test_cache_hit_cost_is_flat(policy: str):
+    per_hit = {}
+    for num_models in (10, 800):
+        cache = _make_cache(policy, num_models)
+        per_hit[num_models] = _time_per_call(lambda i, c=cache, n=num_models: c.get(f"lora_{i % n}"))
+    assert per_hit[800] <= per_hit[10] * MAX_SLOWDOWN, (
+        f"{policy}: {per_hit[10] * 1e6:.2f} us/hit with 10 models, {per_hit[800] * 1e6:.2f} us/hit with 800 models"
+    )
+
+
+@pytest.mark.slow
+def test_cache_size_cost_is_flat():
+    per_call = {}
+    for num_models in (10, 800):
+        cache = _make_cache("lru", num_models)
+        per_call[num_models] = _time_per_call(lambda i, c=cache: c.cache_size())
+    assert per_call[800] <= per_call[10] * MAX_SLOWDOWN
+
+
+@pytest.mark.slow
+def test_quantized_tier_fits_more_models():
+    caches = {
+        quantization: ModelCache(max_cache_size=1.0, storage_device=torch.device("meta"), quantization=quantization)
+        for quantization in (None, "int8", "fp8")
+    }
+    cached_models = {}
+    for quantization, cache in caches.items():
+        for i in range(10):
+            cache.put(f"model_{i}", StandInNetwork())
+        size = cache.get("model_9")._cache_entry.size
+        cache.max_cache_size = 4 * size / GIG  # room for four fp16 models
+        cache.make_room(0)
+        cached_models[quantization] = sum(cache.exists(f"model_{i}") for i in range(10))
+    assert cached_models[None] == 4, f"models cached in the room of four: {cached_models}"
+    assert cached_models["int8"] >= 7, f"models cached in the room of four: {cached_models}"
+    assert cached_models["fp8"] >= 7, f"models cached in the room of four: {cached_models}"
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("quantization", ["int8", "fp8"])
+def test_quantized_tier_reload_penalty(quantization: str):
+    reload_time = {}
+    for q in (None, quantization):
+        cache = ModelCache(
+            max_cache_size=1.0, max_vram_cache_size=0, storage_device=torch.device("meta"), quantization=q
+        )
+        cache.put("model", StandInNetwork())
+        if q is not None:
+            cache.max_cache_size = 0.6 * cache.cache_size() / GIG  # forces the model to be quantized
+            cache.make_room(0)
+        entry = cache.get("model")._cache_entry
+        reload_time[q] = _time_per_call(lambda i, c=cache, e=entry: c.model_to_device(e, torch.device("cpu")), calls=10)
+    assert reload_time[quantization] <= reload_time[None] * 10, (
+        f"{quantization}: {reload_time[None] * 1e3:.1f} ms per reload unquantized,"
+        f" {reload_time[quantization] * 1e3:.1f} ms quantized"
+    )
@@ -71,3 +71,17 @@ def test_skip_torch_weight_init_restores_base_class_behavior():
     torch.nn.modules.conv._ConvNd.reset_parameters = saved_fn
 
     assert called_monkey_patched_fn
+
+
+def test_skip_torch_weight_init_overlapping_use():
+    """Test that the original behavior is restored when `skip_torch_weight_init()` is used by several threads at once,
+    and they do not leave it in the order in which they entered it.
+    """
+    reset_params_fn_before = torch.nn.Linear.reset_parameters
+    first, second = skip_torch_weight_init(), skip_torch_weight_init()
+    first.__enter__()
+    second.__enter__()
+    first.__exit__(None, None, None)
+    assert torch.nn.Linear.reset_parameters == _no_op  # still in use
+    second.__exit__(None, None, None)
+    assert torch.nn.Linear.reset_parameters is reset_params_fn_before
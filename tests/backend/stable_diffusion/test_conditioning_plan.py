@@ -0,0 +1,74 @@
+import torch
+
+from invokeai.backend.stable_diffusion.diffusion.conditioning_data import (
+    Range,
+    SDXLConditioningInfo,
+    TextConditioningData,
+    TextConditioningRegions,
+)
+from invokeai.backend.stable_diffusion.diffusion.conditioning_plan import ConditioningPlan
+from invokeai.backend.stable_diffusion.diffusion.shared_invokeai_diffusion import InvokeAIDiffuserComponent
+
+
+def _sdxl_conditioning(seq_len: int, fill: float) -> SDXLConditioningInfo:
+    return SDXLConditioningInfo(
+        embeds=torch.full((1, seq_len, 8), fill),
+        pooled_embeds=torch.full((1, 4), fill),
+        add_time_ids=torch.full((1, 6), fill),
+    )
+
+
+def _conditioning_data(cond_regions=None) -> TextConditioningData:
+    return TextConditioningData(
+        uncond_text=_sdxl_conditioning(77, 0.0),
+        cond_text=_sdxl_conditioning(154, 1.0),
+        uncond_regions=None,
+        cond_regions=cond_regions,
+        guidance_scale=7.5,
+    )
+
+
+def test_plan_concatenates_the_guidance_batch():
+    plan = ConditioningPlan(_conditioning_data(), None, 8, 8, device=torch.device("cpu"), dtype=torch.float32)
+
+    # the shorter unconditioned embeddings are padded with zeros, and the padding is masked out
+    assert plan.both.embeds.shape == (2, 154, 8)
+    assert torch.equal(plan.both.embeds[0, 77:], torch.zeros(77, 8))
+    assert plan.both.encoder_attention_mask is not None
+    assert plan.both.encoder_attention_mask.sum(dim=1).tolist() == [77, 154]
+    assert plan.both.added_cond_kwargs is not None
+    assert plan.both.added_cond_kwargs["text_embeds"].tolist() == [[0.0] * 4, [1.0] * 4]
+    assert plan.both.added_cond_kwargs["time_ids"].shape == (2, 6)
+    assert plan.both.cross_attention_kwargs(None, 0, 10) == {}
+
+    # the sequential passes use the embeddings as they are
+    assert plan.cond.embeds.shape == (1, 154, 8)
+    assert plan.cond.encoder_attention_mask is None
+    assert plan.uncond.added_cond_kwargs is not None
+    assert plan.uncond.added_cond_kwargs["time_ids"].shape == (1, 6)
+
+
+def test_plan_prepares_regional_prompts_once():
+    regions = TextConditioningRegions(masks=torch.ones((1, 1, 8, 8)), ranges=[Range(start=0, end=154)])
+    plan = ConditioningPlan(_conditioning_data(regions), None, 8, 8, device=torch.device("cpu"), dtype=torch.float32)
+
+    assert plan.uncond.regional_prompt_data is None
+    kwargs = plan.both.cross_attention_kwargs(None, 5, 10)
+    assert kwargs["regional_prompt_data"] is plan.both.regional_prompt_data
+    assert kwargs["percent_through"] == 0.5
+    assert plan.cond.cross_attention_kwargs(None, 6, 10)["regional_prompt_data"] is plan.cond.regional_prompt_data
+
+
+def test_component_reuses_the_plan_of_the_run():
+    conditioning_data = _conditioning_data()
+    component = InvokeAIDiffuserComponent(None, lambda *args, **kwargs: None)
+    sample = torch.zeros((1, 4, 8, 8))
+
+    plan = component._get_conditioning_plan(conditioning_data, None, sample)
+    assert conditioning_data.plan is plan
+    assert component._get_conditioning_plan(conditioning_data, None, sample) is plan
+
+    # a plan made for other latents is replaced
+    other_plan = component._get_conditioning_plan(conditioning_data, None, torch.zeros((1, 4, 16, 16)))
+    assert other_plan is not plan
+    assert other_plan.latent_size == (16, 16)
@@ -0,0 +1,74 @@
+from contextvars import copy_context
+from threading import Thread
+from typing import Callable
+
+from invokeai.backend.stable_diffusion.denoise_coalescer import DenoiseCoalescer
+
+
+def _run_members(coalescer: DenoiseCoalescer, members: list[Callable[[], None]]) -> None:
+    def _member(fn: Callable[[], None]) -> None:
+        with coalescer.member():
+            assert DenoiseCoalescer.current() is coalescer
+            fn()
+
+    threads = [Thread(target=copy_context().run, args=(_member, fn)) for fn in members]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+        assert not thread.is_alive()
+
+
+def test_coalescer_batches_requests_with_equal_keys():
+    batches: list[list[int]] = []
+    results: dict[int, int] = {}
+
+    def run_batch(requests: list[int]) -> list[int]:
+        batches.append(sorted(requests))
+        return [r * 10 for r in requests]
+
+    def member(request: int, key: str) -> Callable[[], None]:
+        def _fn() -> None:
+            results[request] = coalescer.run(key, request, run_batch)
+
+        return _fn
+
+    coalescer = DenoiseCoalescer(3)
+    _run_members(coalescer, [member(1, "a"), member(2, "a"), member(3, "b")])
+
+    assert results == {1: 10, 2: 20, 3: 30}
+    assert sorted(batches) == [[1, 2], [3]]
+
+
+def test_coalescer_does_not_wait_for_finished_members():
+    batches: list[list[int]] = []
+
+    def run_batch(requests: list[int]) -> list[int]:
+        batches.append(requests)
+        return requests
+
+    coalescer = DenoiseCoalescer(2)
+    _run_members(coalescer, [lambda: coalescer.run("a", 1, run_batch), lambda: None])
+
+    assert batches == [[1]]
+
+
+def test_coalescer_returns_exceptions_to_their_requests():
+    errors: list[Exception] = []
+
+    def run_batch(requests: list[int]) -> list[object]:
+        return [ValueError(r) if r == 2 else r for r in requests]
+
+    def member(request: int) -> Callable[[], None]:
+        def _fn() -> None:
+            try:
+                coalescer.run("a", request, run_batch)
+            except ValueError as e:
+                errors.append(e)
+
+        return _fn
+
+    coalescer = DenoiseCoalescer(2)
+    _run_members(coalescer, [member(1), member(2)])
+
+    assert [e.args for e in errors] == [(2,)]
@@ -0,0 +1,90 @@
+from typing import Optional
+
+import torch
+
+from invokeai.backend.stable_diffusion.diffusion.conditioning_data import BasicConditioningInfo, TextConditioningData
+from invokeai.backend.stable_diffusion.diffusion.shared_invokeai_diffusion import InvokeAIDiffuserComponent
+
+
+def _conditioning_data(truncate_after: float = 1.0, truncate_similarity: Optional[float] = None):
+    return TextConditioningData(
+        uncond_text=BasicConditioningInfo(embeds=torch.zeros(1, 77, 8)),
+        cond_text=BasicConditioningInfo(embeds=torch.ones(1, 77, 8)),
+        uncond_regions=None,
+        cond_regions=None,
+        guidance_scale=7.5,
+        guidance_truncate_after=truncate_after,
+        guidance_truncate_similarity=truncate_similarity,
+    )
+
+
+def _run_steps(
+    conditioning_data: TextConditioningData, total_step_count: int, uncond_offset: float
+) -> tuple[InvokeAIDiffuserComponent, list[int]]:
+    """Run the UNet steps of a denoising run, and return the component and the batch size of each UNet pass."""
+    batch_sizes: list[int] = []
+
+    def forward(x: torch.Tensor, sigma: torch.Tensor, embeds: torch.Tensor, **kwargs) -> torch.Tensor:
+        batch_sizes.append(x.shape[0])
+        # the prediction of the unconditioned pass is offset from that of the conditioned pass
+        return x + (1 - embeds[:, :1, :1, None]) * uncond_offset
+
+    component = InvokeAIDiffuserComponent(None, forward)
+    component.sequential_guidance = False
+    sample = torch.ones(1, 4, 8, 8)
+    for step_index in range(total_step_count):
+        uncond, cond = component.do_unet_step(
+            sample=sample,
+            timestep=torch.tensor([1.0]),
+            conditioning_data=conditioning_data,
+            ip_adapter_data=None,
+            step_index=step_index,
+            total_step_count=total_step_count,
+        )
+        assert torch.equal(cond, sample)
+    return component, batch_sizes
+
+
+def test_guidance_is_not_truncated_by_default():
+    component, batch_sizes = _run_steps(_conditioning_data(), 10, uncond_offset=0.0)
+    assert batch_sizes == [2] * 10
+    assert (component.unet_passes, component.skipped_unet_passes) == (20, 0)
+
+
+def test_guidance_is_truncated_after_a_fraction_of_the_steps():
+    component, batch_sizes = _run_steps(_conditioning_data(truncate_after=0.6), 10, uncond_offset=1.0)
+    assert batch_sizes == [2] * 6 + [1] * 4
+    assert (component.unet_passes, component.skipped_unet_passes) == (16, 4)
+
+
+def test_guidance_is_truncated_once_the_predictions_converge():
+    # the predictions of the two passes are identical, so they converge at the first step
+    component, batch_sizes = _run_steps(_conditioning_data(truncate_similarity=0.99), 5, uncond_offset=0.0)
+    assert batch_sizes == [2] + [1] * 4
+    assert component.skipped_unet_passes == 4
+
+    # predictions that differ do not converge
+    component, batch_sizes = _run_steps(_conditioning_data(truncate_similarity=0.99), 5, uncond_offset=-1.0)
+    assert batch_sizes == [2] * 5
+
+
+def test_sequential_guidance_passes_are_told_apart_after_truncation():
+    guidance_branches: list[str] = []
+
+    def forward(x: torch.Tensor, sigma: torch.Tensor, embeds: torch.Tensor, **kwargs) -> torch.Tensor:
+        guidance_branches.append(kwargs["guidance_branch"])
+        return x
+
+    component = InvokeAIDiffuserComponent(None, forward)
+    component.sequential_guidance = True
+    for step_index in range(4):
+        component.do_unet_step(
+            sample=torch.ones(1, 4, 8, 8),
+            timestep=torch.tensor([1.0]),
+            conditioning_data=_conditioning_data(truncate_after=0.5),
+            ip_adapter_data=None,
+            step_index=step_index,
+            total_step_count=4,
+        )
+    # the first pass of the truncated steps is the conditioned one, so that the UNet feature cache keeps them apart
+    assert guidance_branches == ["uncond", "cond", "uncond", "cond", "cond", "cond"]
@@ -0,0 +1,108 @@
+import torch
+from diffusers.models import UNet2DConditionModel
+from diffusers.models.attention_processor import Attention
+
+from invokeai.backend.stable_diffusion.diffusion.custom_atttention import CustomAttnProcessor2_0
+from invokeai.backend.stable_diffusion.diffusion.token_merging import (
+    TokenMergingSettings,
+    ToMeAttnProcessor2_0,
+    bipartite_soft_matching_2d,
+)
+from invokeai.backend.stable_diffusion.diffusion.unet_attention_patcher import UNetAttentionPatcher
+
+
+def test_grids_are_found_at_each_resolution_level():
+    token_merging = TokenMergingSettings(ratios=[0.5, 0.25], latent_height=13, latent_width=10)
+    assert token_merging.get_level(13 * 10) == (0, 13, 10)
+    assert token_merging.get_level(7 * 5) == (1, 7, 5)
+    assert token_merging.get_level(4 * 3) == (2, 4, 3)
+    assert token_merging.get_level(77) is None
+
+    assert token_merging.get_merge_count(13 * 10) == (65, 13, 10)
+    assert token_merging.get_merge_count(7 * 5) == (8, 7, 5)
+    # the levels past the end of the ratios are not merged
+    assert token_merging.get_merge_count(4 * 3)[0] == 0
+
+
+def test_merged_tokens_are_unmerged_to_their_positions():
+    # each 2x2 window of the grid holds identical tokens, and the odd row at the bottom holds other tokens
+    torch.manual_seed(0)
+    h, w = 5, 6
+    windows = torch.randn(2, 2, 3, 8)
+    grid = windows.repeat_interleave(2, dim=1).repeat_interleave(2, dim=2)
+    grid = torch.cat([grid, torch.randn(2, 1, w, 8)], dim=1)
+    x = grid.reshape(2, h * w, 8)
+
+    # there are 6 destination tokens, and 18 source tokens in the windows
+    merge, unmerge = bipartite_soft_matching_2d(x, h, w, r=18)
+    merged = merge(x)
+    assert merged.shape == (2, h * w - 18, 8)
+    assert torch.allclose(unmerge(merged), x, atol=1e-6)
+
+    merge, unmerge = bipartite_soft_matching_2d(x, h, w, r=0)
+    assert merge(x) is x
+
+
+@torch.inference_mode()
+def test_merging_processor_runs_attention_on_merged_tokens():
+    torch.manual_seed(0)
+    attn = Attention(query_dim=8, heads=2, dim_head=4).eval()
+    hidden_states = torch.randn(2, 8 * 8, 8)
+    expected = CustomAttnProcessor2_0()(attn, hidden_states)
+
+    seq_lens: list[int] = []
+    attn.to_q.register_forward_hook(lambda module, args, output: seq_lens.append(args[0].shape[1]))
+
+    no_merging = ToMeAttnProcessor2_0(TokenMergingSettings(ratios=[0.0], latent_height=8, latent_width=8))
+    assert torch.allclose(no_merging(attn, hidden_states), expected, atol=1e-6)
+
+    merging = ToMeAttnProcessor2_0(TokenMergingSettings(ratios=[0.5], latent_height=8, latent_width=8))
+    output = merging(attn, hidden_states)
+    assert output.shape == hidden_states.shape
+    assert seq_lens == [64, 32]
+
+    # cross-attention is not merged
+    merging(attn, hidden_states, encoder_hidden_states=torch.randn(2, 7, 8))
+    assert seq_lens[-1] == 64
+
+
+def test_patcher_merges_self_attention_only():
+    unet = UNet2DConditionModel(
+        sample_size=16,
+        block_out_channels=(8, 16),
+        layers_per_block=1,
+        down_block_types=("CrossAttnDownBlock2D", "DownBlock2D"),
+        up_block_types=("UpBlock2D", "CrossAttnUpBlock2D"),
+        cross_attention_dim=8,
+        attention_head_dim=2,
+        norm_num_groups=4,
+    )
+    token_merging = TokenMergingSettings(ratios=[0.5], latent_height=16, latent_width=16)
+    patcher = UNetAttentionPatcher(None, token_merging)
+    with patcher.apply_ip_adapter_attention(unet):
+        for name, processor in unet.attn_processors.items():
+            assert isinstance(processor, ToMeAttnProcessor2_0) == name.endswith("attn1.processor")
+    assert not any(isinstance(processor, ToMeAttnProcessor2_0) for processor in unet.attn_processors.values())
+
+
+def test_patcher_keeps_the_other_processors_when_only_merging_tokens():
+    unet = UNet2DConditionModel(
+        sample_size=16,
+        block_out_channels=(8, 16),
+        layers_per_block=1,
+        down_block_types=("CrossAttnDownBlock2D", "DownBlock2D"),
+        up_block_types=("UpBlock2D", "CrossAttnUpBlock2D"),
+        cross_attention_dim=8,
+        attention_head_dim=2,
+        norm_num_groups=4,
+    )
+    unet.set_attention_slice(1)
+    sliced_processors = unet.attn_processors
+    token_merging = TokenMergingSettings(ratios=[0.5], latent_height=16, latent_width=16)
+    patcher = UNetAttentionPatcher(None, token_merging, keep_other_processors=True)
+    with patcher.apply_ip_adapter_attention(unet):
+        for name, processor in unet.attn_processors.items():
+            if name.endswith("attn1.processor"):
+                assert isinstance(processor, ToMeAttnProcessor2_0)
+            else:
+                assert processor is sliced_processors[name]
@@ -0,0 +1,141 @@
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+import pytest
+import torch
+
+from invokeai.backend.stable_diffusion.unet_compiler import UNetCompiler, get_unet_compiler
+
+
+@dataclass
+class StandInUNetOutput:
+    sample: torch.Tensor
+
+
+class StandInUNet(torch.nn.Module):
+    """A module with the call signature of a UNet."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.conv = torch.nn.Conv2d(4, 4, kernel_size=3, padding=1)
+        self.proj = torch.nn.Linear(8, 4)
+
+    def forward(
+        self,
+        sample: torch.Tensor,
+        timestep: torch.Tensor,
+        encoder_hidden_states: torch.Tensor,
+        cross_attention_kwargs: Optional[dict] = None,
+        mid_block_additional_residual: Optional[torch.Tensor] = None,
+    ) -> StandInUNetOutput:
+        x = self.conv(sample) + self.proj(encoder_hidden_states.mean(dim=1))[:, :, None, None]
+        if mid_block_additional_residual is not None:
+            x = x + mid_block_additional_residual
+        return StandInUNetOutput(sample=x * timestep[:, None, None, None])
+
+
+def _inputs(batch_size: int, size: int) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    return torch.randn(batch_size, 4, size, size), torch.full((batch_size,), 0.5), torch.randn(batch_size, 77, 8)
+
+
+@torch.inference_mode()
+def test_compiled_unet_is_cached_per_input_signature():
+    unet = StandInUNet()
+    compiler = UNetCompiler("default", backend="eager")
+
+    latents, t, embeds = _inputs(2, 8)
+    assert torch.allclose(compiler(unet, latents, t, embeds), unet(latents, t, embeds).sample)
+    compiler(unet, *_inputs(2, 8))
+    assert len(compiler.compiled_keys(unet)) == 1
+
+    # the sequential guidance mode, another latent size and a ControlNet residual each need their own callable
+    compiler(unet, *_inputs(1, 8))
+    compiler(unet, *_inputs(2, 16))
+    compiler(unet, *_inputs(2, 8), mid_block_additional_residual=torch.zeros(2, 4, 8, 8))
+    assert len(compiler.compiled_keys(unet)) == 4
+
+    # the callables of a UNet are not used for another UNet
+    assert compiler.compiled_keys(StandInUNet()) == []
+
+
+def test_unets_compile_without_waiting_for_each_other(monkeypatch: pytest.MonkeyPatch):
+    slow_unet, fast_unet = StandInUNet(), StandInUNet()
+    compiler = UNetCompiler("default", backend="eager")
+    compiling, release = threading.Event(), threading.Event()
+    compile = compiler._compile
+
+    def _compile(unet, *args, **kwargs):
+        if unet is slow_unet:
+            compiling.set()
+            release.wait(10)
+        return compile(unet, *args, **kwargs)
+
+    monkeypatch.setattr(compiler, "_compile", _compile)
+
+    def run_slow_unet() -> None:
+        with torch.inference_mode():
+            compiler(slow_unet, *_inputs(2, 8))
+
+    thread = threading.Thread(target=run_slow_unet, daemon=True)
+    thread.start()
+    try:
+        assert compiling.wait(10)
+        with torch.inference_mode():
+            compiler(fast_unet, *_inputs(2, 8))
+        assert len(compiler.compiled_keys(fast_unet)) == 1
+        assert thread.is_alive()
+    finally:
+        release.set()
+        thread.join(10)
+    assert len(compiler.compiled_keys(slow_unet)) == 1
+
+
+@torch.inference_mode()
+def test_unsupported_passes_run_eagerly():
+    unet = StandInUNet()
+    compiler = UNetCompiler("default", backend="eager")
+
+    compiler(unet, *_inputs(2, 8), cross_attention_kwargs={"percent_through": 0.5})
+    assert compiler.compiled_keys(unet) == []
+
+    assert compiler.supports(unet)
+    handle = unet.proj.register_forward_hook(lambda module, args, output: output)
+    assert not compiler.supports(unet)
+    handle.remove()
+
+
+@torch.inference_mode()
+def test_failed_compilation_falls_back_to_eager():
+    def failing_backend(graph_module, example_inputs):
+        raise RuntimeError("unsupported")
+
+    unet = StandInUNet()
+    compiler = UNetCompiler("default", backend=failing_backend)
+
+    latents, t, embeds = _inputs(2, 8)
+    for _ in range(2):
+        assert torch.allclose(compiler(unet, latents, t, embeds), unet(latents, t, embeds).sample)
+    assert compiler.compiled_keys(unet) == []
+
+
+def test_dynamo_cache_size_limit_is_raised_only_when_compilation_is_configured(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(torch._dynamo.config, "cache_size_limit", 8)
+    UNetCompiler("default", backend="eager")
+    assert torch._dynamo.config.cache_size_limit == 8
+
+    get_unet_compiler.cache_clear()
+    get_unet_compiler("default")
+    get_unet_compiler.cache_clear()
+    assert torch._dynamo.config.cache_size_limit == 64
+
+
+@pytest.mark.slow
+@torch.inference_mode()
+def test_unet_compiles_on_cpu():
+    unet = StandInUNet()
+    compiler = UNetCompiler("default")
+
+    latents, t, embeds = _inputs(2, 8)
+    assert torch.allclose(compiler(unet, latents, t, embeds), unet(latents, t, embeds).sample, atol=1e-5)
+    assert len(compiler.compiled_keys(unet)) == 1
@@ -0,0 +1,105 @@
+import torch
+from diffusers.models import UNet2DConditionModel
+
+from invokeai.backend.stable_diffusion.diffusion.unet_feature_cache import UNetFeatureCache
+
+
+def _tiny_unet() -> UNet2DConditionModel:
+    torch.manual_seed(0)
+    return UNet2DConditionModel(
+        sample_size=16,
+        block_out_channels=(8, 16, 16),
+        layers_per_block=1,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "CrossAttnUpBlock2D", "UpBlock2D"),
+        cross_attention_dim=8,
+        attention_head_dim=2,
+        norm_num_groups=4,
+    ).eval()
+
+
+def _count_calls(module: torch.nn.Module) -> list[int]:
+    calls = [0]
+    forward = module.forward
+
+    def _forward(*args, **kwargs):
+        calls[0] += 1
+        return forward(*args, **kwargs)
+
+    module.forward = _forward
+    return calls
+
+
+@torch.inference_mode()
+def test_deep_features_are_reused_between_full_steps():
+    unet = _tiny_unet()
+    mid_block_calls = _count_calls(unet.mid_block)
+    counting_forward = unet.mid_block.forward
+    sample, timestep, embeds = torch.randn(2, 4, 16, 16), torch.tensor([10, 10]), torch.randn(2, 7, 8)
+    expected = unet(sample, timestep, embeds).sample
+
+    feature_cache = UNetFeatureCache(unet, interval=2)
+    outputs = []
+    with feature_cache.apply():
+        for step_index in range(4):
+            feature_cache.begin_step(step_index)
+            feature_cache.begin_call(sample)
+            outputs.append(unet(sample, timestep, embeds).sample)
+
+    # the deep blocks run at steps 0 and 2 only; with the same inputs, the reused features are those of a full step
+    assert mid_block_calls[0] == 1 + 2
+    assert (feature_cache.full_calls, feature_cache.reused_calls) == (2, 2)
+    for output in outputs:
+        assert torch.allclose(output, expected, atol=1e-6)
+
+    # the original forwards are restored
+    assert unet.mid_block.forward is counting_forward
+    assert "forward" not in unet.up_blocks[0].__dict__
+
+
+@torch.inference_mode()
+def test_calls_are_cached_separately():
+    unet = _tiny_unet()
+    mid_block_calls = _count_calls(unet.mid_block)
+    timestep, embeds = torch.tensor([10]), torch.randn(1, 7, 8)
+
+    feature_cache = UNetFeatureCache(unet, interval=3)
+    with feature_cache.apply():
+        feature_cache.begin_step(0)
+        # two calls per step, as with sequential guidance
+        for _ in range(2):
+            feature_cache.begin_call(torch.zeros(1, 4, 16, 16))
+            unet(torch.zeros(1, 4, 16, 16), timestep, embeds)
+        feature_cache.begin_step(1)
+        feature_cache.begin_call(torch.zeros(1, 4, 16, 16))
+        unet(torch.zeros(1, 4, 16, 16), timestep, embeds)
+        # latents of another shape than those of the cached call run the full UNet
+        feature_cache.begin_call(torch.zeros(2, 4, 16, 16))
+        unet(torch.zeros(2, 4, 16, 16), torch.tensor([10, 10]), torch.randn(2, 7, 8))
+
+    assert mid_block_calls[0] == 3
+    assert (feature_cache.full_calls, feature_cache.reused_calls) == (3, 1)
+
+
+@torch.inference_mode()
+def test_guidance_branches_are_cached_separately():
+    unet = _tiny_unet()
+    sample, timestep = torch.randn(1, 4, 16, 16), torch.tensor([10])
+    uncond_embeds, cond_embeds = torch.zeros(1, 7, 8), torch.randn(1, 7, 8)
+    expected = unet(sample, timestep, cond_embeds).sample
+
+    feature_cache = UNetFeatureCache(unet, interval=3)
+    with feature_cache.apply():
+        # sequential guidance, then truncated guidance, which runs the conditioned pass alone
+        feature_cache.begin_step(0)
+        feature_cache.begin_call(sample, "uncond")
+        unet(sample, timestep, uncond_embeds)
+        feature_cache.begin_call(sample, "cond")
+        unet(sample, timestep, cond_embeds)
+        feature_cache.begin_step(1)
+        feature_cache.begin_call(sample, "cond")
+        output = unet(sample, timestep, cond_embeds).sample
+
+    # the conditioned pass reused the conditioned features, not those of the first call of the step
+    assert (feature_cache.full_calls, feature_cache.reused_calls) == (2, 1)
+    assert torch.allclose(output, expected, atol=1e-6)
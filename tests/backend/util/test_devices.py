@@ -2,6 +2,8 @@
 Test abstract device class.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from unittest.mock import patch
 
 import pytest
@@ -162,3 +164,14 @@ def test_multi_device_support_3():
     with cache.reserve_execution_device() as gpu:
         assert gpu in [torch.device(x) for x in config.devices]
         assert TorchDevice.choose_torch_device() == gpu
+
+
+def test_execution_device_inherited_by_thread_pool():
+    config = get_config()
+    config.devices = ["cuda:0", "cuda:1"]
+    cache = ModelCache()
+    with cache.reserve_execution_device() as gpu:
+        assert TorchDevice.bound_execution_device() == gpu
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            assert executor.submit(copy_context().run, TorchDevice.choose_torch_device).result() == gpu
+    assert TorchDevice.bound_execution_device() is None
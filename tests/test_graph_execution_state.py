@@ -222,3 +222,30 @@ def test_graph_iterate_execution_order(execution_number: int):
     _ = invoke_next(g)
     assert _[1].item == "Dinosaur Sushi"
     _ = invoke_next(g)
+
+
+def test_graph_state_hands_out_independent_nodes_concurrently():
+    """Tests that nodes returned by next() are not returned again before completion, so independent nodes can run at once"""
+    graph = Graph()
+    graph.add_node(PromptTestInvocation(id="a", prompt="Banana sushi"))
+    graph.add_node(PromptTestInvocation(id="b", prompt="Cat sushi"))
+    graph.add_node(CollectInvocation(id="c"))
+    graph.add_edge(create_edge("a", "prompt", "c", "item"))
+    graph.add_edge(create_edge("b", "prompt", "c", "item"))
+
+    g = GraphExecutionState(graph=graph)
+    n1 = g.next()
+    n2 = g.next()
+    assert n1 is not None and n2 is not None
+    assert {g.prepared_source_mapping[n1.id], g.prepared_source_mapping[n2.id]} == {"a", "b"}
+    assert g.next() is None  # the collector must wait for both
+    assert g.is_executing()
+
+    g.complete(n2.id, n2.invoke(Mock(InvocationContext)))
+    assert g.next() is None
+    g.complete(n1.id, n1.invoke(Mock(InvocationContext)))
+    assert not g.is_executing()
+
+    n3 = g.next()
+    assert isinstance(n3, CollectInvocation)
+    assert sorted(n3.collection) == ["Banana sushi", "Cat sushi"]
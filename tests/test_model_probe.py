@@ -3,8 +3,9 @@ from pathlib import Path
 import pytest
 from torch import tensor
 
-from invokeai.backend.model_manager import BaseModelType, ModelRepoVariant
+from invokeai.backend.model_manager import BaseModelType, ModelRepoVariant, SubModelType
 from invokeai.backend.model_manager.config import InvalidModelConfigException, MainDiffusersConfig, ModelVariantType
+from invokeai.backend.model_manager.load.model_util import get_recorded_model_size
 from invokeai.backend.model_manager.probe import (
     CkptType,
     ModelProbe,
@@ -86,3 +87,14 @@ def test_probe_sd1_diffusers_inpainting(datadir: Path):
     assert config.base is BaseModelType.StableDiffusion1
     assert config.variant is ModelVariantType.Inpaint
     assert config.repo_variant is ModelRepoVariant.FP16
+
+
+def test_probe_records_model_sizes(datadir: Path):
+    model_path = datadir / "sd-1/main/dreamshaper-8-inpainting"
+    config = ModelProbe.probe(model_path)
+    unet_size = (model_path / "unet/diffusion_pytorch_model.fp16.safetensors").stat().st_size
+    assert config.submodel_sizes == {SubModelType.UNet: unet_size, SubModelType.Scheduler: 0}
+    assert config.size == unet_size
+    assert get_recorded_model_size(config) == unet_size
+    assert get_recorded_model_size(config, SubModelType.UNet) == unet_size
+    assert get_recorded_model_size(config, SubModelType.VAE) is None
@@ -1,6 +1,12 @@
 import pytest
 from pydantic import TypeAdapter, ValidationError
 
+from invokeai.app.invocations.model import (
+    LoRALoaderInvocation,
+    MainModelLoaderInvocation,
+    ModelIdentifierField,
+    UNetField,
+)
 from invokeai.app.services.session_queue.session_queue_common import (
     Batch,
     BatchDataCollection,
@@ -8,9 +14,12 @@ from invokeai.app.services.session_queue.session_queue_common import (
     NodeFieldValue,
     calc_session_count,
     create_session_nfv_tuples,
+    get_model_identifiers,
+    get_model_keys,
     prepare_values_to_insert,
 )
 from invokeai.app.services.shared.graph import Graph, GraphExecutionState
+from invokeai.backend.model_manager.config import BaseModelType, ModelType, SubModelType
 
 from .test_nodes import PromptTestInvocation
 
@@ -231,3 +240,37 @@ def test_cannot_create_bad_batch_fields_exist(
                 ],
             ],
         )
+
+
+def _model_identifier(key: str, type: ModelType, submodel_type=None) -> ModelIdentifierField:
+    return ModelIdentifierField(
+        key=key, hash=key, name=key, base=BaseModelType.StableDiffusion1, type=type, submodel_type=submodel_type
+    )
+
+
+def test_get_model_keys(batch_graph):
+    batch_graph.add_node(MainModelLoaderInvocation(id="5", model=_model_identifier("main", ModelType.Main)))
+    unet = UNetField(
+        unet=_model_identifier("main", ModelType.Main, SubModelType.UNet),
+        scheduler=_model_identifier("main", ModelType.Main, SubModelType.Scheduler),
+        loras=[],
+    )
+    batch_graph.add_node(LoRALoaderInvocation(id="6", lora=_model_identifier("lora", ModelType.LoRA), unet=unet))
+    assert get_model_keys(batch_graph) == {"main", "lora"}
+
+
+def test_get_model_identifiers(batch_graph):
+    batch_graph.add_node(MainModelLoaderInvocation(id="5", model=_model_identifier("main", ModelType.Main)))
+    unet = UNetField(
+        unet=_model_identifier("main", ModelType.Main, SubModelType.UNet),
+        scheduler=_model_identifier("main", ModelType.Main, SubModelType.Scheduler),
+        loras=[],
+    )
+    batch_graph.add_node(LoRALoaderInvocation(id="6", lora=_model_identifier("lora", ModelType.LoRA), unet=unet))
+    identifiers = [(x.key, x.submodel_type) for x in get_model_identifiers(batch_graph)]
+    assert identifiers == [
+        ("main", None),
+        ("lora", None),
+        ("main", SubModelType.UNet),
+        ("main", SubModelType.Scheduler),
+    ]